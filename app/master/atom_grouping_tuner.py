@@ -0,0 +1,265 @@
+import json
+import os
+
+from app.master.time_based_atom_grouper import TimeBasedAtomGrouper
+from app.util import analytics, log
+from app.util.exceptions import ItemNotReadyError
+import app.util.fs
+
+
+class AtomGroupingTuner(object):
+    """
+    Tunes the parameters that the TimeBasedAtomGrouper uses to group a job's atoms (the fraction of the work that goes
+    into 'big chunk' subjobs and the number of 'small chunk' subjobs per executor), based on how the job's previous
+    builds ended. The tuned parameters are stored in a file next to the job's timing file.
+
+    The tail idle time of a build is the executor time that was wasted at the end of the build: for each executor, the
+    time from its last result until the build's last result. Jobs whose atom times vary a lot end with a large tail
+    since their big chunks finish unevenly; those jobs need more of their work in small chunks to even out the ends. For
+    jobs with predictable atom times the small chunks only add overhead. So after each build:
+        - if the tail idle time was more than TAIL_IDLE_TARGET of the executor time, a smaller fraction of the work is
+          put in big chunks and more small chunks are created
+        - if it was less than half of TAIL_IDLE_TARGET, a larger fraction of the work is put in big chunks and fewer
+          small chunks are created
+
+    The tuner also measures the fixed costs that each subjob pays on top of running its atoms (sending it to a slave,
+    creating the atom artifact directories, compressing and uploading the results) from how long each subjob took
+    between being sent and its results being received. These costs are modeled as a cost per subjob plus a cost per
+    atom, and are averaged over builds so the grouper can weigh them (see TimeBasedAtomGrouper).
+    """
+    TAIL_IDLE_TARGET = 0.05
+    BIG_CHUNK_FRACTION_STEP = 0.05
+    MIN_BIG_CHUNK_FRACTION, MAX_BIG_CHUNK_FRACTION = 0.5, 0.95
+    MIN_SMALL_SUBJOBS_PER_EXECUTOR, MAX_SMALL_SUBJOBS_PER_EXECUTOR = 1, 8
+    OVERHEAD_WEIGHT = 0.5  # the weight of the newest build's measured overheads in their moving average
+
+    def __init__(self, timing_file_path):
+        """
+        :param timing_file_path: the path of the timing file of the job to tune the grouping of. Until the job has been
+            tuned, its parameters are the TimeBasedAtomGrouper defaults.
+        :type timing_file_path: str
+        """
+        self._logger = log.get_logger(__name__)
+        self._parameters_file_path = grouping_parameters_file_path(timing_file_path)
+        self.big_chunk_fraction = TimeBasedAtomGrouper.BIG_CHUNK_FRACTION
+        self.small_subjobs_per_executor = TimeBasedAtomGrouper.SMALL_SUBJOBS_PER_EXECUTOR
+        self.subjob_overhead = None  # the seconds each subjob costs on top of its atoms, or None if not measured yet
+        self.atom_overhead = None  # the seconds each atom costs on top of its own time, or None if not measured yet
+        self._load_parameters()
+
+    def tune(self, build_id, since_timestamp=None, subjob_work=None):
+        """
+        Adjust the parameters based on the tail idle time and subjob overheads of a finished build, and store them.
+
+        :type build_id: int
+        :param since_timestamp: the time the build started, to limit the analytics events that are searched
+        :type since_timestamp: float | None
+        :param subjob_work: the number of atoms and the total time of the atoms of each subjob of the build, by subjob
+            id, or None to not measure the subjob overheads
+        :type subjob_work: dict[int, (int, float)] | None
+        :return: whether the parameters were changed
+        :rtype: bool
+        """
+        parameters_changed = self._tune_chunk_sizes(build_id, since_timestamp)
+        if subjob_work:
+            parameters_changed = self._update_overheads(build_id, since_timestamp, subjob_work) or parameters_changed
+        if parameters_changed:
+            app.util.fs.write_file(json.dumps({
+                'big_chunk_fraction': self.big_chunk_fraction,
+                'small_subjobs_per_executor': self.small_subjobs_per_executor,
+                'subjob_overhead': self.subjob_overhead,
+                'atom_overhead': self.atom_overhead,
+            }), self._parameters_file_path)
+        return parameters_changed
+
+    def _tune_chunk_sizes(self, build_id, since_timestamp):
+        """
+        :type build_id: int
+        :type since_timestamp: float | None
+        :return: whether the big chunk fraction or the number of small subjobs per executor were changed
+        :rtype: bool
+        """
+        tail_idle_fraction = build_tail_idle_fraction(build_id, since_timestamp)
+        if tail_idle_fraction is None:
+            return False
+
+        if tail_idle_fraction > self.TAIL_IDLE_TARGET:
+            big_chunk_fraction = self.big_chunk_fraction - self.BIG_CHUNK_FRACTION_STEP
+            small_subjobs_per_executor = self.small_subjobs_per_executor + 1
+        elif tail_idle_fraction < self.TAIL_IDLE_TARGET / 2:
+            big_chunk_fraction = self.big_chunk_fraction + self.BIG_CHUNK_FRACTION_STEP
+            small_subjobs_per_executor = self.small_subjobs_per_executor - 1
+        else:
+            return False
+
+        big_chunk_fraction = round(min(max(big_chunk_fraction, self.MIN_BIG_CHUNK_FRACTION),
+                                       self.MAX_BIG_CHUNK_FRACTION), 2)
+        small_subjobs_per_executor = min(max(small_subjobs_per_executor, self.MIN_SMALL_SUBJOBS_PER_EXECUTOR),
+                                         self.MAX_SMALL_SUBJOBS_PER_EXECUTOR)
+        if (big_chunk_fraction, small_subjobs_per_executor) == (self.big_chunk_fraction,
+                                                                self.small_subjobs_per_executor):
+            return False
+
+        self._logger.info('Build {} had {:.1%} tail idle time. Grouping future builds with a big chunk fraction of {} '
+                          'and {} small subjobs per executor.', build_id, tail_idle_fraction, big_chunk_fraction,
+                          small_subjobs_per_executor)
+        self.big_chunk_fraction = big_chunk_fraction
+        self.small_subjobs_per_executor = small_subjobs_per_executor
+        return True
+
+    def _update_overheads(self, build_id, since_timestamp, subjob_work):
+        """
+        :type build_id: int
+        :type since_timestamp: float | None
+        :type subjob_work: dict[int, (int, float)]
+        :return: whether the subjob or atom overhead were changed
+        :rtype: bool
+        """
+        overheads = build_subjob_overheads(build_id, subjob_work, since_timestamp)
+        if overheads is None:
+            return False
+
+        updated_overheads = []
+        for current_overhead, measured_overhead in zip((self.subjob_overhead, self.atom_overhead), overheads):
+            if current_overhead is not None:
+                measured_overhead = current_overhead + self.OVERHEAD_WEIGHT * (measured_overhead - current_overhead)
+            updated_overheads.append(round(measured_overhead, 3))
+        subjob_overhead, atom_overhead = updated_overheads
+        if (subjob_overhead, atom_overhead) == (self.subjob_overhead, self.atom_overhead):
+            return False
+
+        self._logger.info('Build {} had {:.3f}s of overhead per subjob and {:.3f}s per atom.', build_id, *overheads)
+        self.subjob_overhead = subjob_overhead
+        self.atom_overhead = atom_overhead
+        return True
+
+    def _load_parameters(self):
+        if not os.path.isfile(self._parameters_file_path):
+            return
+        try:
+            with open(self._parameters_file_path) as parameters_file:
+                parameters = json.load(parameters_file)
+            self.big_chunk_fraction = float(parameters['big_chunk_fraction'])
+            self.small_subjobs_per_executor = int(parameters['small_subjobs_per_executor'])
+            if parameters.get('subjob_overhead') is not None:
+                self.subjob_overhead = float(parameters['subjob_overhead'])
+                self.atom_overhead = float(parameters['atom_overhead'])
+        except (ValueError, KeyError, TypeError):
+            self._logger.warning('Failed to load grouping parameters from file that exists {}',
+                                 self._parameters_file_path)
+
+
+def grouping_parameters_file_path(timing_file_path):
+    """
+    :type timing_file_path: str
+    :return: the path of the file that the tuned grouping parameters of the timing file's job are stored in
+    :rtype: str
+    """
+    timing_file_root, _ = os.path.splitext(timing_file_path)
+    if timing_file_root.endswith('.timing'):
+        timing_file_root = timing_file_root[:-len('.timing')]
+    return timing_file_root + '.grouping.json'
+
+
+def build_tail_idle_fraction(build_id, since_timestamp=None):
+    """
+    Calculate the fraction of executor time that was wasted at the end of a build from the analytics events the master
+    recorded when it sent the build's subjobs to slaves and received their results.
+
+    :type build_id: int
+    :param since_timestamp: the time the build started, to limit the analytics events that are searched
+    :type since_timestamp: float | None
+    :return: the tail idle time as a fraction of the executor time the build used, or None if there are not enough
+        events to tell (e.g., because the event log is disabled or the build ran on a single executor)
+    :rtype: float | None
+    """
+    events = _build_events(build_id, since_timestamp)
+    if events is None:
+        return None
+
+    start_time, end_time = None, None
+    last_result_times_by_executor = {}
+    for event in events:
+        timestamp = event['__timestamp__']
+        if event['__tag__'] == analytics.MASTER_TRIGGERED_SUBJOB:
+            start_time = timestamp if start_time is None else min(start_time, timestamp)
+        elif event['__tag__'] == analytics.MASTER_RECEIVED_RESULT:
+            executor = event.get('slave_id'), event.get('executor_id')
+            last_result_times_by_executor[executor] = max(last_result_times_by_executor.get(executor, 0), timestamp)
+            end_time = timestamp if end_time is None else max(end_time, timestamp)
+
+    if start_time is None or end_time is None or end_time <= start_time or len(last_result_times_by_executor) < 2:
+        return None
+    tail_idle_time = sum(end_time - last_result_time for last_result_time in last_result_times_by_executor.values())
+    return tail_idle_time / (len(last_result_times_by_executor) * (end_time - start_time))
+
+
+def build_subjob_overheads(build_id, subjob_work, since_timestamp=None):
+    """
+    Estimate the fixed costs of the subjobs of a build. The overhead of a subjob is the time between the master sending
+    it to a slave and receiving its results, minus the time its atoms took. The overheads are fit (by least squares) to
+    a cost per subjob plus a cost per atom.
+
+    Subjobs that were sent to slaves more than once (e.g., because they were requeued or executed speculatively) are
+    left out since their times cannot be told apart.
+
+    :type build_id: int
+    :param subjob_work: the number of atoms and the total time of the atoms of each subjob, by subjob id
+    :type subjob_work: dict[int, (int, float)]
+    :param since_timestamp: the time the build started, to limit the analytics events that are searched
+    :type since_timestamp: float | None
+    :return: the overhead in seconds per subjob and per atom, or None if there are not enough events to tell
+    :rtype: (float, float) | None
+    """
+    events = _build_events(build_id, since_timestamp)
+    if events is None:
+        return None
+
+    trigger_times_by_subjob, result_times_by_subjob = {}, {}
+    for event in events:
+        if event['__tag__'] == analytics.MASTER_TRIGGERED_SUBJOB:
+            trigger_times_by_subjob.setdefault(event.get('subjob_id'), []).append(event['__timestamp__'])
+        elif event['__tag__'] == analytics.MASTER_RECEIVED_RESULT:
+            result_times_by_subjob.setdefault(event.get('subjob_id'), []).append(event['__timestamp__'])
+
+    samples = []  # (number of atoms, overhead) of each subjob
+    for subjob_id, (num_atoms, atom_time) in subjob_work.items():
+        trigger_times = trigger_times_by_subjob.get(subjob_id, [])
+        result_times = result_times_by_subjob.get(subjob_id, [])
+        if len(trigger_times) != 1 or len(result_times) != 1:
+            continue
+        samples.append((num_atoms, max(result_times[0] - trigger_times[0] - atom_time, 0.0)))
+    if len(samples) < 2:
+        return None
+
+    mean_num_atoms = sum(num_atoms for num_atoms, _ in samples) / len(samples)
+    mean_overhead = sum(overhead for _, overhead in samples) / len(samples)
+    num_atoms_variation = sum((num_atoms - mean_num_atoms) ** 2 for num_atoms, _ in samples)
+    if num_atoms_variation == 0:
+        # All the subjobs had the same number of atoms, so the overhead cannot be split between subjobs and atoms.
+        return mean_overhead, 0.0
+
+    atom_overhead = sum((num_atoms - mean_num_atoms) * (overhead - mean_overhead)
+                        for num_atoms, overhead in samples) / num_atoms_variation
+    atom_overhead = max(atom_overhead, 0.0)
+    subjob_overhead = mean_overhead - atom_overhead * mean_num_atoms
+    if subjob_overhead < 0:
+        # Fit the overhead to the atoms alone.
+        subjob_overhead = 0.0
+        atom_overhead = sum(num_atoms * overhead for num_atoms, overhead in samples) / sum(
+            num_atoms ** 2 for num_atoms, _ in samples)
+    return subjob_overhead, atom_overhead
+
+
+def _build_events(build_id, since_timestamp=None):
+    """
+    :type build_id: int
+    :type since_timestamp: float | None
+    :return: the analytics events of the build, or None if the event log is not available
+    :rtype: list[dict] | None
+    """
+    try:
+        events = analytics.get_events(since_timestamp=since_timestamp) or []
+    except ItemNotReadyError:
+        return None
+    return [event for event in events if event.get('build_id') == build_id]
@@ -0,0 +1,107 @@
+from hashlib import sha256
+import json
+import os
+
+from app.util import log
+import app.util.fs
+
+
+class AtomizationCache(object):
+    """
+    Caches the output of atomizer commands on disk, so that builds of a commit that has already been atomized (e.g.,
+    retries, several jobs of the same repo, or bisects) do not have to run the atomizer commands again.
+
+    Entries are keyed by the project, the commit hash that was fetched (see ProjectType.cached_source()), the atomizer
+    variable name and the atomizer command. Atomizer commands run in the environment that the project type sets up,
+    which only differs between builds in the project directory, and that is replaced with $PROJECT_DIR in the cached
+    atom values. Projects whose fetched commit is not known (e.g., the Directory project type) are never cached.
+
+    Each entry is stored in its own file, and the least recently used entries are removed once there are more than
+    max_entries of them.
+    """
+
+    def __init__(self, cache_directory, max_entries):
+        """
+        :param cache_directory: the directory that the cached atomizer output is stored in
+        :type cache_directory: str
+        :param max_entries: the maximum number of atomizer outputs to keep, or 0 to disable the cache
+        :type max_entries: int
+        """
+        self._logger = log.get_logger(__name__)
+        self._cache_directory = cache_directory
+        self._max_entries = max_entries
+
+    def atom_values(self, project_type, atomizer_var_name, atomizer_command):
+        """
+        :type project_type: app.project_type.project_type.ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :return: the cached atom values that the atomizer command output at the project's fetched commit, or None if
+            they are not cached
+        :rtype: list[str] | None
+        """
+        cache_file_path = self._cache_file_path(project_type, atomizer_var_name, atomizer_command)
+        if cache_file_path is None or not os.path.isfile(cache_file_path):
+            return None
+        try:
+            with open(cache_file_path) as cache_file:
+                atom_values = json.load(cache_file)
+            os.utime(cache_file_path)  # Mark the entry as recently used.
+        except (OSError, ValueError):
+            self._logger.warning('Failed to load cached atomizer output from file that exists {}', cache_file_path)
+            return None
+
+        self._logger.info('Using {} cached atoms of atomizer command "{}".', len(atom_values), atomizer_command)
+        return atom_values
+
+    def store_atom_values(self, project_type, atomizer_var_name, atomizer_command, atom_values):
+        """
+        :type project_type: app.project_type.project_type.ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :param atom_values: the atom values that the atomizer command output, with the project directory replaced
+        :type atom_values: list[str]
+        """
+        cache_file_path = self._cache_file_path(project_type, atomizer_var_name, atomizer_command)
+        if cache_file_path is None:
+            return
+        app.util.fs.write_file(json.dumps(atom_values), cache_file_path)
+        self._evict_least_recently_used_entries()
+
+    def _cache_file_path(self, project_type, atomizer_var_name, atomizer_command):
+        """
+        :type project_type: app.project_type.project_type.ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :return: the path of the file the atomizer output is cached in, or None if it cannot be cached
+        :rtype: str | None
+        """
+        cached_source = project_type.cached_source()
+        if self._max_entries <= 0 or cached_source is None or cached_source[1] is None:
+            return None
+        _, commit_hash = cached_source
+        cache_key = json.dumps([project_type.project_id(), commit_hash, atomizer_var_name, atomizer_command])
+        return os.path.join(self._cache_directory, sha256(cache_key.encode()).hexdigest() + '.json')
+
+    def _evict_least_recently_used_entries(self):
+        cache_file_paths = [os.path.join(self._cache_directory, file_name)
+                            for file_name in os.listdir(self._cache_directory)]
+        if len(cache_file_paths) <= self._max_entries:
+            return
+        cache_file_paths.sort(key=self._last_used_time)
+        for cache_file_path in cache_file_paths[:len(cache_file_paths) - self._max_entries]:
+            try:
+                os.remove(cache_file_path)
+            except FileNotFoundError:
+                pass  # Another build has already removed it.
+
+    @staticmethod
+    def _last_used_time(cache_file_path):
+        """
+        :type cache_file_path: str
+        :rtype: float
+        """
+        try:
+            return os.path.getmtime(cache_file_path)
+        except FileNotFoundError:
+            return 0.0
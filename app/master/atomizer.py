@@ -1,5 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from app.master.atom import Atom
 from app.util import log
+from app.util.conf.configuration import Configuration
 from app.util.process_utils import get_environment_variable_setter_command
 
 
@@ -17,34 +20,135 @@ class Atomizer(object):
         self._logger = log.get_logger(__name__)
         self._atomizer_dicts = atomizer_dicts
 
-    def atomize_in_project(self, project_type):
+    def atomize_in_project(self, project_type, atomization_cache=None):
         """
         Translate the atomizer dicts that this instance was initialized with into a list of actual atom commands. This
-        executes atomizer commands inside the given project in order to generate the atoms.
+        executes atomizer commands inside the given project in order to generate the atoms. Up to
+        max_concurrent_atomizer_commands of the atomizer commands are executed at the same time.
 
         :param project_type: The ProjectType instance in which to execute the atomizer commands
         :type project_type: ProjectType
+        :param atomization_cache: The cache to look up the output of the atomizer commands in before executing them,
+            and to store their output in. If None, the atomizer commands are always executed.
+        :type atomization_cache: app.master.atomization_cache.AtomizationCache | None
         :return: The list of environment variable "export" atom commands
         :rtype: list[app.master.atom.Atom]
         """
+        atomizer_commands = [(atomizer_var_name, atomizer_command)
+                             for atomizer_dict in self._atomizer_dicts
+                             for atomizer_var_name, atomizer_command in atomizer_dict.items()]
+
+        # The atomizer commands are independent of each other, so they are executed concurrently. The atoms are still
+        # listed in the order of the atomizer commands.
+        max_workers = min(len(atomizer_commands), Configuration['max_concurrent_atomizer_commands'])
+        if max_workers <= 1:
+            atom_values_by_command = [self._atom_values(project_type, atomizer_var_name, atomizer_command,
+                                                        atomization_cache)
+                                      for atomizer_var_name, atomizer_command in atomizer_commands]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self._atom_values, project_type, atomizer_var_name, atomizer_command,
+                                           atomization_cache)
+                           for atomizer_var_name, atomizer_command in atomizer_commands]
+                atom_values_by_command = [future.result() for future in futures]
+
         atoms_list = []
+        for (atomizer_var_name, _), atom_values in zip(atomizer_commands, atom_values_by_command):
+            atoms_list.extend(Atom(get_environment_variable_setter_command(atomizer_var_name, atom_value))
+                              for atom_value in atom_values)
+        return atoms_list
+
+    def atomize_in_project_incrementally(self, project_type, atoms_callback, atomization_cache=None):
+        """
+        Translate the atomizer dicts into atoms like atomize_in_project(), but pass the atoms to a callback as soon as
+        each atomizer command outputs them, instead of returning them once all the atomizer commands are done. The
+        atomizer commands are executed one after another so that the atoms keep the order of the atomizer commands.
+
+        :param project_type: The ProjectType instance in which to execute the atomizer commands
+        :type project_type: ProjectType
+        :param atoms_callback: called with each list of new atoms, in order
+        :type atoms_callback: callable
+        :param atomization_cache: The cache to look up the output of the atomizer commands in before executing them,
+            and to store their output in. If None, the atomizer commands are always executed.
+        :type atomization_cache: app.master.atomization_cache.AtomizationCache | None
+        """
         for atomizer_dict in self._atomizer_dicts:
             for atomizer_var_name, atomizer_command in atomizer_dict.items():
-                atomizer_output, exit_code = project_type.execute_command_in_project(atomizer_command)
-                if exit_code != 0:
-                    self._logger.error('Atomizer command "{}" for variable "{}" failed with exit code: {} and output:'
-                                       '\n{}', atomizer_command, atomizer_var_name, exit_code, atomizer_output)
-                    raise AtomizerError('Atomizer command failed!')
-
-                new_atoms = []
-                for atom_value in atomizer_output.strip().splitlines():
-                    # For purposes of matching atom string values across builds, we must replace the generated/unique
-                    # project directory with its corresponding universal environment variable: '$PROJECT_DIR'.
-                    atom_value = atom_value.replace(project_type.project_directory, '$PROJECT_DIR')
-                    new_atoms.append(Atom(get_environment_variable_setter_command(atomizer_var_name, atom_value)))
-                atoms_list.extend(new_atoms)
+                atom_values = None
+                if atomization_cache is not None:
+                    atom_values = atomization_cache.atom_values(project_type, atomizer_var_name, atomizer_command)
+                if atom_values is not None:
+                    atoms_callback([Atom(get_environment_variable_setter_command(atomizer_var_name, atom_value))
+                                    for atom_value in atom_values])
+                    continue
 
-        return atoms_list
+                atom_values = self._stream_atomizer_command(project_type, atomizer_var_name, atomizer_command,
+                                                            atoms_callback)
+                if atomization_cache is not None:
+                    atomization_cache.store_atom_values(project_type, atomizer_var_name, atomizer_command, atom_values)
+
+    def _stream_atomizer_command(self, project_type, atomizer_var_name, atomizer_command, atoms_callback):
+        """
+        :type project_type: ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :param atoms_callback: called with a list of the new atom for each line that the atomizer command outputs
+        :type atoms_callback: callable
+        :return: The atom values that the atomizer command output
+        :rtype: list[str]
+        """
+        atom_values = []
+
+        def handle_output_line(atom_value):
+            if not atom_value.strip():
+                return
+            atom_value = atom_value.replace(project_type.project_directory, '$PROJECT_DIR')
+            atom_values.append(atom_value)
+            atoms_callback([Atom(get_environment_variable_setter_command(atomizer_var_name, atom_value))])
+
+        error_output, exit_code = project_type.stream_command_in_project(atomizer_command, handle_output_line)
+        if exit_code != 0:
+            self._logger.error('Atomizer command "{}" for variable "{}" failed with exit code: {} and output:'
+                               '\n{}', atomizer_command, atomizer_var_name, exit_code, error_output)
+            raise AtomizerError('Atomizer command failed!')
+        return atom_values
+
+    def _atom_values(self, project_type, atomizer_var_name, atomizer_command, atomization_cache):
+        """
+        :type project_type: ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :type atomization_cache: app.master.atomization_cache.AtomizationCache | None
+        :return: The atom values of the atomizer command, from the cache if they are cached
+        :rtype: list[str]
+        """
+        atom_values = None
+        if atomization_cache is not None:
+            atom_values = atomization_cache.atom_values(project_type, atomizer_var_name, atomizer_command)
+        if atom_values is None:
+            atom_values = self._execute_atomizer_command(project_type, atomizer_var_name, atomizer_command)
+            if atomization_cache is not None:
+                atomization_cache.store_atom_values(project_type, atomizer_var_name, atomizer_command, atom_values)
+        return atom_values
+
+    def _execute_atomizer_command(self, project_type, atomizer_var_name, atomizer_command):
+        """
+        :type project_type: ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :return: The atom values that the atomizer command output, one per line
+        :rtype: list[str]
+        """
+        atomizer_output, exit_code = project_type.execute_command_in_project(atomizer_command)
+        if exit_code != 0:
+            self._logger.error('Atomizer command "{}" for variable "{}" failed with exit code: {} and output:'
+                               '\n{}', atomizer_command, atomizer_var_name, exit_code, atomizer_output)
+            raise AtomizerError('Atomizer command failed!')
+
+        # For purposes of matching atom string values across builds, we must replace the generated/unique project
+        # directory with its corresponding universal environment variable: '$PROJECT_DIR'.
+        return [atom_value.replace(project_type.project_directory, '$PROJECT_DIR')
+                for atom_value in atomizer_output.strip().splitlines()]
 
 
 class AtomizerError(Exception):
@@ -1,5 +1,6 @@
 from collections import OrderedDict
 from enum import Enum
+from itertools import takewhile
 import os
 from queue import Queue, Empty
 import shutil
@@ -7,9 +8,12 @@ import time
 from threading import Lock
 import uuid
 
+from app.master.atom_grouping_tuner import AtomGroupingTuner
 from app.master.build_artifact import BuildArtifact
 from app.master.build_fsm import BuildFsm, BuildEvent, BuildState
 from app.master.build_request import BuildRequest
+from app.master.subjob import Subjob
+from app.master.timing_store import TimingStore
 from app.project_type.project_type import ProjectType
 from app.util import util
 from app.util.conf.configuration import Configuration
@@ -59,6 +63,7 @@ class Build(object):
         self._failed_atoms = None
         self._postbuild_tasks_are_finished = False  # WIP(joey): Remove and use build state.
         self._timing_file_path = None
+        self._is_atomizing = False  # whether subjobs are still being added as the atomizers output atoms
 
         self._state_machine = BuildFsm(
             build_id=self._build_id,
@@ -89,6 +94,7 @@ class Build(object):
             'failed_atoms': failed_atoms_api_representation,
             'result': self._result(),
             'request_params': self.build_request.build_parameters(),
+            'priority': self.build_request.priority(),
             # Convert self._state_timestamps to OrderedDict to make raw API response more readable. Sort the entries
             # by numerically increasing dict value, with None values sorting highest.
             'state_timestamps': OrderedDict(sorted(
@@ -117,10 +123,14 @@ class Build(object):
         if self._project_type is None:
             raise BuildProjectError('Build failed due to an invalid project type.')
 
-    def prepare(self, subjob_calculator):
+    def prepare(self, subjob_calculator, ready_for_slaves_callback=None):
         """
         :param subjob_calculator: Used after project fetch to atomize and group subjobs for this build
         :type subjob_calculator: SubjobCalculator
+        :param ready_for_slaves_callback: When the build is prepared before its atomizers have exited (see
+            _prepare_while_atomizing()), this is called each time the build may be able to use more slaves: when it is
+            prepared, each time subjobs have been added, and once more when the atomizers have exited.
+        :type ready_for_slaves_callback: callable | None
         """
         if not isinstance(self.build_request, BuildRequest):
             raise RuntimeError('Build {} has no associated request object.'.format(self._build_id))
@@ -143,10 +153,17 @@ class Build(object):
         if job_config is None:
             raise RuntimeError('Build failed while trying to parse clusterrunner.yaml.')
 
+        atomizes_while_building = Configuration['streaming_atomization_batch_size'] > 0 or Configuration[
+            'allocate_slaves_while_atomizing']
+        if atomizes_while_building and self.project_type.atoms_override is None:
+            self._prepare_while_atomizing(subjob_calculator, job_config, ready_for_slaves_callback)
+            return
+
         subjobs = subjob_calculator.compute_subjobs_for_build(self._build_id, job_config, self.project_type)
 
-        self._unstarted_subjobs = Queue(maxsize=len(subjobs))  # WIP(joey): Move this into BuildScheduler?
-        self._finished_subjobs = Queue(maxsize=len(subjobs))  # WIP(joey): Remove this and just record finished count.
+        # These queues are unbounded since subjobs can be split into more subjobs while the build is running.
+        self._unstarted_subjobs = Queue()  # WIP(joey): Move this into BuildScheduler?
+        self._finished_subjobs = Queue()  # WIP(joey): Remove this and just record finished count.
 
         for subjob in subjobs:
             self._all_subjobs_by_id[subjob.subjob_id()] = subjob
@@ -156,6 +173,74 @@ class Build(object):
         app.util.fs.create_dir(self._build_results_dir())
         self._state_machine.trigger(BuildEvent.FINISH_PREPARE)
 
+    def _prepare_while_atomizing(self, subjob_calculator, job_config, ready_for_slaves_callback):
+        """
+        Add the subjobs of this build while slaves may already be working on it. With streaming atomization, subjobs
+        are added in batches as the atomizers output atoms (see SubjobCalculator.group_atoms_incrementally()) and the
+        build is prepared as soon as the first batch has been added, so that its first subjobs can execute while the
+        atomizers are still running. With allocate_slaves_while_atomizing, the build is prepared before atomizing, since
+        slaves only need the fetched project to set up for the build, so their setup overlaps with atomization. Either
+        way, the build cannot finish until the atomizers have exited.
+
+        :type subjob_calculator: SubjobCalculator
+        :type job_config: JobConfig
+        :type ready_for_slaves_callback: callable | None
+        """
+        self._unstarted_subjobs = Queue()
+        self._finished_subjobs = Queue()
+        self._timing_file_path = self._project_type.timing_file_path(job_config.name)
+        app.util.fs.create_dir(self._build_results_dir())
+        self._is_atomizing = True
+
+        def notify_ready_for_slaves():
+            if ready_for_slaves_callback is not None:
+                ready_for_slaves_callback()
+
+        def add_subjobs(grouped_atoms):
+            if self._is_stopped():
+                return
+            # The completion lock ensures that a build is not detected as finished while its subjob count is changing.
+            with self._build_completion_lock:
+                first_subjob_id = max(self._all_subjobs_by_id) + 1 if self._all_subjobs_by_id else 0
+                new_subjobs = []
+                for subjob_id, subjob_atoms in enumerate(grouped_atoms, start=first_subjob_id):
+                    # The atom id isn't calculated until the atom has been grouped into a subjob.
+                    for atom_id, atom in enumerate(subjob_atoms):
+                        atom.id = atom_id
+                    new_subjobs.append(Subjob(self._build_id, subjob_id, self.project_type, job_config, subjob_atoms))
+                    self._all_subjobs_by_id[subjob_id] = new_subjobs[-1]
+
+            self._logger.info('Added {} subjobs to build {} while atomizing.', len(new_subjobs), self._build_id)
+            for subjob in new_subjobs:
+                self._unstarted_subjobs.put(subjob)
+            if self._status() is BuildState.PREPARING:
+                self._state_machine.trigger(BuildEvent.FINISH_PREPARE)
+            notify_ready_for_slaves()
+
+        if Configuration['allocate_slaves_while_atomizing']:
+            self._state_machine.trigger(BuildEvent.FINISH_PREPARE)
+            notify_ready_for_slaves()
+
+        try:
+            if Configuration['streaming_atomization_batch_size'] > 0:
+                subjob_calculator.group_atoms_incrementally(job_config, self.project_type, add_subjobs)
+            else:
+                subjobs = subjob_calculator.compute_subjobs_for_build(self._build_id, job_config, self.project_type)
+                add_subjobs([subjob.atoms for subjob in subjobs])
+        finally:
+            with self._build_completion_lock:
+                self._is_atomizing = False
+                should_trigger_postbuild_tasks = (len(self._all_subjobs_by_id) > 0 and self._all_subjobs_are_finished()
+                                                  and not self._is_stopped())
+            if self._status() is not BuildState.PREPARING:
+                notify_ready_for_slaves()  # Slaves that are waiting for more subjobs are released if there are none.
+
+        if self._status() is BuildState.PREPARING:
+            self._state_machine.trigger(BuildEvent.FINISH_PREPARE)  # The atomizers did not output any atoms.
+        if should_trigger_postbuild_tasks:
+            self._logger.info("All results received for build {}!", self._build_id)
+            SafeThread(target=self._perform_async_postbuild_tasks, name='PostBuild{}'.format(self._build_id)).start()
+
     def build_id(self):
         """
         :rtype: int
@@ -187,15 +272,45 @@ class Build(object):
             raise ItemNotFoundError('Invalid subjob id.')
         return subjob
 
+    def split_subjob(self, subjob, num_atoms_to_keep=None):
+        """
+        Split the trailing atoms of a subjob off into a new subjob and queue the new subjob for execution.
+
+        :type subjob: Subjob
+        :param num_atoms_to_keep: the number of atoms the original subjob keeps, or None to split it in half
+        :type num_atoms_to_keep: int | None
+        :return: the new subjob, or None if the subjob could not be split
+        :rtype: Subjob | None
+        """
+        # The completion lock ensures that a build is not detected as finished while its subjob count is changing.
+        with self._build_completion_lock:
+            new_subjob = subjob.split(max(self._all_subjobs_by_id) + 1, num_atoms_to_keep)
+            if new_subjob is None:
+                return None
+            self._all_subjobs_by_id[new_subjob.subjob_id()] = new_subjob
+
+        self._logger.info('Split {} atoms off subjob {} into subjob {} (build {}).', len(new_subjob.atoms),
+                          subjob.subjob_id(), new_subjob.subjob_id(), self._build_id)
+        self._unstarted_subjobs.put(new_subjob)
+        return new_subjob
+
     def complete_subjob(self, subjob_id, payload=None):
         """
-        Handle the subjob payload and mark the given subjob id for this build as complete.
+        Handle the subjob payload and mark the given subjob id for this build as complete. If a result has already been
+        received for this subjob (because it was also executed speculatively on another slave), the payload is ignored.
         :type subjob_id: int
         :type payload: dict
+        :return: whether this was the first result received for the subjob
+        :rtype: bool
         """
         try:
+            if not self.subjob(subjob_id).claim_result():
+                self._logger.info('Ignoring duplicate result for subjob {} of build {}.', subjob_id, self._build_id)
+                return False
+
             self._handle_subjob_payload(subjob_id, payload)
             self._mark_subjob_complete(subjob_id)
+            return True
 
         except Exception:
             self._logger.exception('Error while completing subjob; marking build as failed.')
@@ -203,18 +318,38 @@ class Build(object):
             raise
 
     def _parse_payload_for_atom_exit_code(self, subjob_id):
+        """
+        Read the exit codes of the subjob's atoms from the extracted payload. A slave that was asked to release its
+        unstarted atoms (see BuildScheduler._release_atoms_from_running_subjob()) may report its result before the
+        master has split those atoms off, so the trailing atoms that the slave did not execute are split off here.
+
+        :type subjob_id: int
+        """
         subjob = self.subjob(subjob_id)
+        atom_exit_code_file_paths = [self._atom_exit_code_file_path(subjob_id, atom_id)
+                                     for atom_id in range(len(subjob.atoms))]
+        num_atoms_executed = len(list(takewhile(os.path.isfile, atom_exit_code_file_paths)))
+        if 0 < num_atoms_executed < len(subjob.atoms):
+            self.split_subjob(subjob, num_atoms_executed)
+
         for atom_id in range(len(subjob.atoms)):
-            artifact_dir = BuildArtifact.atom_artifact_directory(
-                self.build_id(),
-                subjob.subjob_id(),
-                atom_id,
-                result_root=Configuration['results_directory']
-            )
-            atom_exit_code_file_sys_path = os.path.join(artifact_dir, BuildArtifact.EXIT_CODE_FILE)
-            with open(atom_exit_code_file_sys_path, 'r') as atom_exit_code_file:
+            with open(atom_exit_code_file_paths[atom_id], 'r') as atom_exit_code_file:
                 subjob.atoms[atom_id].exit_code = int(atom_exit_code_file.read())
 
+    def _atom_exit_code_file_path(self, subjob_id, atom_id):
+        """
+        :type subjob_id: int
+        :type atom_id: int
+        :rtype: str
+        """
+        artifact_dir = BuildArtifact.atom_artifact_directory(
+            self.build_id(),
+            subjob_id,
+            atom_id,
+            result_root=Configuration['results_directory']
+        )
+        return os.path.join(artifact_dir, BuildArtifact.EXIT_CODE_FILE)
+
     def _handle_subjob_payload(self, subjob_id, payload):
         if not payload:
             self._logger.warning('No payload for subjob {} of build {}.', subjob_id, self._build_id)
@@ -231,16 +366,27 @@ class Build(object):
             self._logger.warning('Writing payload for subjob {} of build {} FAILED.', subjob_id, self._build_id)
             raise
 
-    def _read_subjob_timings_from_results(self):
+    def _record_atom_timings(self):
         """
-        Collect timing data from all subjobs
-        :rtype: dict [str, float]
+        Record the times of this build's atoms that passed in the timing store, so that future builds of this job can
+        be grouped using them. Atoms that failed are left out since a failing atom often stops early.
         """
-        timings = {}
-        for _, subjob in self._all_subjobs_by_id.items():
-            timings.update(subjob.read_timings())
+        failed_atom_ids = set(self._build_artifact.get_failed_subjob_and_atom_ids())
+        atom_times = {}
+        for subjob in self._all_subjobs_by_id.values():
+            subjob.read_timings()
+            for atom_id, atom in enumerate(subjob.atoms):
+                if atom.actual_time is not None and (subjob.subjob_id(), atom_id) not in failed_atom_ids:
+                    atom_times[atom.command_string] = atom.actual_time
 
-        return timings
+        if len(atom_times) == 0:
+            self._logger.error('Failed to find timing data')
+            return
+        timing_store = TimingStore(Configuration['timing_database_path'])
+        try:
+            timing_store.record_atom_times(self._timing_file_path, atom_times)
+        finally:
+            timing_store.close()
 
     def _mark_subjob_complete(self, subjob_id):
         """
@@ -382,7 +528,16 @@ class Build(object):
         return sum([len(subjob.atomic_commands()) for subjob in self._all_subjobs_by_id.values()])
 
     def _all_subjobs_are_finished(self):
-        return self._finished_subjobs and self._finished_subjobs.full()
+        return (not self._is_atomizing and self._finished_subjobs
+                and self._finished_subjobs.qsize() == len(self._all_subjobs_by_id))
+
+    @property
+    def is_atomizing(self):
+        """
+        :return: whether the build is prepared but subjobs are still being added to it as the atomizers output atoms
+        :rtype: bool
+        """
+        return self._is_atomizing
 
     @property
     def is_finished(self):
@@ -412,6 +567,10 @@ class Build(object):
     def _is_canceled(self):
         return self._status() is BuildState.CANCELED
 
+    @property
+    def is_canceled(self):
+        return self._is_canceled()
+
     def _is_stopped(self):
         return self._status() in (BuildState.ERROR, BuildState.CANCELED)
 
@@ -462,10 +621,29 @@ class Build(object):
     def _create_build_artifact(self):
         self._build_artifact = BuildArtifact(self._build_results_dir())
         self._build_artifact.generate_failures_file()
-        self._build_artifact.write_timing_data(self._timing_file_path, self._read_subjob_timings_from_results())
+        self._record_atom_timings()
+        self._tune_atom_grouping()
         self._artifacts_archive_file = app.util.fs.compress_directory(self._build_results_dir(),
                                                                       BuildArtifact.ARTIFACT_FILE_NAME)
 
+    def _tune_atom_grouping(self):
+        """
+        Tune how the atoms of future builds of this job are grouped based on how this build ended. Only builds without
+        failures whose atoms were all grouped using timing data are used, since the others say little about how well
+        the grouping worked.
+        """
+        if any(subjob.expected_time() is None for subjob in self._all_subjobs_by_id.values()):
+            return
+        if len(self._build_artifact.get_failed_subjob_and_atom_ids()) > 0:
+            return
+        build_start_time = self._state_machine.transition_timestamps.get(BuildState.BUILDING)
+        # The atom times have been read from the results by _record_atom_timings().
+        subjob_work = {subjob.subjob_id(): (len(subjob.atoms), sum(atom.actual_time for atom in subjob.atoms))
+                       for subjob in self._all_subjobs_by_id.values()
+                       if all(atom.actual_time is not None for atom in subjob.atoms)}
+        AtomGroupingTuner(self._timing_file_path).tune(self._build_id, since_timestamp=build_start_time,
+                                                       subjob_work=subjob_work)
+
     def _delete_temporary_build_artifact_files(self):
         """
         Delete the temporary build result files that are no longer needed, due to the creation of the
@@ -1,9 +1,7 @@
-import json
 import os
 import re
 
 from app.util.conf.configuration import Configuration
-import app.util.fs
 from app.util.log import get_logger
 
 
@@ -27,39 +25,6 @@ class BuildArtifact(object):
         self._failed_artifact_directories = None
         self._failed_subjob_atom_pairs = None
 
-    def write_timing_data(self, timing_file_path, timing_data):
-        """
-        Persist timing data to a file.
-
-        If there is no timing data, write the timing file regardless of whether there were any invalid executions.
-        If there is timing data, only write the timing file if there were no failures.
-
-        :param timing_file_path: where the timing data should be written
-        :type timing_file_path: str
-        :param timing_data: the key-value pairs of the atom-time in seconds the atom took to run
-        :type timing_data: dict[str, float]
-        """
-        if len(timing_data) == 0:
-            self._logger.error('Failed to find timing data')
-            return
-
-        app.util.fs.create_dir(os.path.dirname(timing_file_path))
-
-        # If file doesn't exist, then write timing data no matter what
-        if not os.path.isfile(timing_file_path):
-            self._write_timing_data_to_file(timing_file_path, timing_data)
-            self._logger.debug('Created new timing file in {}', timing_file_path)
-            return
-
-        # If file exists, update the timing data only if there were no failures this build
-        # @TODO: in the future we should always update the timing data, but only for passed atom keys.
-        if len(self._get_failed_artifact_directories()) == 0:
-            self._update_timing_file(timing_file_path, timing_data)
-            self._logger.debug('Overwrote existing timing file in {}', timing_file_path)
-            return
-
-        self._logger.debug('Did not write/overwrite timing data during build')
-
     def get_failed_subjob_and_atom_ids(self):
         """
         Get a list of (subjob_id, atom_id) tuples that failed.
@@ -119,27 +84,6 @@ class BuildArtifact(object):
             with open(os.path.join(self.build_artifact_dir, 'failures.txt'), 'w') as f:
                 f.write("\n".join(failed_atom_directories))
 
-    def _write_timing_data_to_file(self, timing_file_path, timing_data):
-        """
-        :type timing_file_path: str
-        :type timing_data: dict[str, float]
-        """
-        app.util.fs.write_file(json.dumps(timing_data), timing_file_path)
-
-    def _update_timing_file(self, timing_file_path, new_timing_data):
-        """
-        Update the timing data for the atoms specified in new_timing_data. This means that new results
-        does not replace the entire timing data file, but rather only replaces the timing data for
-        individual atom keys.
-        :param timing_file_path: str
-        :param new_timing_data: dict[str, float]
-        """
-        with open(timing_file_path) as timing_file:
-            timing_data = json.load(timing_file)
-
-        timing_data.update(new_timing_data)
-        self._write_timing_data_to_file(timing_file_path, timing_data)
-
     @staticmethod
     def atom_artifact_directory(build_id, subjob_id, atom_id, result_root=None):
         """
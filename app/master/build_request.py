@@ -23,6 +23,9 @@ class BuildRequest(object):
             - This field is optional if the "config" section is specified
         [OPTIONAL] "atoms_override": ['export VAR="overridden_atom_value_1";', ...],
         [OPTIONAL] "hash": "123456789123456789123456789"
+        [OPTIONAL] "priority": 10
+            - Builds with a higher priority are allocated slaves first and may reclaim executors from running
+              builds with a lower priority. Defaults to 0.
         [OPTIONAL] "config": {
             "commands" : [...],
             "atomizers" : {...},
@@ -32,7 +35,13 @@ class BuildRequest(object):
             "max_executors_per_slave": ...
         }
     }
+
+    Note that "priority" is a build-level parameter: it is removed from the build parameters that are used to create
+    the project type.
     """
+    PRIORITY = 'priority'
+    DEFAULT_PRIORITY = 0
+
     def __init__(self, build_parameters):
         """
         :param build_parameters: A dictionary of request parameters
@@ -41,6 +50,23 @@ class BuildRequest(object):
         self._build_parameters = dict(build_parameters) or {}
         build_type = self._build_parameters.get('type')
         self._build_type = build_type.lower() if build_type else None
+        self._priority = self._parse_priority(self._build_parameters.pop(self.PRIORITY, self.DEFAULT_PRIORITY))
+
+    @staticmethod
+    def _parse_priority(priority):
+        """
+        :param priority: The requested priority, as received in the request (may be a string)
+        :type priority: int | str | None
+        :return: the priority as an int, or None if the requested value is not an integer
+        :rtype: int | None
+        """
+        if priority is None:
+            return BuildRequest.DEFAULT_PRIORITY
+        if isinstance(priority, int) and not isinstance(priority, bool):
+            return priority
+        if isinstance(priority, str) and priority.strip().lstrip('-').isdigit():
+            return int(priority)
+        return None
 
     def is_valid(self):
         """
@@ -52,7 +78,14 @@ class BuildRequest(object):
         if self._build_type is None:
             return False
         missing_parameters = set(self.required_parameters()) - self._build_parameters.keys()
-        return self.is_valid_type() and not missing_parameters
+        return self.is_valid_type() and self.is_valid_priority() and not missing_parameters
+
+    def is_valid_priority(self):
+        """
+        :return: whether the requested priority is valid or not
+        :rtype: bool
+        """
+        return self._priority is not None
 
     def is_valid_type(self):
         """
@@ -80,3 +113,10 @@ class BuildRequest(object):
         :rtype: dict
         """
         return self._build_parameters
+
+    def priority(self):
+        """
+        :return: the priority of this build; builds with a higher value are scheduled ahead of lower ones
+        :rtype: int
+        """
+        return self._priority
@@ -23,11 +23,14 @@ class BuildRequestHandler(object):
     entity) to pull Builds from.
 
     All of the input of builds come through self.handle_build_request() calls, and all of the output
-    of builds go through self._scheduler_pool.next_prepared_build_scheduler() calls.
+    of builds go through self._scheduler_pool.next_fair_share_build_scheduler() calls.
     """
-    def __init__(self, scheduler_pool):
+    def __init__(self, scheduler_pool, get_executor_speed_factors=None):
         """
         :type scheduler_pool: app.master.build_scheduler_pool.BuildSchedulerPool
+        :param get_executor_speed_factors: a callable that returns the speed factors of the executors that builds can
+            run on, fastest first (see SubjobCalculator)
+        :type get_executor_speed_factors: callable | None
         """
         self._logger = get_logger(__name__)
         self._scheduler_pool = scheduler_pool
@@ -35,7 +38,7 @@ class BuildRequestHandler(object):
         self._request_queue_worker_thread = SafeThread(
             target=self._build_preparation_loop, name='RequestHandlerLoop', daemon=True)
         self._project_preparation_locks = {}
-        self._subjob_calculator = SubjobCalculator()
+        self._subjob_calculator = SubjobCalculator(get_executor_speed_factors)
 
     def start(self):
         """
@@ -79,27 +82,58 @@ class BuildRequestHandler(object):
         :type build: app.master.build.Build
         :type project_lock: Lock
         """
+        if build.project_type.has_build_specific_copy():
+            # The build is prepared in its own copy of the project, so it can be prepared at the same time as other
+            # builds of the project. The project type serializes updates to the state that the copies share.
+            self._logger.info('Build {} is being prepared in its own copy of the project', build.build_id())
+            self._prepare_build(build)
+            return
+
         self._logger.info('Build {} is waiting for the project lock', build.build_id())
 
         with project_lock:
             self._logger.info('Build {} has acquired project lock', build.build_id())
-            analytics.record_event(analytics.BUILD_PREPARE_START, build_id=build.build_id(),
-                                   log_msg='Build preparation loop is handling request for build {build_id}.')
-            try:
-                build.prepare(self._subjob_calculator)
-                if not build.has_error:
-                    analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=True,
-                                           log_msg='Build {build_id} successfully prepared.')
-                    # If the atomizer found no work to do, perform build cleanup and skip the slave allocation.
-                    if len(build.all_subjobs()) == 0:
-                        self._logger.info('Build {} has no work to perform and is exiting.', build.build_id())
-                        build.finish()
-                    # If there is work to be done, this build must queue to be allocated slaves.
-                    else:
-                        self._logger.info('Build {} is waiting for slaves.', build.build_id())
-                        self._scheduler_pool.add_build_waiting_for_slaves(build)
-
-            except Exception as ex:  # pylint: disable=broad-except
-                build.mark_failed(str(ex))  # WIP(joey): Build should do this internally.
-                self._logger.exception('Could not handle build request for build {}.'.format(build.build_id()))
-                analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=False)
+            self._prepare_build(build)
+
+    def _prepare_build(self, build):
+        """
+        :type build: app.master.build.Build
+        """
+        analytics.record_event(analytics.BUILD_PREPARE_START, build_id=build.build_id(),
+                               log_msg='Build preparation loop is handling request for build {build_id}.')
+        try:
+            build.prepare(self._subjob_calculator,
+                          ready_for_slaves_callback=lambda: self._handle_build_ready_for_slaves(build))
+            if not build.has_error:
+                analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=True,
+                                       log_msg='Build {build_id} successfully prepared.')
+                # If the atomizer found no work to do, perform build cleanup and skip the slave allocation.
+                if len(build.all_subjobs()) == 0:
+                    self._logger.info('Build {} has no work to perform and is exiting.', build.build_id())
+                    build.finish()
+                # If there is work to be done, this build must queue to be allocated slaves.
+                else:
+                    self._logger.info('Build {} is waiting for slaves.', build.build_id())
+                    self._scheduler_pool.add_build_waiting_for_slaves(build)
+
+        except Exception as ex:  # pylint: disable=broad-except
+            build.mark_failed(str(ex))  # WIP(joey): Build should do this internally.
+            self._logger.exception('Could not handle build request for build {}.'.format(build.build_id()))
+            analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=False)
+
+        finally:
+            # The slaves set up their own copies of the project, so the master only needs its copy to prepare the build.
+            build.project_type.remove_build_specific_copy()
+
+    def _handle_build_ready_for_slaves(self, build):
+        """
+        A build can be prepared before its atomizers have exited (see Build.prepare()), in which case subjobs are added
+        to it while slaves are already working on it. Each time the build may be able to use more slaves, the executors
+        that are waiting for subjobs get them, and the build waits for more slaves if it can use them.
+
+        :type build: app.master.build.Build
+        """
+        build_scheduler = self._scheduler_pool.get(build)
+        build_scheduler.execute_subjobs_on_waiting_slaves()
+        if build_scheduler.needs_more_slaves():
+            self._scheduler_pool.add_build_waiting_for_slaves(build)
@@ -1,8 +1,11 @@
+from functools import partial
 from queue import Empty
-from threading import Lock
+from threading import Lock, Timer
 
-from app.master.slave import SlaveMarkedForShutdownError
+from app.master.project_distribution_tree import ProjectDistributionTree
+from app.master.slave import DeadSlaveError, SlaveMarkedForShutdownError
 from app.util import analytics
+from app.util.conf.configuration import Configuration
 from app.util.log import get_logger
 
 # pylint: disable=protected-access
@@ -38,14 +41,59 @@ class BuildScheduler(object):
         self._slaves_allocated = []
         self._build_started = False
         self._num_executors_allocated = 0
+        self._num_executors_allocated_by_slave_id = {}
+        self._next_executor_start_index = 0
         self._num_executors_in_use = 0
+        # Each executor can have several subjobs dispatched to it at once, so that it does not sit idle while its
+        # results are uploaded and the master sends it the next subjob.
+        self._subjob_dispatch_depth = max(1, Configuration['subjob_dispatch_depth'])
+        self._num_dispatch_slots_by_slave_id = {}
+        self._slave_ids_being_reclaimed = set()
         self._subjob_assignment_lock = Lock()  # prevents subjobs from being skipped
+        self._straggler_check_timer = None
+        self._subjob_ids_with_released_atoms = set()
+        # The slaves that each have a dispatch slot waiting for the atomizers to output more subjobs, one entry per slot
+        self._slaves_waiting_for_subjobs = []
+        # Slaves that have set up the build serve the project to the slaves that are set up after them, if the project
+        # type supports it, so that the master does not serve every slave itself.
+        self._project_distribution_tree = None
+        fan_out = Configuration['project_distribution_fan_out']
+        if fan_out > 0 and build.project_type.can_be_fetched_from_slaves():
+            self._project_distribution_tree = ProjectDistributionTree(fan_out)
 
     @property
     def build_id(self):
         """ :rtype: int """
         return self._build.build_id()
 
+    @property
+    def build(self):
+        """ :rtype: app.master.build.Build """
+        return self._build
+
+    @property
+    def num_executors_allocated(self):
+        """ :rtype: int """
+        return self._num_executors_allocated
+
+    @property
+    def priority(self):
+        """ :rtype: int """
+        return self._build.build_request.priority()
+
+    def num_executors_wanted(self):
+        """
+        The number of additional executors this build could make use of right now.
+
+        :rtype: int
+        """
+        if not self.needs_more_slaves():
+            return 0
+        max_useful_executors = self._max_executors
+        if not self._build.is_atomizing:
+            max_useful_executors = min(max_useful_executors, len(self._build.all_subjobs()))
+        return max(0, max_useful_executors - self._num_executors_allocated)
+
     def needs_more_slaves(self):
         """
         Determine whether or not this build should have more slaves allocated to it.
@@ -54,8 +102,13 @@ class BuildScheduler(object):
         """
         if self._num_executors_allocated >= self._max_executors:
             return False
+        if self._build.is_atomizing:
+            # The number of subjobs is not known until the atomizers have exited, so the build is assumed to be able to
+            # use all of its max_executors. Executors that get no subjobs are freed once the atomizers have exited.
+            return True
         if self._build._unstarted_subjobs.empty():
-            return False
+            # A build with no subjobs left to start can still use a slave to speculatively re-execute a straggler.
+            return self._next_straggler_subjob() is not None
         if self._num_executors_allocated >= len(self._build.all_subjobs()):
             return False
         return True
@@ -70,8 +123,24 @@ class BuildScheduler(object):
             self._build_started = True
             self._build.mark_started()
         self._slaves_allocated.append(slave)
-        slave.setup(self._build, executor_start_index=self._num_executors_allocated)
-        self._num_executors_allocated += min(slave.num_executors, self._max_executors_per_slave)
+        # The slave may already be shared with other builds, so only its unallocated executors can be used. We also
+        # leave any executors this build cannot use unallocated so that other builds can use them.
+        num_executors_for_slave = min(slave.num_unallocated_executors(), self._max_executors_per_slave,
+                                      max(self._max_executors - self._num_executors_allocated, 0))
+        # Executor indices are never reused within a build, even after a slave is deallocated, since other slaves may
+        # still be running with the indices that came before.
+        if self._project_distribution_tree is None:
+            slave.setup(self._build, executor_start_index=self._next_executor_start_index,
+                        num_executors=num_executors_for_slave)
+        else:
+            # The executors are allocated right away, even if the slave has to wait for a source of the project.
+            slave.allocate_executors(self._build, num_executors_for_slave)
+            self._project_distribution_tree.add_slave(
+                slave, partial(slave.start_setup, self._build, self._next_executor_start_index),
+                has_project=slave.setup_cost(self._build) == 0)
+        self._num_executors_allocated_by_slave_id[slave.id] = num_executors_for_slave
+        self._num_executors_allocated += num_executors_for_slave
+        self._next_executor_start_index += num_executors_for_slave
         analytics.record_event(analytics.BUILD_SETUP_START, build_id=self._build.build_id(), slave_id=slave.id)
 
     def begin_subjob_executions_on_slave(self, slave):
@@ -82,53 +151,394 @@ class BuildScheduler(object):
         :type slave: Slave
         """
         analytics.record_event(analytics.BUILD_SETUP_FINISH, build_id=self._build.build_id(), slave_id=slave.id)
-        for slave_executor_count in range(slave.num_executors):
-            if (self._num_executors_in_use >= self._max_executors
-                    or slave_executor_count >= self._max_executors_per_slave):
+        if self._project_distribution_tree is not None:
+            self._project_distribution_tree.mark_slave_as_set_up(slave)
+        num_executors_claimed = 0
+        for _ in range(self._num_executors_allocated_by_slave_id.get(slave.id, 0)):
+            if self._num_executors_in_use >= self._max_executors:
                 break
             slave.claim_executor()
             self._num_executors_in_use += 1
-            self.execute_next_subjob_or_free_executor(slave)
+            num_executors_claimed += 1
+        self._num_dispatch_slots_by_slave_id[slave.id] = num_executors_claimed * self._subjob_dispatch_depth
+
+        # Dispatch in rounds so that every executor gets its first subjob before any executor gets a second one.
+        for _ in range(self._subjob_dispatch_depth):
+            for _ in range(num_executors_claimed):
+                self.execute_next_subjob_or_free_executor(slave)
 
     def execute_next_subjob_or_free_executor(self, slave):
         """
         Grabs an unstarted subjob off the queue and sends it to the specified slave to be executed. If the unstarted
         subjob queue is empty, we teardown the slave to free it up for other builds.
 
+        This is called once for each of the slave's dispatch slots (an executor has subjob_dispatch_depth of them) when
+        execution begins on the slave, and again each time the slave reports a result, which frees up a slot. If no
+        subjob is sent, the slot is released, and so is an executor once the slave has fewer slots than executors.
+
+        If a build with a higher priority is waiting for slaves, the slave may instead be reclaimed: it stops receiving
+        new subjobs from this build and is torn down once its in-flight subjobs finish. This build's remaining subjobs
+        stay queued and the build waits for slaves again.
+
+        When the unstarted subjob queue runs low, the subjob that is sent is split in two so that the remaining work
+        can be shared by more executors. Once the queue is empty, unstarted atoms are taken from a running subjob. If
+        there are none and a subjob is taking much longer than expected, the executor is used to speculatively
+        re-execute that subjob instead of being freed. While the build is still atomizing, the slot is instead kept
+        until more subjobs are added (see execute_subjobs_on_waiting_slaves()), so the slave is not torn down.
+
         :type slave: Slave
         """
+        if not slave.is_alive():
+            # The subjobs that were in flight on a dead slave are requeued by remove_dead_slave().
+            self._logger.info('Not sending more subjobs from build {} to dead slave {}.', self.build_id, slave)
+            return
+
+        if self._should_reclaim_slave(slave):
+            self._logger.info('Reclaiming {} from build {} for a higher priority build.', slave, self.build_id)
+            self._release_dispatch_slot(slave)
+            return
+
         try:
             # This lock prevents the scenario where a subjob is pulled from the queue but cannot be assigned to this
             # slave because it is shutdown, so we put it back on the queue but in the meantime another slave enters
             # this method, finds the subjob queue empty, and is torn down.  If that was the last 'living' slave, the
             # build would be stuck.
             with self._subjob_assignment_lock:
-                subjob = self._build._unstarted_subjobs.get(block=False)
+                subjob = self._take_unstarted_subjob(slave)
+                if (Configuration['dynamic_subjob_splitting']
+                        and self._build._unstarted_subjobs.qsize() < self._num_executors_in_use):
+                    self._build.split_subjob(subjob)
                 self._logger.debug('Sending subjob {} (build {}) to slave {}.',
                                    subjob.subjob_id(), subjob.build_id(), slave.url)
                 try:
                     slave.start_subjob(subjob)
                     subjob.mark_in_progress(slave)
+                except DeadSlaveError:
+                    # The slave died since the check above; remove_dead_slave() will clean up its executors.
+                    self._build._unstarted_subjobs.put(subjob)
                 except SlaveMarkedForShutdownError:
                     self._build._unstarted_subjobs.put(subjob)  # todo: This changes subjob execution order. (Issue #226)
                     # An executor is currently allocated for this subjob in begin_subjob_executions_on_slave.
                     # Since the slave has been marked for shutdown, we need to free the executor.
-                    self._free_slave_executor(slave)
+                    self._release_dispatch_slot(slave)
 
         except Empty:
-            self._free_slave_executor(slave)
+            if self._release_atoms_from_running_subjob():
+                self.execute_next_subjob_or_free_executor(slave)
+            elif self._build.is_atomizing:
+                self._wait_for_more_subjobs(slave)
+            elif not self._execute_straggler_subjob(slave):
+                self._release_dispatch_slot(slave)
+                self._schedule_straggler_check()
+
+    def execute_subjobs_on_waiting_slaves(self):
+        """
+        Send subjobs to the dispatch slots that have been waiting for the atomizers to output more subjobs. This is
+        called each time a build that is still atomizing has added subjobs, and once more when its atomizers have
+        exited, at which point the slots that get no subjob are released.
+        """
+        with self._subjob_assignment_lock:
+            waiting_slaves = self._slaves_waiting_for_subjobs
+            self._slaves_waiting_for_subjobs = []
+        for slave in waiting_slaves:
+            self.execute_next_subjob_or_free_executor(slave)
+
+    def _wait_for_more_subjobs(self, slave):
+        """
+        Keep one of the slave's dispatch slots until the atomizers of the build output more subjobs.
+
+        :type slave: Slave
+        """
+        with self._subjob_assignment_lock:
+            # Subjobs may have been added (or atomization may have finished) since the queue was found empty.
+            if self._build.is_atomizing and self._build._unstarted_subjobs.empty():
+                self._slaves_waiting_for_subjobs.append(slave)
+                return
+        self.execute_next_subjob_or_free_executor(slave)
+
+    def _take_unstarted_subjob(self, slave):
+        """
+        Take the unstarted subjob to send to the specified slave off the queue. Queued subjobs that already have a
+        result are dropped: a subjob requeued by remove_dead_slave() is completed if the lost slave's result arrives
+        late, and must not be sent again.
+
+        :type slave: Slave
+        :raises Empty: if there are no unstarted subjobs
+        :rtype: app.master.subjob.Subjob
+        """
+        while True:
+            subjob = self._take_queued_subjob(slave)
+            if not subjob.is_result_received():
+                return subjob
+            self._logger.info('Not sending subjob {} (build {}) since its result has already been received.',
+                              subjob.subjob_id(), self.build_id)
+
+    def _take_queued_subjob(self, slave):
+        """
+        Take the next subjob for the specified slave off the queue. The largest remaining subjobs go to the fastest
+        slaves: if the build's slaves differ in speed (see Slave.speed_factor), the unstarted subjobs are ranked by
+        expected time and the slave gets the subjob whose rank matches the slave's own rank among the build's slaves.
+        Otherwise, subjobs are sent in the order they were queued.
+
+        :type slave: Slave
+        :raises Empty: if there are no unstarted subjobs
+        :rtype: app.master.subjob.Subjob
+        """
+        unstarted_subjobs = self._build._unstarted_subjobs
+        speed_factors = [allocated_slave.speed_factor for allocated_slave in self._slaves_allocated]
+        if not speed_factors or min(speed_factors) == max(speed_factors):
+            return unstarted_subjobs.get(block=False)
+
+        fraction_of_slaves_faster = sum(1 for speed_factor in speed_factors
+                                        if speed_factor > slave.speed_factor) / len(speed_factors)
+        with unstarted_subjobs.mutex:
+            queued_subjobs = unstarted_subjobs.queue
+            if not queued_subjobs:
+                raise Empty
+            if any(subjob.expected_time() is None for subjob in queued_subjobs):
+                index = 0
+            else:
+                indices_by_decreasing_time = sorted(range(len(queued_subjobs)),
+                                                    key=lambda i: queued_subjobs[i].expected_time(), reverse=True)
+                index = indices_by_decreasing_time[int(fraction_of_slaves_faster * len(queued_subjobs))]
+            subjob = queued_subjobs[index]
+            del queued_subjobs[index]
+            unstarted_subjobs.not_full.notify()
+        return subjob
+
+    def _release_atoms_from_running_subjob(self):
+        """
+        Ask the slave executing the subjob with the most remaining work to stop after the atom it is currently
+        executing. The atoms it releases are split off into a new subjob on the unstarted subjob queue.
+
+        The slave is asked outside of the subjob assignment lock, since it is a network call and every dispatch for the
+        build takes the lock. The slave may report its result for the truncated subjob before it responds here, in
+        which case Build.complete_subjob() has already split off the released atoms.
+
+        :return: whether a new subjob was queued
+        :rtype: bool
+        """
+        if not Configuration['dynamic_subjob_splitting'] or self._build.is_finished:
+            return False
+
+        with self._subjob_assignment_lock:
+            running_subjobs = [subjob for subjob in self._build.all_subjobs()
+                               if subjob.is_executing() and len(subjob.atoms) > 1 and not subjob.speculative_slaves
+                               and subjob.subjob_id() not in self._subjob_ids_with_released_atoms]
+            if not running_subjobs:
+                return False
+
+            if all(subjob.expected_time() is not None for subjob in running_subjobs):
+                subjob = max(running_subjobs, key=lambda subjob: subjob.expected_time() - subjob.elapsed_time())
+            else:
+                subjob = max(running_subjobs, key=lambda subjob: len(subjob.atoms))
+            # Each subjob is only asked once, since a slave that cannot release atoms now will not be able to later.
+            self._subjob_ids_with_released_atoms.add(subjob.subjob_id())
+
+        num_atoms_to_keep = subjob.slave.release_unstarted_atoms(subjob)
+        if num_atoms_to_keep is None:
+            return False
+        return self._build.split_subjob(subjob, num_atoms_to_keep) is not None
+
+    def _execute_straggler_subjob(self, slave):
+        """
+        Send a copy of the worst straggler subjob to the specified slave.
+
+        :type slave: Slave
+        :return: whether a subjob was sent to the slave
+        :rtype: bool
+        """
+        with self._subjob_assignment_lock:
+            subjob = self._next_straggler_subjob(slave)
+            if subjob is None:
+                return False
+            self._logger.info('Speculatively re-executing subjob {} (build {}) on slave {} after {:.1f}s '
+                              '(expected {:.1f}s).', subjob.subjob_id(), subjob.build_id(), slave.url,
+                              subjob.elapsed_time(), subjob.expected_time())
+            try:
+                slave.start_subjob(subjob)
+            except (DeadSlaveError, SlaveMarkedForShutdownError):
+                return False
+            subjob.mark_speculatively_executing(slave)
+        return True
+
+    def _next_straggler_subjob(self, slave=None):
+        """
+        Find the subjob that has overrun its expected time by the largest factor, considering only subjobs that have
+        run for longer than the configured speculative_execution_multiplier times their expected time and that have
+        not already been re-executed.
+
+        :param slave: the slave that would run the copy; subjobs already running on this slave are not considered
+        :type slave: Slave | None
+        :rtype: app.master.subjob.Subjob | None
+        """
+        multiplier = Configuration['speculative_execution_multiplier']
+        if not multiplier or self._build.is_finished:
+            return None
+
+        straggler, straggler_overrun = None, multiplier
+        for subjob in self._build.all_subjobs():
+            if not subjob.is_executing() or subjob.speculative_slaves or subjob.slave is slave:
+                continue
+            expected_time = subjob.expected_time()
+            if not expected_time:
+                continue
+            overrun = subjob.elapsed_time() / expected_time
+            if overrun > straggler_overrun:
+                straggler, straggler_overrun = subjob, overrun
+        return straggler
+
+    def _schedule_straggler_check(self):
+        """
+        Once the unstarted subjob queue has run dry, the build's executors are freed as they finish. A subjob that is
+        still running may only become a straggler after that, so schedule a check for the moment the first running
+        subjob overruns its expected time. If there is a straggler by then, the build waits for slaves again so that
+        the slave allocator can hand it an executor to re-execute the straggler on.
+        """
+        multiplier = Configuration['speculative_execution_multiplier']
+        if not multiplier or self._build.is_finished:
+            return
+
+        # Subjobs that have already overrun are picked up as soon as an executor becomes available, so only subjobs
+        # that will overrun in the future need a check scheduled.
+        seconds_until_overrun = [subjob.expected_time() * multiplier - subjob.elapsed_time()
+                                 for subjob in self._build.all_subjobs()
+                                 if subjob.is_executing() and not subjob.speculative_slaves and subjob.expected_time()]
+        seconds_until_overrun = [seconds for seconds in seconds_until_overrun if seconds > 0]
+        if not seconds_until_overrun:
+            return
+
+        with self._subjob_assignment_lock:
+            if self._straggler_check_timer is not None and self._straggler_check_timer.is_alive():
+                return
+            self._straggler_check_timer = Timer(min(seconds_until_overrun), self._check_for_stragglers)
+            self._straggler_check_timer.daemon = True
+            self._straggler_check_timer.start()
+
+    def _check_for_stragglers(self):
+        """
+        Timer callback for _schedule_straggler_check().
+        """
+        self._straggler_check_timer = None
+        if self.needs_more_slaves():
+            self._scheduler_pool.add_build_waiting_for_slaves(self._build)
+        else:
+            self._schedule_straggler_check()
+
+    def _should_reclaim_slave(self, slave):
+        """
+        Determine whether the specified slave should stop receiving subjobs from this build so that a build with a
+        higher priority can use it.
+
+        :type slave: Slave
+        :rtype: bool
+        """
+        if slave.id in self._slave_ids_being_reclaimed:
+            return True
+        if self._build._unstarted_subjobs.empty():
+            return False  # The slave will be torn down soon anyway.
+
+        num_executors_for_slave = self._num_executors_allocated_by_slave_id.get(slave.id, 0)
+        if self._scheduler_pool.reclaim_executors_for_higher_priority_builds(self.priority, num_executors_for_slave):
+            self._slave_ids_being_reclaimed.add(slave.id)
+            return True
+        return False
+
+    def remove_dead_slave(self, slave):
+        """
+        Forget about a slave that has been lost (e.g., it stopped sending heartbeats). The subjobs that were executing
+        on it are put back on the unstarted subjob queue so that other slaves can execute them, and the build waits for
+        slaves to replace the lost executors.
+
+        :type slave: Slave
+        """
+        if self._project_distribution_tree is not None:
+            self._project_distribution_tree.remove_slave(slave)
+        with self._subjob_assignment_lock:
+            if slave.id not in self._num_executors_allocated_by_slave_id:
+                return  # The slave was not allocated to this build (or has already been removed).
+
+            num_executors_for_slave = self._num_executors_allocated_by_slave_id.pop(slave.id)
+            if self._num_dispatch_slots_by_slave_id.pop(slave.id, None) is not None:
+                self._num_executors_in_use -= num_executors_for_slave  # Subjob executions had begun on the slave.
+            self._num_executors_allocated -= num_executors_for_slave
+            try:
+                self._slaves_allocated.remove(slave)
+            except ValueError:
+                pass
+            if slave.id in self._slave_ids_being_reclaimed:
+                self._scheduler_pool.release_reclaimed_executors(num_executors_for_slave)
+                self._slave_ids_being_reclaimed.discard(slave.id)
+
+            for subjob in self._build.all_subjobs():
+                executing_slaves = [subjob.slave] + subjob.speculative_slaves
+                if not subjob.is_executing() or slave not in executing_slaves:
+                    continue
+                if slave in subjob.speculative_slaves:
+                    subjob.speculative_slaves.remove(slave)
+                if any(other_slave is not slave and other_slave.is_alive() for other_slave in executing_slaves):
+                    continue  # Another copy of the subjob is still executing and will report back.
+
+                self._logger.warning('Requeuing subjob {} (build {}) since {} was lost.',
+                                     subjob.subjob_id(), self.build_id, slave)
+                subjob.mark_not_started()
+                self._build._unstarted_subjobs.put(subjob)
+
+        if self.needs_more_slaves():
+            self._scheduler_pool.add_build_waiting_for_slaves(self._build)
+
+    def _release_dispatch_slot(self, slave):
+        """
+        Stop using one of the slave's dispatch slots for this build. Once the slave has fewer dispatch slots left than
+        executors allocated to this build, one of the executors is freed.
+
+        :type slave: Slave
+        """
+        num_dispatch_slots = self._num_dispatch_slots_by_slave_id.get(slave.id)
+        if num_dispatch_slots is not None:
+            num_dispatch_slots -= 1
+            self._num_dispatch_slots_by_slave_id[slave.id] = num_dispatch_slots
+            if num_dispatch_slots >= self._num_executors_allocated_by_slave_id.get(slave.id, 0):
+                return  # Every executor on the slave still has a subjob dispatched to it.
+        self._free_slave_executor(slave)
 
     def _free_slave_executor(self, slave):
-        num_executors_in_use = slave.free_executor()
-        if num_executors_in_use == 0:
+        """
+        Stop using one of the slave's executors for this build. The executor is released so that the slave can offer
+        it to other builds right away; once this build is using none of the slave's executors, the build is torn down
+        on the slave.
+
+        :type slave: Slave
+        """
+        slave.free_executor()
+        num_executors_for_slave = self._num_executors_allocated_by_slave_id.get(slave.id, 0)
+        if num_executors_for_slave == 0:
+            return  # We have already deallocated this slave, no need to teardown
+
+        self._num_executors_in_use -= 1
+        self._num_executors_allocated -= 1
+        num_executors_for_slave -= 1
+        if num_executors_for_slave > 0:
+            self._num_executors_allocated_by_slave_id[slave.id] = num_executors_for_slave
+            slave.release_executor(self.build_id)
+            self._scheduler_pool.add_slave_with_unallocated_executors(slave)
+        else:
+            self._num_executors_allocated_by_slave_id.pop(slave.id)
+            self._num_dispatch_slots_by_slave_id.pop(slave.id, None)
             try:
                 self._slaves_allocated.remove(slave)
             except ValueError:
-                pass  # We have already deallocated this slave, no need to teardown
-            else:
-                slave.teardown()
-                # If all slaves are removed from a build that isn't done, but had already started, then we must
-                # make sure that when slave resources are available again, that this build them allocated.
-                # https://github.com/box/ClusterRunner/issues/313
-                if len(self._slaves_allocated) == 0 and self.needs_more_slaves():
-                    self._scheduler_pool.add_build_waiting_for_slaves(self._build)
+                pass
+            slave.teardown(self.build_id)
+
+        if slave.id in self._slave_ids_being_reclaimed:
+            self._scheduler_pool.release_reclaimed_executors(1)
+            if num_executors_for_slave == 0:
+                self._slave_ids_being_reclaimed.discard(slave.id)
+
+        # If slaves are removed from a build that isn't done, but had already started (e.g., because they were
+        # reclaimed by a higher priority build), then we must make sure that when slave resources are available
+        # again, that this build gets them allocated.
+        # https://github.com/box/ClusterRunner/issues/313
+        if self.needs_more_slaves():
+            self._scheduler_pool.add_build_waiting_for_slaves(self._build)
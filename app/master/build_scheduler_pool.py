@@ -1,5 +1,4 @@
-from queue import Queue
-from threading import Lock
+from threading import Condition, Lock
 
 from app.master.build_scheduler import BuildScheduler
 
@@ -9,11 +8,17 @@ class BuildSchedulerPool(object):
     A BuildSchedulerPool creates and manages a group of BuildScheduler instances.
     Since there is a one-to-one relationship between Build and BuildScheduler, this
     class exists to make it easier to create and manage scheduler instances.
+
+    The pool also tracks which builds are currently waiting for slaves. All waiting builds are considered together
+    when a slave becomes idle, so that one large build cannot block the builds queued behind it.
     """
     def __init__(self):
         self._schedulers_by_build_id = {}
         self._scheduler_creation_lock = Lock()
-        self._builds_waiting_for_slaves = Queue()
+        self._schedulers_waiting_for_slaves = []
+        self._waiting_for_slaves_condition = Condition()
+        self._num_executors_being_reclaimed = 0
+        self._unallocated_executors_callback = None
 
     def get(self, build):
         """
@@ -29,20 +34,109 @@ class BuildSchedulerPool(object):
 
         return scheduler
 
-    def next_prepared_build_scheduler(self):
+    def wait_for_build_waiting_for_slaves(self):
         """
-        Get the scheduler for the next build that has successfully completed build preparation.
+        Block until at least one build is waiting for slaves.
 
-        This is a blocking call--if there are no more builds that have completed build preparation and this
-        method gets invoked, the execution will hang until the next build has completed build preparation.
+        Builds that no longer need slaves are removed from the waiting list while checking. A build that later needs
+        slaves again will be re-added through add_build_waiting_for_slaves().
+        """
+        with self._waiting_for_slaves_condition:
+            while not self._prune_schedulers_waiting_for_slaves():
+                self._waiting_for_slaves_condition.wait()
 
-        :rtype: BuildScheduler
+    def next_fair_share_build_scheduler(self, slave=None):
+        """
+        Get the scheduler of the waiting build that should receive the next idle slave, or None if no build currently
+        needs slaves. If a slave is specified, only builds that can share that slave with the builds already running
+        on it are considered.
+
+        Builds with the highest priority always go first. Within a priority, slaves are handed out by max-min fairness
+        over executors: the waiting build with the fewest executors allocated gets the next slave. Ties are broken in
+        favor of the build that started waiting first. This means a small build queued behind a huge one gets its
+        first slave as soon as one becomes idle, instead of waiting for the huge build to be fully satisfied.
+
+        :type slave: app.master.slave.Slave | None
+        :rtype: BuildScheduler | None
+        """
+        with self._waiting_for_slaves_condition:
+            waiting_schedulers = self._prune_schedulers_waiting_for_slaves()
+            if slave is not None:
+                waiting_schedulers = [scheduler for scheduler in waiting_schedulers
+                                      if slave.can_be_shared_with(scheduler.build)]
+            if not waiting_schedulers:
+                return None
+            # min() returns the first minimal element, which preserves first-come-first-serve ordering for ties.
+            return min(waiting_schedulers,
+                       key=lambda scheduler: (-scheduler.priority, scheduler.num_executors_allocated))
+
+    def reclaim_executors_for_higher_priority_builds(self, priority, num_executors):
+        """
+        Decide whether a slave running a build with the given priority should be reclaimed (torn down and made
+        available to the allocator) so that a waiting build with a higher priority can use it.
+
+        Only as many executors as the higher-priority waiting builds still want are reclaimed. Executors on slaves
+        that are already being reclaimed count towards that demand until release_reclaimed_executors() is called.
+
+        :param priority: the priority of the build that currently owns the slave
+        :type priority: int
+        :param num_executors: the number of executors the slave contributes to its build
+        :type num_executors: int
+        :return: whether the caller should stop feeding subjobs to the slave so it can be reclaimed
+        :rtype: bool
+        """
+        with self._waiting_for_slaves_condition:
+            num_executors_wanted = sum(scheduler.num_executors_wanted()
+                                       for scheduler in self._prune_schedulers_waiting_for_slaves()
+                                       if scheduler.priority > priority)
+            if num_executors_wanted <= self._num_executors_being_reclaimed:
+                return False
+            self._num_executors_being_reclaimed += num_executors
+            return True
+
+    def release_reclaimed_executors(self, num_executors):
         """
-        build = self._builds_waiting_for_slaves.get()
-        return self.get(build)
+        Called once a slave that was reclaimed via reclaim_executors_for_higher_priority_builds() has been torn down.
+
+        :type num_executors: int
+        """
+        with self._waiting_for_slaves_condition:
+            self._num_executors_being_reclaimed = max(0, self._num_executors_being_reclaimed - num_executors)
 
     def add_build_waiting_for_slaves(self, build):
         """
         :type build: app.master.build.Build
         """
-        self._builds_waiting_for_slaves.put(build)
+        scheduler = self.get(build)
+        with self._waiting_for_slaves_condition:
+            if scheduler not in self._schedulers_waiting_for_slaves:
+                self._schedulers_waiting_for_slaves.append(scheduler)
+            self._waiting_for_slaves_condition.notify_all()
+
+    def set_unallocated_executors_callback(self, callback):
+        """
+        Register the callable that is notified when a build releases some, but not all, of its executors on a slave.
+        The slave allocator uses this to offer those executors to other builds while the slave is still busy.
+
+        :type callback: callable
+        """
+        self._unallocated_executors_callback = callback
+
+    def add_slave_with_unallocated_executors(self, slave):
+        """
+        :type slave: app.master.slave.Slave
+        """
+        if self._unallocated_executors_callback is not None:
+            self._unallocated_executors_callback(slave)
+
+    def _prune_schedulers_waiting_for_slaves(self):
+        """
+        Remove schedulers from the waiting list whose builds do not need any more slaves. This must be called while
+        holding self._waiting_for_slaves_condition.
+
+        :return: the remaining schedulers that are waiting for slaves, in the order they started waiting
+        :rtype: list[BuildScheduler]
+        """
+        self._schedulers_waiting_for_slaves = [scheduler for scheduler in self._schedulers_waiting_for_slaves
+                                               if scheduler.needs_more_slaves()]
+        return self._schedulers_waiting_for_slaves
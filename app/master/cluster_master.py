@@ -1,4 +1,5 @@
 from collections import OrderedDict
+from functools import partial
 import os
 
 from app.common.cluster_service import ClusterService
@@ -8,8 +9,10 @@ from app.master.build_request_handler import BuildRequestHandler
 from app.master.build_scheduler_pool import BuildSchedulerPool
 from app.master.slave import Slave
 from app.master.slave_allocator import SlaveAllocator
+from app.master.slave_liveness_monitor import SlaveLivenessMonitor
 from app.slave.cluster_slave import SlaveState
 from app.util.conf.configuration import Configuration
+from app.util.dispatch_pool import DispatchPool
 from app.util.exceptions import BadRequestError, ItemNotFoundError, ItemNotReadyError
 from app.util import fs
 from app.util.log import get_logger
@@ -26,12 +29,21 @@ class ClusterMaster(ClusterService):
         self._logger = get_logger(__name__)
         self._master_results_path = Configuration['results_directory']
         self._all_slaves_by_url = {}
+        self._slave_dispatch_pool = DispatchPool(max_workers=Configuration['max_slave_dispatch_threads'],
+                                                 name='SlaveDispatch')
         self._all_builds_by_id = OrderedDict()
         self._scheduler_pool = BuildSchedulerPool()
-        self._build_request_handler = BuildRequestHandler(self._scheduler_pool)
+        self._build_request_handler = BuildRequestHandler(self._scheduler_pool, self._executor_speed_factors)
         self._build_request_handler.start()
         self._slave_allocator = SlaveAllocator(self._scheduler_pool)
         self._slave_allocator.start()
+        self._slave_liveness_monitor = SlaveLivenessMonitor(
+            get_slaves=lambda: list(self._all_slaves_by_url.values()),
+            dead_slave_callback=self._handle_dead_slave,
+            probe_interval=Configuration['slave_liveness_probe_interval'],
+            heartbeat_timeout=Configuration['heartbeat_interval'] * Configuration['max_missed_heartbeats'],
+        )
+        self._slave_liveness_monitor.start()
 
         # Asynchronously delete (but immediately rename) all old builds when master starts.
         # Remove this if/when build numbers are unique across master starts/stops
@@ -57,6 +69,7 @@ class ClusterMaster(ClusterService):
         return {
             'status': self._get_status(),
             'slaves': slaves_representation,
+            'slave_dispatch_pool': self._slave_dispatch_pool.api_representation(),
         }
 
     def builds(self):
@@ -126,40 +139,40 @@ class ClusterMaster(ClusterService):
             self._logger.warning('Slave requested to connect to master, even though previously connected as {}. ' +
                                  'Removing existing slave instance from the master\'s bookkeeping.', old_slave)
 
-            # If a slave has requested to reconnect, we have to assume that whatever build the dead slave was
-            # working on no longer has valid results.
-            if old_slave.current_build_id is not None:
-                self._logger.info('{} has build [{}] running on it. Attempting to cancel build.', old_slave,
-                                  old_slave.current_build_id)
+            # If a slave has requested to reconnect, we have to assume that whatever builds the dead slave was
+            # working on no longer have valid results.
+            for build_id in old_slave.current_build_ids():
+                self._logger.info('{} has build [{}] running on it. Attempting to cancel build.', old_slave, build_id)
                 try:
-                    build = self.get_build(old_slave.current_build_id)
+                    build = self.get_build(build_id)
                     build.cancel()
-                    self._logger.info('Cancelled build {} due to dead slave {}', old_slave.current_build_id,
-                                      old_slave)
+                    self._logger.info('Cancelled build {} due to dead slave {}', build_id, old_slave)
                 except ItemNotFoundError:
-                    self._logger.info('Failed to find build {} that was running on {}', old_slave.current_build_id,
-                                      old_slave)
+                    self._logger.info('Failed to find build {} that was running on {}', build_id, old_slave)
 
-        slave = Slave(slave_url, num_executors, slave_session_id)
+        slave = Slave(slave_url, num_executors, slave_session_id, dispatch_pool=self._slave_dispatch_pool)
         self._all_slaves_by_url[slave_url] = slave
         self._slave_allocator.add_idle_slave(slave)
         self._logger.info('Slave on {} connected to master with {} executors. (id: {})',
                           slave_url, num_executors, slave.id)
         return {'slave_id': str(slave.id)}
 
-    def handle_slave_state_update(self, slave, new_slave_state):
+    def handle_slave_state_update(self, slave, new_slave_state, build_id=None):
         """
         Execute logic to transition the specified slave to the given state.
 
         :type slave: Slave
         :type new_slave_state: SlaveState
+        :param build_id: the build the state change applies to, since a slave can be shared by several builds. If
+            None, the most recently allocated build on the slave is assumed.
+        :type build_id: int | None
         """
         slave_transition_functions = {
             SlaveState.DISCONNECTED: self._disconnect_slave,
             SlaveState.SHUTDOWN: self._graceful_shutdown_slave,
             SlaveState.IDLE: self._slave_allocator.add_idle_slave,
-            SlaveState.SETUP_COMPLETED: self._handle_setup_success_on_slave,
-            SlaveState.SETUP_FAILED: self._handle_setup_failure_on_slave,
+            SlaveState.SETUP_COMPLETED: partial(self._handle_setup_success_on_slave, build_id=build_id),
+            SlaveState.SETUP_FAILED: partial(self._handle_setup_failure_on_slave, build_id=build_id),
         }
 
         if new_slave_state not in slave_transition_functions:
@@ -193,32 +206,60 @@ class ClusterMaster(ClusterService):
 
         :type slave: Slave
         """
-        # Mark slave dead. We do not remove it from the list of all slaves. We also do not remove it from idle_slaves;
-        # that will happen during slave allocation.
-        slave.mark_dead()
-        # todo: Fail/resend any currently executing subjobs still executing on this slave.
+        # Mark slave dead. We do not remove it from the list of all slaves.
+        self._handle_dead_slave(slave)
         self._logger.info('Slave on {} was disconnected. (id: {})', slave.url, slave.id)
 
-    def _handle_setup_success_on_slave(self, slave):
+    def handle_slave_heartbeat(self, slave, executors_state, cached_sources=None):
+        """
+        Record a heartbeat sent by a slave. A slave that stops sending heartbeats is considered dead by the slave
+        liveness monitor.
+
+        :type slave: Slave
+        :param executors_state: the api representations of the slave's executors
+        :type executors_state: list[dict]
+        :param cached_sources: the commits the slave has fetched, keyed by the url of the repo they were fetched from
+        :type cached_sources: dict[str, list[str]] | None
+        """
+        slave.record_heartbeat(executors_state, cached_sources)
+
+    def _handle_dead_slave(self, slave):
+        """
+        Respond to a slave being lost: it was disconnected or found dead by the liveness monitor. The subjobs that were
+        executing on it are requeued so that the builds using it can carry on with other slaves.
+
+        :type slave: Slave
+        """
+        build_ids = slave.current_build_ids()
+        slave.mark_dead()
+        self._slave_allocator.remove_idle_slave(slave)
+        for build_id in build_ids:
+            build = self._all_builds_by_id.get(build_id)
+            if build is not None and not build.is_finished:
+                self._scheduler_pool.get(build).remove_dead_slave(slave)
+
+    def _handle_setup_success_on_slave(self, slave, build_id=None):
         """
         Respond to successful build setup on a slave. This starts subjob executions on the slave. This should be called
         once after the specified slave has already run build_setup commands for the specified build.
 
         :type slave: Slave
+        :type build_id: int | None
         """
-        build = self.get_build(slave.current_build_id)
+        build = self.get_build(build_id if build_id is not None else slave.current_build_id)
         scheduler = self._scheduler_pool.get(build)
         scheduler.begin_subjob_executions_on_slave(slave)
 
-    def _handle_setup_failure_on_slave(self, slave):
+    def _handle_setup_failure_on_slave(self, slave, build_id=None):
         """
         Respond to failed build setup on a slave. This should put the slave back into a usable state.
 
         :type slave: Slave
+        :type build_id: int | None
         """
-        build = self.get_build(slave.current_build_id)
+        build = self.get_build(build_id if build_id is not None else slave.current_build_id)
         build.mark_setup_failed('Unable to setup build on slave.')
-        slave.teardown()
+        slave.teardown(build.build_id())
 
     def handle_request_for_new_build(self, build_params):
         """
@@ -240,6 +281,8 @@ class ClusterMaster(ClusterService):
             success = True
         elif not build_request.is_valid_type():
             response = {'error': 'Invalid build request type.'}
+        elif not build_request.is_valid_priority():
+            response = {'error': 'Invalid build priority. The priority must be an integer.'}
         else:
             required_params = build_request.required_parameters()
             response = {'error': 'Missing required parameter. Required parameters: {}'.format(required_params)}
@@ -281,11 +324,44 @@ class ClusterMaster(ClusterService):
         # If the build has been canceled or failed, don't work on the next subjob.
         if not build.is_finished or build.has_error:
             try:
-                build.complete_subjob(subjob_id, payload)
+                if build.complete_subjob(subjob_id, payload):
+                    self._record_slave_speed(slave, build.subjob(subjob_id))
             finally:
                 scheduler = self._scheduler_pool.get(build)
                 scheduler.execute_next_subjob_or_free_executor(slave)
 
+        elif not build.is_canceled:
+            # A speculatively re-executed subjob can report back after its build has finished. The result is not
+            # needed, but the executor still has to be freed so that the slave is torn down.
+            self._logger.info('Ignoring late result for subjob {} of finished build {}.', subjob_id, build_id)
+            scheduler = self._scheduler_pool.get(build)
+            scheduler.execute_next_subjob_or_free_executor(slave)
+
+    def _record_slave_speed(self, slave, subjob):
+        """
+        Compare the time it took the slave to execute the atoms of a completed subjob with their expected times, so
+        that the slave's speed factor reflects how fast it actually is.
+
+        :type slave: Slave
+        :type subjob: app.master.subjob.Subjob
+        """
+        subjob.read_timings()
+        timed_atoms = [atom for atom in subjob.atoms if atom.expected_time and atom.actual_time is not None]
+        if timed_atoms:
+            slave.record_atom_times(expected_time=sum(atom.expected_time for atom in timed_atoms),
+                                    actual_time=sum(atom.actual_time for atom in timed_atoms))
+
+    def _executor_speed_factors(self):
+        """
+        :return: the speed factor of each executor of the connected slaves, fastest first
+        :rtype: list[float]
+        """
+        speed_factors = []
+        for slave in list(self._all_slaves_by_url.values()):
+            if slave.is_alive() and not slave.is_shutdown():
+                speed_factors.extend([slave.speed_factor] * slave.num_executors)
+        return sorted(speed_factors, reverse=True)
+
     def get_build(self, build_id):
         """
         Returns a build by id
@@ -10,6 +10,7 @@ COMMANDS = 'commands'
 ATOMIZERS = 'atomizers'
 MAX_EXECUTORS = 'max_executors'
 MAX_EXECUTORS_PER_SLAVE = 'max_executors_per_slave'
+SPARSE_CHECKOUT = 'sparse_checkout'
 
 
 class JobConfig(object):
@@ -18,7 +19,8 @@ class JobConfig(object):
     """
     DEFAULT_MAX_EXECUTORS = sys.maxsize
 
-    def __init__(self, name, setup_build, teardown_build, command, atomizer, max_executors, max_executors_per_slave):
+    def __init__(self, name, setup_build, teardown_build, command, atomizer, max_executors, max_executors_per_slave,
+                 sparse_checkout_paths=None):
         """
         :type name: str
         :type setup_build: list[str] | None
@@ -27,6 +29,8 @@ class JobConfig(object):
         :type atomizer: Atomizer
         :type max_executors: int | None
         :type max_executors_per_slave: int | None
+        :param sparse_checkout_paths: the paths in the repo that slaves need to check out, or None for the whole repo
+        :type sparse_checkout_paths: list[str] | None
         """
         self.name = name
         self.setup_build = setup_build
@@ -35,6 +39,7 @@ class JobConfig(object):
         self.atomizer = atomizer
         self.max_executors = max_executors
         self.max_executors_per_slave = max_executors_per_slave
+        self.sparse_checkout_paths = sparse_checkout_paths
 
     @classmethod
     def construct_from_dict(cls, name, config_dict):
@@ -68,6 +73,7 @@ class JobConfig(object):
             ATOMIZERS: [(list, dict)],  # (list, dict) means this field should be a list of dicts
             MAX_EXECUTORS: [int],
             MAX_EXECUTORS_PER_SLAVE: [int],
+            SPARSE_CHECKOUT: [(list, str)],
         }
 
         if not isinstance(config_dict, dict):
@@ -110,7 +116,9 @@ class JobConfig(object):
         atomizer = Atomizer(config_dict[ATOMIZERS])
         max_executors = config_dict.get(MAX_EXECUTORS, cls.DEFAULT_MAX_EXECUTORS)
         max_executors_per_slave = config_dict.get(MAX_EXECUTORS_PER_SLAVE, cls.DEFAULT_MAX_EXECUTORS)
-        return cls(name, setup_build, teardown_build, command, atomizer, max_executors, max_executors_per_slave)
+        sparse_checkout_paths = config_dict.get(SPARSE_CHECKOUT)
+        return cls(name, setup_build, teardown_build, command, atomizer, max_executors, max_executors_per_slave,
+                   sparse_checkout_paths)
 
     @classmethod
     def _shell_command_list_to_single_command(cls, commands):
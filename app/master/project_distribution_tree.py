@@ -0,0 +1,121 @@
+from threading import Lock
+
+from app.util import log
+
+
+class ProjectDistributionTree(object):
+    """
+    Decides where each of a build's slaves gets the project from, so that the master does not have to send it to all
+    of the build's slaves at once. Slaves that have finished setting up the build serve the project to the slaves that
+    are set up after them, so the slaves form a tree rooted at the master in which each source (the master or a slave)
+    serves at most fan_out slaves at a time. The number of slaves that have the project then grows exponentially, and
+    the master only serves a few slaves in each round rather than every slave.
+
+    Slaves that cannot get a source right away are set up once a source is free. Slaves that already have the project
+    (see Slave.setup_cost()) do not fetch anything, so they are set up right away and do not use a source.
+    """
+    _MASTER = None  # the key of the master in the sources, since the master is not a Slave
+
+    def __init__(self, fan_out):
+        """
+        :param fan_out: the maximum number of slaves that each source serves the project to at the same time
+        :type fan_out: int
+        """
+        self._logger = log.get_logger(__name__)
+        self._fan_out = fan_out
+        self._num_slaves_served_by_source = {self._MASTER: 0}
+        self._source_by_slave = {}  # the slaves that are getting the project, and where they are getting it from
+        self._slaves_waiting_for_source = []  # (slave, start_setup) pairs, in the order they were added
+        self._lock = Lock()
+
+    def add_slave(self, slave, start_setup, has_project=False):
+        """
+        Start setting up the slave once there is a source that it can get the project from.
+
+        :type slave: app.master.slave.Slave
+        :param start_setup: starts setting up the slave; called with the slave to get the project from, or with None to
+            get it from the master
+        :type start_setup: callable
+        :param has_project: whether the slave already has the project, in which case it does not need a source
+        :type has_project: bool
+        """
+        if has_project:
+            start_setup(None)
+            return
+        with self._lock:
+            self._slaves_waiting_for_source.append((slave, start_setup))
+            setups_to_start = self._assign_sources()
+        self._start_setups(setups_to_start)
+
+    def mark_slave_as_set_up(self, slave):
+        """
+        Record that the slave has the project, so that it can serve it to other slaves, and free up its own source.
+
+        :type slave: app.master.slave.Slave
+        """
+        with self._lock:
+            self._release_source_of(slave)
+            self._num_slaves_served_by_source.setdefault(slave, 0)
+            setups_to_start = self._assign_sources()
+        self._start_setups(setups_to_start)
+
+    def remove_slave(self, slave):
+        """
+        Forget about a slave that has been lost. The slaves that were getting the project from it fall back to getting
+        it from the master (see Git.peer_param_overrides()).
+
+        :type slave: app.master.slave.Slave
+        """
+        with self._lock:
+            self._slaves_waiting_for_source = [(waiting_slave, start_setup)
+                                               for waiting_slave, start_setup in self._slaves_waiting_for_source
+                                               if waiting_slave is not slave]
+            self._release_source_of(slave)
+            self._num_slaves_served_by_source.pop(slave, None)
+            setups_to_start = self._assign_sources()
+        self._start_setups(setups_to_start)
+
+    def _release_source_of(self, slave):
+        """
+        The caller must hold the lock.
+
+        :type slave: app.master.slave.Slave
+        """
+        if slave not in self._source_by_slave:
+            return
+        source = self._source_by_slave.pop(slave)
+        if source in self._num_slaves_served_by_source:
+            self._num_slaves_served_by_source[source] -= 1
+
+    def _assign_sources(self):
+        """
+        Assign a free source to each of the waiting slaves, in order, until no source is free. Slaves are preferred
+        over the master as sources, so that the master serves as few slaves as possible. The caller must hold the lock.
+
+        :return: the setups to start, with the source each slave gets the project from
+        :rtype: list[(callable, app.master.slave.Slave, app.master.slave.Slave|None)]
+        """
+        setups_to_start = []
+        while self._slaves_waiting_for_source:
+            free_sources = [source for source, num_slaves_served in self._num_slaves_served_by_source.items()
+                            if num_slaves_served < self._fan_out]
+            if not free_sources:
+                break
+            source = min(free_sources, key=lambda source: (source is self._MASTER,
+                                                           self._num_slaves_served_by_source[source]))
+            slave, start_setup = self._slaves_waiting_for_source.pop(0)
+            self._source_by_slave[slave] = source
+            self._num_slaves_served_by_source[source] += 1
+            setups_to_start.append((start_setup, slave, source))
+        return setups_to_start
+
+    def _start_setups(self, setups_to_start):
+        """
+        Start the setups outside of the lock, since starting a setup sends a request to the slave.
+
+        :type setups_to_start: list[(callable, app.master.slave.Slave, app.master.slave.Slave|None)]
+        """
+        for start_setup, slave, source in setups_to_start:
+            self._logger.info('Setting up {} to get the project from {}.', slave,
+                              'the master' if source is self._MASTER else source)
+            start_setup(source)
@@ -1,9 +1,15 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+from urllib.parse import urlparse
+
 import requests.exceptions
+from tornado import gen
 
 from app.util import analytics, log
 from app.util.counter import Counter
+from app.util.dispatch_pool import DispatchPool
 from app.util.network import Network
-from app.util.safe_thread import SafeThread
 from app.util.secret import Secret
 from app.util.session_id import SessionId
 from app.util.url_builder import UrlBuilder
@@ -13,20 +19,34 @@ class Slave(object):
 
     API_VERSION = 'v1'
     _slave_id_counter = Counter()
+    _SPEED_FACTOR_SMOOTHING = 0.3  # the weight of each new measurement in the moving average of the speed factor
+    _MIN_SPEED_SAMPLE, _MAX_SPEED_SAMPLE = 0.1, 10.0  # measurements are clamped so a single outlier has less effect
 
-    def __init__(self, slave_url, num_executors, slave_session_id=None):
+    def __init__(self, slave_url, num_executors, slave_session_id=None, dispatch_pool=None):
         """
         :type slave_url: str
         :type num_executors: int
         :type slave_session_id: str
+        :param dispatch_pool: the pool to send subjobs to the slave on, usually shared by all slaves. If None, the
+            slave gets a pool with a single worker thread of its own.
+        :type dispatch_pool: DispatchPool | None
         """
         self.url = slave_url
         self.num_executors = num_executors
         self.id = self._slave_id_counter.increment()
         self._num_executors_in_use = Counter()
         self._network = Network(min_connection_poolsize=num_executors)
-        self.current_build_id = None
+        self._dispatch_pool = dispatch_pool or DispatchPool(max_workers=1, name='Slave{}-Dispatch'.format(self.id))
+        # A slave can be shared by several builds at once; each build is allocated a subset of the slave's executors.
+        self._num_executors_allocated_by_build_id = OrderedDict()
+        self._project_ids_by_build_id = {}
+        self._allocation_lock = Lock()
         self._is_alive = True
+        self._last_liveness_check_time = None
+        self._last_heartbeat_time = None
+        self._executors_state = []  # the state of the slave's executors, as reported in its last heartbeat
+        self._cached_commits_by_repo_url = {}  # the sources the slave has on disk, as reported in its last heartbeat
+        self._speed_factor = 1.0
         self._is_in_shutdown_mode = False
         self._slave_api = UrlBuilder(slave_url, self.API_VERSION)
         self._session_id = slave_session_id
@@ -43,26 +63,130 @@ class Slave(object):
             'num_executors': self.num_executors,
             'num_executors_in_use': self.num_executors_in_use(),
             'current_build_id': self.current_build_id,
+            'current_build_ids': self.current_build_ids(),
+            'num_executors_allocated_by_build_id': dict(self._num_executors_allocated_by_build_id),
             'is_alive': self.is_alive(),
+            'last_liveness_check_time': self._last_liveness_check_time,
+            'last_heartbeat_time': self._last_heartbeat_time,
+            'executors': self._executors_state,
+            'cached_sources': self._cached_commits_by_repo_url,
+            'speed_factor': self._speed_factor,
             'is_in_shutdown_mode': self._is_in_shutdown_mode,
         }
 
-    def mark_as_idle(self):
+    @property
+    def current_build_id(self):
+        """
+        The id of the most recently allocated build that is still using this slave, or None if no build is.
+
+        :rtype: int | None
         """
-        Do bookkeeping when this slave becomes idle.  Error if the slave cannot be idle.
-        If the slave is in shutdown mode, clear the build_id, kill the slave, and raise an error.
+        build_ids = self.current_build_ids()
+        return build_ids[-1] if build_ids else None
+
+    def current_build_ids(self):
+        """
+        The ids of all builds that currently have executors allocated on this slave, in the order they were allocated.
+
+        :rtype: list[int]
         """
-        if self._num_executors_in_use.value() != 0:
-            raise Exception('Trying to mark slave idle while {} executors still in use.',
-                            self._num_executors_in_use.value())
+        with self._allocation_lock:
+            return list(self._num_executors_allocated_by_build_id.keys())
 
-        self.current_build_id = None
+    def num_unallocated_executors(self):
+        """
+        The number of executors on this slave that have not been allocated to any build.
+
+        :rtype: int
+        """
+        with self._allocation_lock:
+            return self.num_executors - sum(self._num_executors_allocated_by_build_id.values())
+
+    def num_executors_allocated_to_build(self, build_id):
+        """
+        :type build_id: int
+        :rtype: int
+        """
+        with self._allocation_lock:
+            return self._num_executors_allocated_by_build_id.get(build_id, 0)
 
+    def can_be_shared_with(self, build):
+        """
+        Whether the specified build can be allocated executors on this slave alongside the builds already using it.
+        Builds of the same project cannot share a slave since they would both fetch into the same repo directory.
+
+        :type build: Build
+        :rtype: bool
+        """
+        with self._allocation_lock:
+            if build.build_id() in self._num_executors_allocated_by_build_id:
+                return False
+            return build.project_type.project_id() not in self._project_ids_by_build_id.values()
+
+    @property
+    def host(self):
+        """
+        :return: the hostname of the slave, without its port
+        :rtype: str
+        """
+        return urlparse(self._slave_api.url()).hostname
+
+    @property
+    def speed_factor(self):
+        """
+        How fast this slave executes atoms relative to their expected (historic) times: 2.0 means that the slave
+        executes atoms in half their expected time. Slaves start out at 1.0.
+
+        :rtype: float
+        """
+        return self._speed_factor
+
+    def record_atom_times(self, expected_time, actual_time):
+        """
+        Update the speed factor with the expected and actual time it took this slave to execute some atoms.
+
+        :param expected_time: the sum of the expected times of the atoms
+        :type expected_time: float
+        :param actual_time: the sum of the times it actually took the slave to execute the atoms
+        :type actual_time: float
+        """
+        if expected_time <= 0 or actual_time <= 0:
+            return
+        speed_sample = min(max(expected_time / actual_time, self._MIN_SPEED_SAMPLE), self._MAX_SPEED_SAMPLE)
+        self._speed_factor += self._SPEED_FACTOR_SMOOTHING * (speed_sample - self._speed_factor)
+
+    def setup_cost(self, build):
+        """
+        Estimate how much work it would be for this slave to fetch the source of the specified build, based on the
+        sources it reported having on disk: 0 if it already has the build's commit, 1 if it has a clone of the build's
+        repo, and 2 if it would have to clone the repo from scratch. Setting up a project type that does not keep a
+        copy of its source costs the same on every slave.
+
+        :type build: Build
+        :rtype: int
+        """
+        expected_source = build.project_type.cached_source()
+        if expected_source is None:
+            return 0
+        repo_url, commit_hash = expected_source
+        # The slave may be told to fetch from somewhere other than the original repo (e.g., from the master's clone).
+        repo_url = build.project_type.slave_param_overrides().get('url', repo_url)
+        cached_commits = self._cached_commits_by_repo_url.get(repo_url)
+        if cached_commits is None:
+            return 2
+        return 0 if commit_hash in cached_commits else 1
+
+    def mark_as_idle(self):
+        """
+        Do bookkeeping when this slave has executors available for new builds.
+        If the slave is in shutdown mode, raise an error, and kill the slave if no builds are using it anymore.
+        """
         if self._is_in_shutdown_mode:
-            self.kill()
+            if self.current_build_id is None:
+                self.kill()
             raise SlaveMarkedForShutdownError
 
-    def setup(self, build, executor_start_index):
+    def setup(self, build, executor_start_index, num_executors=None):
         """
         Execute a setup command on the slave for the specified build. The setup process executes asynchronously on the
         slave and the slave will alert the master when setup is complete and it is ready to start working on subjobs.
@@ -71,25 +195,84 @@ class Slave(object):
         :type build: Build
         :param executor_start_index: The index the slave should number its executors from for this build
         :type executor_start_index: int
+        :param num_executors: The number of this slave's executors to allocate to the build, or None to allocate all
+            executors that are not allocated to other builds
+        :type num_executors: int | None
+        """
+        self.allocate_executors(build, num_executors)
+        self.start_setup(build, executor_start_index)
+
+    def allocate_executors(self, build, num_executors=None):
+        """
+        Allocate this slave's executors to the specified build without setting the slave up for it yet (see
+        start_setup()), so that the executors are not offered to other builds in the meantime.
+
+        :type build: Build
+        :param num_executors: The number of this slave's executors to allocate to the build, or None to allocate all
+            executors that are not allocated to other builds
+        :type num_executors: int | None
+        """
+        with self._allocation_lock:
+            num_unallocated_executors = self.num_executors - sum(self._num_executors_allocated_by_build_id.values())
+            if num_executors is None or num_executors > num_unallocated_executors:
+                num_executors = num_unallocated_executors
+            self._num_executors_allocated_by_build_id[build.build_id()] = num_executors
+            self._project_ids_by_build_id[build.build_id()] = build.project_type.project_id()
+
+    def start_setup(self, build, executor_start_index, peer_slave=None):
+        """
+        Execute a setup command on the slave for a build that its executors have been allocated to.
+
+        :type build: Build
+        :param executor_start_index: The index the slave should number its executors from for this build
+        :type executor_start_index: int
+        :param peer_slave: A slave that has already set up the build, which this slave should get the project from
+            (see ProjectType.peer_param_overrides()), or None to get it as usual
+        :type peer_slave: Slave | None
         """
         slave_project_type_params = build.build_request.build_parameters().copy()
         slave_project_type_params.update(build.project_type.slave_param_overrides())
+        if peer_slave is not None:
+            slave_project_type_params.update(build.project_type.peer_param_overrides(peer_slave.host))
 
         setup_url = self._slave_api.url('build', build.build_id(), 'setup')
         post_data = {
             'project_type_params': slave_project_type_params,
             'build_executor_start_index': executor_start_index,
         }
-
-        self.current_build_id = build.build_id()
         self._network.post_with_digest(setup_url, post_data, Secret.get())
 
-    def teardown(self):
+    def release_executor(self, build_id):
+        """
+        Return one of the executors allocated to the specified build so that it can be allocated to another build.
+
+        :type build_id: int
+        :return: the number of executors that remain allocated to the build
+        :rtype: int
+        """
+        with self._allocation_lock:
+            num_executors = self._num_executors_allocated_by_build_id.get(build_id, 0)
+            if num_executors <= 0:
+                raise Exception('Cannot release executor for build {} on slave {}. None are allocated.'
+                                .format(build_id, self.url))
+            self._num_executors_allocated_by_build_id[build_id] = num_executors - 1
+            return num_executors - 1
+
+    def teardown(self, build_id=None):
         """
-        Tell the slave to run the build teardown
+        Tell the slave to run the build teardown, and release any of the slave's executors that are still allocated
+        to the build.
+
+        :param build_id: The id of the build to tear down, or None to tear down the most recently allocated build
+        :type build_id: int | None
         """
+        build_id = build_id if build_id is not None else self.current_build_id
+        with self._allocation_lock:
+            self._num_executors_allocated_by_build_id.pop(build_id, None)
+            self._project_ids_by_build_id.pop(build_id, None)
+
         if self.is_alive():
-            teardown_url = self._slave_api.url('build', self.current_build_id, 'teardown')
+            teardown_url = self._slave_api.url('build', build_id, 'teardown')
             self._network.post(teardown_url)
         else:
             self._logger.notice('Teardown request to slave {} was not sent since slave is disconnected.', self.url)
@@ -105,7 +288,8 @@ class Slave(object):
             raise SlaveMarkedForShutdownError('Tried to start a subjob on a slave in shutdown mode. ({}, id: {})'
                                               .format(self.url, self.id))
 
-        SafeThread(target=self._async_start_subjob, args=(subjob,)).start()
+        # Subjobs are sent to each slave in the order they were started.
+        self._dispatch_pool.submit(self._async_start_subjob, subjob, key=self.id)
 
     def _async_start_subjob(self, subjob):
         """
@@ -119,6 +303,28 @@ class Slave(object):
         analytics.record_event(analytics.MASTER_TRIGGERED_SUBJOB, executor_id=subjob_executor_id,
                                build_id=subjob.build_id(), subjob_id=subjob.subjob_id(), slave_id=self.id)
 
+    def release_unstarted_atoms(self, subjob):
+        """
+        Ask the slave to stop executing the specified subjob after the atom it is currently executing, so that the
+        subjob's remaining atoms can be executed elsewhere.
+
+        :type subjob: Subjob
+        :return: the number of the subjob's atoms that the slave will still execute, or None if the slave could not
+            release any atoms (e.g., because it has not started executing the subjob yet)
+        :rtype: int | None
+        """
+        if not self.is_alive():
+            return None
+
+        release_url = self._slave_api.url('build', subjob.build_id(), 'subjob', subjob.subjob_id(), 'release_atoms')
+        try:
+            response = self._network.post_with_digest(release_url, {}, Secret.get())
+        except requests.exceptions.ConnectionError:
+            return None
+        if not response.ok:
+            return None
+        return response.json().get('num_atoms_to_execute')
+
     def num_executors_in_use(self):
         return self._num_executors_in_use.value()
 
@@ -134,7 +340,7 @@ class Slave(object):
             raise Exception('Cannot free executor on slave {}. All are free.'.format(self.url))
         return new_count
 
-    def is_alive(self, use_cached=True):
+    def is_alive(self, use_cached=True, timeout=None):
         """
         Is the slave API responsive?
 
@@ -144,33 +350,108 @@ class Slave(object):
         :param use_cached: Should we use the last returned value of the network check to the slave? If True,
             will return cached value. If False, this method will perform an actual network call to the slave.
         :type use_cached: bool
+        :param timeout: The number of seconds to wait for the slave to respond to the network call, or None to wait
+            indefinitely. Only used if use_cached is False.
+        :type timeout: float | None
         :rtype: bool
         """
         if use_cached:
             return self._is_alive
 
         try:
-            response = self._network.get(self._slave_api.url(), headers=self._expected_session_header())
-
-            if not response.ok:
-                self._is_alive = False
-            else:
-                response_data = response.json()
-
-                if 'slave' not in response_data or 'is_alive' not in response_data['slave']:
-                    self._logger.warning('{}\'s API is missing key slave[\'is_alive\'].', self.url)
-                    self._is_alive = False
-                elif not isinstance(response_data['slave']['is_alive'], bool):
-                    self._logger.warning('{}\'s API key \'is_alive\' is not a boolean.', self.url)
-                    self._is_alive = False
-                else:
-                    self._is_alive = response_data['slave']['is_alive']
+            response = self._network.get(self._slave_api.url(), headers=self._expected_session_header(),
+                                         timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            response = None
+        return self._record_liveness_response(response)
+
+    @gen.coroutine
+    def probe_liveness(self, network, timeout=None):
+        """
+        The non-blocking equivalent of is_alive(use_cached=False), which does not occupy a thread while it waits for
+        the slave to respond.
+
+        :param network: The network to send the request on, which must be used on the IOLoop this is run on
+        :type network: app.util.async_network.AsyncNetwork
+        :param timeout: The number of seconds to wait for the slave to respond
+        :type timeout: float | None
+        :rtype: tornado.concurrent.Future[bool]
+        """
+        try:
+            response = yield network.get(self._slave_api.url(), headers=self._expected_session_header(),
+                                         timeout=timeout)
         except requests.exceptions.ConnectionError:
+            response = None
+        return self._record_liveness_response(response)
+
+    def _record_liveness_response(self, response):
+        """
+        :param response: The slave's response to a liveness check, or None if it did not respond
+        :type response: requests.Response | app.util.async_network.AsyncResponse | None
+        :return: Whether the slave is alive
+        :rtype: bool
+        """
+        if response is None:
             self._logger.warning('Slave with url {} is offline.', self.url)
             self._is_alive = False
+        elif not response.ok:
+            self._is_alive = False
+        else:
+            try:
+                response_data = response.json()
+            except ValueError:
+                self._logger.warning('{}\'s API did not respond with JSON.', self.url)
+                response_data = None
+
+            if response_data is None:
+                self._is_alive = False
+            elif 'slave' not in response_data or 'is_alive' not in response_data['slave']:
+                self._logger.warning('{}\'s API is missing key slave[\'is_alive\'].', self.url)
+                self._is_alive = False
+            elif not isinstance(response_data['slave']['is_alive'], bool):
+                self._logger.warning('{}\'s API key \'is_alive\' is not a boolean.', self.url)
+                self._is_alive = False
+            else:
+                self._is_alive = response_data['slave']['is_alive']
 
+        self._last_liveness_check_time = time.time()
         return self._is_alive
 
+    @property
+    def last_liveness_check_time(self):
+        """
+        :return: the time the slave's liveness was last checked over the network, or None if it never has been
+        :rtype: float | None
+        """
+        return self._last_liveness_check_time
+
+    def record_heartbeat(self, executors_state, cached_sources=None):
+        """
+        Record a heartbeat sent by the slave.
+
+        :param executors_state: the api representations of the slave's executors
+        :type executors_state: list[dict]
+        :param cached_sources: the commits the slave has fetched, keyed by the url of the repo they were fetched from,
+            or None if the slave did not report them
+        :type cached_sources: dict[str, list[str]] | None
+        """
+        self._last_heartbeat_time = time.time()
+        self._executors_state = executors_state
+        if cached_sources is not None:
+            self._cached_commits_by_repo_url = cached_sources
+
+    def has_missed_heartbeats(self, heartbeat_timeout):
+        """
+        Slaves that have never sent a heartbeat (e.g., older slave versions) are never considered to have missed one.
+
+        :param heartbeat_timeout: the number of seconds after the last heartbeat that the slave is considered lost
+        :type heartbeat_timeout: float
+        :rtype: bool
+        """
+        if self._last_heartbeat_time is None:
+            return False
+        return time.time() - self._last_heartbeat_time > heartbeat_timeout
+
     def set_is_alive(self, value):
         """
         Setter for the self._is_alive attribute.
@@ -207,7 +488,9 @@ class Slave(object):
         Marks the slave dead.
         """
         self.set_is_alive(False)
-        self.current_build_id = None
+        with self._allocation_lock:
+            self._num_executors_allocated_by_build_id.clear()
+            self._project_ids_by_build_id.clear()
 
     def _expected_session_header(self):
         """
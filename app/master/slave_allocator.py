@@ -1,3 +1,5 @@
+from queue import Empty
+
 from app.util.log import get_logger
 from app.util.ordered_set_queue import OrderedSetQueue
 from app.util.safe_thread import SafeThread
@@ -19,11 +21,12 @@ class SlaveAllocator(object):
         self._idle_slaves = OrderedSetQueue()
         self._allocation_thread = SafeThread(
             target=self._slave_allocation_loop, name='SlaveAllocationLoop', daemon=True)
+        # Executors released by one build while the slave is still busy with others can be allocated right away.
+        self._scheduler_pool.set_unallocated_executors_callback(self.add_idle_slave)
 
     def start(self):
         """
-        Start the infinite loop that will pull off prepared builds from a synchronized queue
-        and allocate them slaves.
+        Start the infinite loop that will hand out idle slaves to the builds that are waiting for them.
         """
         if self._allocation_thread.is_alive():
             raise RuntimeError('Error: slave allocation loop was asked to start when its already running.')
@@ -31,39 +34,113 @@ class SlaveAllocator(object):
 
     def _slave_allocation_loop(self):
         """
-        Builds wait in line for more slaves. This method executes in the background on another thread and
-        watches for idle slaves, then gives them out to the waiting builds.
+        Builds wait for more slaves. This method executes in the background on another thread and watches for idle
+        slaves, then gives each one out to whichever waiting build has the smallest fair share of executors (see
+        BuildSchedulerPool.next_fair_share_build_scheduler()). Among the idle slaves, the build gets the one that is
+        cheapest to set up, i.e., the one with the warmest copy of the build's source.
+
+        A slave is shared at executor granularity: a build only gets the slave's unallocated executors, and a slave
+        that still has unallocated executors afterwards is put back on the idle queue for other builds.
         """
         while True:
-            # This is a blocking call that will block until there is a prepared build.
-            build_scheduler = self._scheduler_pool.next_prepared_build_scheduler()
+            # This is a blocking call that will block until there is a build waiting for slaves.
+            self._scheduler_pool.wait_for_build_waiting_for_slaves()
+            self.allocate_slave(self._idle_slaves.get())
+
+    def allocate_slave(self, claimed_slave):
+        """
+        Give a slave that has been taken off the idle queue to the waiting build with the smallest fair share of
+        executors, or put it back on the idle queue if none of the waiting builds can use it.
+
+        :type claimed_slave: Slave
+        """
+        # Remove dead and shutdown slaves from the idle queue. Liveness is kept fresh by the SlaveLivenessMonitor, so
+        # the cached value is used here rather than blocking the allocation loop on a network call.
+        if claimed_slave.is_shutdown() or not claimed_slave.is_alive():
+            return
+
+        # Waiting builds may have completed (or new ones arrived) while we were waiting for an idle slave, so pick the
+        # build to allocate to only now that we have a slave in hand.
+        build_scheduler = self._scheduler_pool.next_fair_share_build_scheduler(claimed_slave)
+        if build_scheduler is not None:
+            claimed_slave = self._cheapest_slave_to_set_up(claimed_slave, build_scheduler)
+            # Potential race condition here!  If the build completes after the build is chosen, a slave will be
+            # allocated needlessly (and run slave.setup(), which can be significant work).
+            self._logger.info('Allocating {} to build {}.', claimed_slave, build_scheduler.build_id)
+            build_scheduler.allocate_slave(claimed_slave)
+            if claimed_slave.num_unallocated_executors() > 0:
+                self.add_idle_slave(claimed_slave)
+        elif claimed_slave.current_build_id is None:
+            self.add_idle_slave(claimed_slave)
+        # Otherwise none of the waiting builds can share this slave with the builds already using it. The slave will be
+        # put back on the idle queue once one of its builds releases executors or is torn down.
+
+    def take_idle_slave(self):
+        """
+        Take the next slave off the idle queue without blocking.
+
+        :return: the slave, or None if there are no idle slaves
+        :rtype: Slave | None
+        """
+        try:
+            return self._idle_slaves.get(block=False)
+        except Empty:
+            return None
 
-            while build_scheduler.needs_more_slaves():
-                claimed_slave = self._idle_slaves.get()
+    def _cheapest_slave_to_set_up(self, claimed_slave, build_scheduler):
+        """
+        Find the idle slave that can fetch the source of the scheduler's build with the least work (see
+        Slave.setup_cost()), so that builds get the slaves that already have a copy of their repo first. If a cheaper
+        slave than the one already claimed is found, it is claimed instead and the original slave is put back on the
+        idle queue.
+
+        :type claimed_slave: Slave
+        :type build_scheduler: app.master.build_scheduler.BuildScheduler
+        :rtype: Slave
+        """
+        idle_slaves = self._idle_slaves.snapshot()
+        if not idle_slaves:
+            return claimed_slave
 
-                # Remove dead and shutdown slaves from the idle queue
-                if claimed_slave.is_shutdown() or not claimed_slave.is_alive(use_cached=False):
-                    continue
+        build = build_scheduler.build
 
-                # The build may have completed while we were waiting for an idle slave, so check one more time.
-                if build_scheduler.needs_more_slaves():
-                    # Potential race condition here!  If the build completes after the if statement is checked,
-                    # a slave will be allocated needlessly (and run slave.setup(), which can be significant work).
-                    self._logger.info('Allocating {} to build {}.', claimed_slave, build_scheduler.build_id)
-                    build_scheduler.allocate_slave(claimed_slave)
-                else:
-                    self.add_idle_slave(claimed_slave)
+        lowest_setup_cost = claimed_slave.setup_cost(build)
+        cheapest_slave = claimed_slave
+        for slave in idle_slaves:
+            if lowest_setup_cost == 0:
+                break
+            if slave.is_shutdown() or not slave.is_alive() or not slave.can_be_shared_with(build):
+                continue
+            setup_cost = slave.setup_cost(build)
+            if setup_cost < lowest_setup_cost:
+                cheapest_slave, lowest_setup_cost = slave, setup_cost
 
-            self._logger.info('Done allocating slaves for build {}.', build_scheduler.build_id)
+        # The cheaper slave may have been removed from the idle queue (e.g., because it died) since the snapshot.
+        if cheapest_slave is claimed_slave or not self._idle_slaves.remove(cheapest_slave):
+            return claimed_slave
+        self._logger.info('Allocating {} instead of {} since it has a warmer copy of the source of build {}.',
+                          cheapest_slave, claimed_slave, build_scheduler.build_id)
+        self.add_idle_slave(claimed_slave)
+        return cheapest_slave
 
     def add_idle_slave(self, slave):
         """
-        Add a slave to the idle queue.
+        Add a slave to the idle queue if it has executors that are not allocated to any build.
 
         :type slave: Slave
         """
         try:
             slave.mark_as_idle()
-            self._idle_slaves.put(slave)
+            if slave.num_unallocated_executors() > 0:
+                self._idle_slaves.put(slave)
         except SlaveMarkedForShutdownError:
             pass
+
+    def remove_idle_slave(self, slave):
+        """
+        Remove a slave (e.g., one that has been found to be dead) from the idle queue, if it is on it.
+
+        :type slave: Slave
+        """
+        if self._idle_slaves.remove(slave):
+            self._logger.info('Removed {} from the idle slave queue.', slave)
@@ -0,0 +1,99 @@
+from threading import Lock
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from app.util.async_network import AsyncNetwork
+from app.util.log import get_logger
+from app.util.safe_thread import SafeThread
+
+
+class SlaveLivenessMonitor(object):
+    """
+    The SlaveLivenessMonitor probes the API of every connected slave in the background and keeps each slave's cached
+    liveness (see Slave.is_alive()) fresh. This lets the slave allocator use the cached value instead of making a
+    blocking network call for every slave it hands out.
+
+    Slaves are probed concurrently with non-blocking requests on an IOLoop in the monitor's own thread, so a probe does
+    not occupy a thread while it waits for a slave to respond. A slave whose previous probe has not finished yet is
+    skipped, so a few hung or firewalled slaves cannot delay the checks for all the others. A slave that has stopped
+    sending heartbeats is considered dead without being probed.
+    """
+
+    _MAX_CONCURRENT_PROBES = 32
+
+    def __init__(self, get_slaves, dead_slave_callback, probe_interval, heartbeat_timeout=None):
+        """
+        :param get_slaves: a callable that returns the slaves to monitor
+        :type get_slaves: callable
+        :param dead_slave_callback: called with each slave that is found to be dead
+        :type dead_slave_callback: callable
+        :param probe_interval: the number of seconds between probes of each slave. This is also the timeout of each
+            probe, so a slave that takes longer than this to respond is considered dead.
+        :type probe_interval: float
+        :param heartbeat_timeout: the number of seconds after its last heartbeat that a slave is considered dead, or
+            None to not check heartbeats
+        :type heartbeat_timeout: float | None
+        """
+        self._logger = get_logger(__name__)
+        self._get_slaves = get_slaves
+        self._dead_slave_callback = dead_slave_callback
+        self._probe_interval = probe_interval
+        self._heartbeat_timeout = heartbeat_timeout
+        self._network = AsyncNetwork(max_concurrent_requests=self._MAX_CONCURRENT_PROBES)
+        self._slave_ids_being_probed = set()
+        self._probe_lock = Lock()
+        self._monitor_thread = SafeThread(target=self._liveness_probe_loop, name='SlaveLivenessMonitor', daemon=True)
+
+    def start(self):
+        """
+        Start the infinite loop that periodically probes all slaves.
+        """
+        if self._monitor_thread.is_alive():
+            raise RuntimeError('Error: slave liveness monitor was asked to start when its already running.')
+        self._monitor_thread.start()
+
+    def _liveness_probe_loop(self):
+        """
+        Run the IOLoop that the probes are sent on. Slaves have just been checked when they connect, so the first round
+        of probes is only sent after one interval.
+        """
+        io_loop = IOLoop()
+        io_loop.make_current()
+        PeriodicCallback(self.probe_slaves, self._probe_interval * 1000).start()
+        io_loop.start()
+
+    def probe_slaves(self):
+        """
+        Start a probe of every slave that is believed to be alive. Slaves that are already known to be dead are not
+        probed; a dead slave comes back by reconnecting to the master, which creates a new Slave instance. This must be
+        called on the monitor's IOLoop.
+        """
+        for slave in self._get_slaves():
+            if not slave.is_alive():
+                continue
+            if self._heartbeat_timeout is not None and slave.has_missed_heartbeats(self._heartbeat_timeout):
+                self._logger.warning('{} has not sent a heartbeat in over {} seconds.', slave, self._heartbeat_timeout)
+                slave.set_is_alive(False)
+                self._dead_slave_callback(slave)
+                continue
+            with self._probe_lock:
+                if slave.id in self._slave_ids_being_probed:
+                    continue
+                self._slave_ids_being_probed.add(slave.id)
+            self._probe_slave(slave)
+
+    @gen.coroutine
+    def _probe_slave(self, slave):
+        """
+        :type slave: app.master.slave.Slave
+        """
+        try:
+            is_alive = yield slave.probe_liveness(self._network, timeout=self._probe_interval)
+        finally:
+            with self._probe_lock:
+                self._slave_ids_being_probed.discard(slave.id)
+
+        if not is_alive:
+            self._logger.warning('Liveness probe found {} to be dead.', slave)
+            self._dead_slave_callback(slave)
@@ -1,4 +1,6 @@
 import os
+from threading import Lock
+import time
 
 from app.master.atom import AtomState
 from app.master.build_artifact import BuildArtifact
@@ -31,6 +33,10 @@ class Subjob(object):
         self._set_atom_state(AtomState.NOT_STARTED)
         self.timings = {}  # a dict, atom_ids are the keys and seconds are the values
         self.slave = None  # The slave that had been assigned this subjob. Is None if not started.
+        self.speculative_slaves = []  # Slaves that were also assigned this subjob because it was running too long.
+        self._start_time = None
+        self._result_received = False
+        self._result_lock = Lock()
 
     def _set_atoms_subjob_id(self, atoms, subjob_id):
         """
@@ -62,6 +68,113 @@ class Subjob(object):
         """
         self._set_atom_state(AtomState.IN_PROGRESS)
         self.slave = slave
+        self._start_time = time.time()
+
+    def mark_not_started(self):
+        """
+        Mark the subjob NOT_STARTED again (e.g., because the slave executing it was lost) so that it can be sent to
+        another slave.
+        """
+        self._set_atom_state(AtomState.NOT_STARTED)
+        self.slave = None
+        self.speculative_slaves = []
+        self._start_time = None
+
+    def mark_speculatively_executing(self, slave):
+        """
+        Record that a copy of this (already started) subjob has been sent to another slave. Whichever execution
+        reports back first provides the subjob's result.
+
+        :type slave: Slave
+        """
+        self.speculative_slaves.append(slave)
+
+    def claim_result(self):
+        """
+        Record that a result has been received for this subjob. A subjob that was speculatively executed on more than
+        one slave reports more than one result, but only the first one should be used.
+
+        :return: whether this is the first result received for this subjob
+        :rtype: bool
+        """
+        with self._result_lock:
+            if self._result_received:
+                return False
+            self._result_received = True
+            return True
+
+    def is_result_received(self):
+        """
+        :return: whether a result has been received for this subjob (see claim_result())
+        :rtype: bool
+        """
+        return self._result_received
+
+    def is_executing(self):
+        """
+        :return: whether this subjob has been started but no result has been received for it yet
+        :rtype: bool
+        """
+        return self._start_time is not None and not self._result_received
+
+    def elapsed_time(self):
+        """
+        :return: the number of seconds since this subjob was started, or None if it has not been started
+        :rtype: float | None
+        """
+        if self._start_time is None:
+            return None
+        return time.time() - self._start_time
+
+    def expected_time(self):
+        """
+        :return: the expected run time of this subjob in seconds based on historic timing data, or None if there is no
+            timing data for some of its atoms
+        :rtype: float | None
+        """
+        if any(atom.expected_time is None for atom in self._atoms):
+            return None
+        return sum(atom.expected_time for atom in self._atoms)
+
+    def split(self, new_subjob_id, num_atoms_to_keep=None):
+        """
+        Move the trailing atoms of this subjob into a new subjob. This is used to rebalance work at the tail of a build,
+        either before this subjob has started or, once its slave has agreed to stop early, while it is executing.
+
+        :param new_subjob_id: the id of the new subjob
+        :type new_subjob_id: int
+        :param num_atoms_to_keep: the number of atoms (from the start) that this subjob keeps. If None, the atoms are
+            split into two halves by expected time, or by count if there is no timing data.
+        :type num_atoms_to_keep: int | None
+        :return: the new subjob, or None if there are not enough atoms to split
+        :rtype: Subjob | None
+        """
+        if num_atoms_to_keep is None:
+            num_atoms_to_keep = self._balanced_split_index()
+        if not 0 < num_atoms_to_keep < len(self._atoms):
+            return None
+
+        split_atoms = self._atoms[num_atoms_to_keep:]
+        self._atoms = self._atoms[:num_atoms_to_keep]
+        for atom_id, atom in enumerate(split_atoms):
+            atom.id = atom_id
+        return Subjob(self._build_id, new_subjob_id, self.project_type, self.job_config, split_atoms)
+
+    def _balanced_split_index(self):
+        """
+        :return: the index at which to split this subjob's atoms so that both halves take about the same time
+        :rtype: int
+        """
+        expected_time = self.expected_time()
+        if not expected_time:
+            return len(self._atoms) // 2
+
+        time_so_far = 0
+        for atom_index, atom in enumerate(self._atoms):
+            time_so_far += atom.expected_time
+            if time_so_far >= expected_time / 2:
+                return min(atom_index + 1, len(self._atoms) - 1)
+        return len(self._atoms) // 2
 
     def mark_completed(self):
         """
@@ -1,19 +1,39 @@
-import json
-import os
+import time
 
 from app.master.atom import Atom
+from app.master.atomization_cache import AtomizationCache
 from app.master.atom_grouper import AtomGrouper
+from app.master.atom_grouping_tuner import AtomGroupingTuner
 from app.master.subjob import Subjob
 from app.master.time_based_atom_grouper import TimeBasedAtomGrouper
+from app.master.timing_store import TimingStore
 from app.util import log
+from app.util.conf.configuration import Configuration
 
 
 class SubjobCalculator(object):
     """
     Calculate subjobs for a build.
     """
-    def __init__(self):
+    # The seconds after which a batch of streamed atoms is grouped early. Only checked when more atoms arrive.
+    STREAMING_BATCH_INTERVAL = 5.0
+
+    def __init__(self, get_executor_speed_factors=None, timing_store=None, atomization_cache=None):
+        """
+        :param get_executor_speed_factors: a callable that returns the speed factors of the executors that builds can
+            run on, fastest first (see Slave.speed_factor). This is used to size the initial subjobs to the capacity
+            that is actually available. If None, every build is assumed to get max_executors equally fast executors.
+        :type get_executor_speed_factors: callable | None
+        :param timing_store: the store to look up the historic atom times in, or None for the configured one
+        :type timing_store: TimingStore | None
+        :param atomization_cache: the cache of atomizer output to use, or None for the configured one
+        :type atomization_cache: AtomizationCache | None
+        """
         self._logger = log.get_logger(__name__)
+        self._get_executor_speed_factors = get_executor_speed_factors
+        self._timing_store = timing_store or TimingStore(Configuration['timing_database_path'])
+        self._atomization_cache = atomization_cache or AtomizationCache(
+            Configuration['atomization_cache_directory'], Configuration['max_cached_atomizations'])
 
     def compute_subjobs_for_build(self, build_id, job_config, project_type):
         """
@@ -29,7 +49,7 @@ class SubjobCalculator(object):
             atoms_string_list = project_type.atoms_override
             atoms_list = [Atom(atom_string_value) for atom_string_value in atoms_string_list]
         else:
-            atoms_list = job_config.atomizer.atomize_in_project(project_type)
+            atoms_list = job_config.atomizer.atomize_in_project(project_type, self._atomization_cache)
 
         # Group the atoms together using some grouping strategy
         timing_file_path = project_type.timing_file_path(job_config.name)
@@ -49,34 +69,85 @@ class SubjobCalculator(object):
             subjobs.append(Subjob(build_id, subjob_id, project_type, job_config, subjob_atoms))
         return subjobs
 
+    def group_atoms_incrementally(self, job_config, project_type, atom_groups_callback):
+        """
+        Atomize the project and group the atoms into subjobs in batches, as the atomizer commands output the atoms (see
+        Atomizer.atomize_in_project_incrementally()). A batch of atoms is grouped once it has reached
+        streaming_atomization_batch_size atoms, or when atoms arrive STREAMING_BATCH_INTERVAL seconds or more after the
+        last batch. The interval is only checked when atoms arrive, so a batch is never grouped by a timer while the
+        atomizers are quiet. The remaining atoms are grouped when the atomizer commands exit. This returns once they
+        have exited.
+
+        Each batch is grouped on its own, so the subjobs are not balanced as well as those of
+        compute_subjobs_for_build(), but the first of them can start executing while the atomizers are still running.
+
+        :type job_config: JobConfig
+        :param project_type: the project_type that the build is running in
+        :type project_type: project_type.project_type.ProjectType
+        :param atom_groups_callback: called with the grouped atoms (a list of lists of atoms) of each batch
+        :type atom_groups_callback: callable
+        """
+        timing_file_path = project_type.timing_file_path(job_config.name)
+        batch_size = max(1, Configuration['streaming_atomization_batch_size'])
+        atom_batch = []
+        last_batch_time = time.time()
+
+        def group_atom_batch():
+            nonlocal atom_batch, last_batch_time
+            if atom_batch:
+                atom_groups_callback(self._grouped_atoms(atom_batch, job_config.max_executors, timing_file_path,
+                                                         project_type.project_directory))
+            atom_batch = []
+            last_batch_time = time.time()
+
+        def add_atoms(atoms):
+            atom_batch.extend(atoms)
+            if len(atom_batch) >= batch_size or time.time() - last_batch_time >= self.STREAMING_BATCH_INTERVAL:
+                group_atom_batch()
+
+        job_config.atomizer.atomize_in_project_incrementally(project_type, add_atoms, self._atomization_cache)
+        group_atom_batch()
+
     def _grouped_atoms(self, atoms, max_executors, timing_file_path, project_directory):
         """
         Return atoms that are grouped for optimal CI performance.
 
-        If a timing file exists, then use the TimeBasedAtomGrouper.
+        If there is timing data for any of the atoms, then use the TimeBasedAtomGrouper, with the grouping parameters
+        that have been tuned for this job (see AtomGroupingTuner), the measured overheads of its subjobs and the
+        variance of each atom's time.
         If not, use the default AtomGrouper (groups each atom into its own subjob).
 
         :param atoms: all of the atoms to be run this time
         :type atoms: list[app.master.atom.Atom]
         :param max_executors: the maximum number of executors for this build
         :type max_executors: int
-        :param timing_file_path: path to where the timing data file would be stored (if it exists) for this job
+        :param timing_file_path: path to where the timing data file would be stored (if it exists) for this job. This
+            identifies the job in the timing store.
         :type timing_file_path: str
         :type project_directory: str
         :return: the grouped atoms (in the form of list of lists of strings)
         :rtype: list[list[app.master.atom.Atom]]
         """
-        atom_time_map = None
+        atom_statistics = self._timing_store.atom_statistics(timing_file_path, [atom.command_string for atom in atoms])
 
-        if os.path.isfile(timing_file_path):
-            with open(timing_file_path, 'r') as json_file:
-                try:
-                    atom_time_map = json.load(json_file)
-                except ValueError:
-                    self._logger.warning('Failed to load timing data from file that exists {}', timing_file_path)
+        if len(atom_statistics) > 0:
+            # Atoms are packed by a percentile of their recent times if one is configured, or by their moving average.
+            atom_time_percentile = Configuration['atom_time_percentile']
+            if atom_time_percentile > 0:
+                atom_time_map = {atom: statistics.percentile(atom_time_percentile / 100)
+                                 for atom, statistics in atom_statistics.items()}
+            else:
+                atom_time_map = {atom: statistics.mean for atom, statistics in atom_statistics.items()}
+            atom_time_variances = {atom: statistics.variance for atom, statistics in atom_statistics.items()}
 
-        if atom_time_map is not None and len(atom_time_map) > 0:
-            atom_grouper = TimeBasedAtomGrouper(atoms, max_executors, atom_time_map, project_directory)
+            executor_speed_factors = None
+            if self._get_executor_speed_factors is not None:
+                executor_speed_factors = self._get_executor_speed_factors()[:max_executors]
+            grouping_tuner = AtomGroupingTuner(timing_file_path)
+            atom_grouper = TimeBasedAtomGrouper(atoms, max_executors, atom_time_map, project_directory,
+                                                executor_speed_factors, grouping_tuner.big_chunk_fraction,
+                                                grouping_tuner.small_subjobs_per_executor, atom_time_variances,
+                                                grouping_tuner.subjob_overhead, grouping_tuner.atom_overhead)
         else:
             atom_grouper = AtomGrouper(atoms, max_executors)
 
@@ -1,4 +1,5 @@
-from collections import OrderedDict
+from bisect import bisect_right
+import math
 
 from app.master.atom_grouper import AtomGrouper
 
@@ -42,18 +43,40 @@ class TimeBasedAtomGrouper(object):
 
     The algorithm has two stages of subjob creation: the 'big chunk' stage and the 'small chunk' stage. The 'big chunk'
     stage creates exactly N large subjob groupings that will consist of the majority of atoms (in terms of runtime).
-    The 'small chunk' stage creates ~2N short subjob groupings that will be used to fill in the gaps in order to aim for
-    having all of the executors end at similar times.
+    The 'small chunk' stage creates ~2N (by default) short subjob groupings that will be used to fill in the gaps in
+    order to aim for having all of the executors end at similar times.
 
     Notes:
-    - For new atoms that we don't have historic times for, we will assign it the highest atom time value in order to
-      avoid underestimating the length of unknown atoms.
-    - We will have to try tweaking the percentage of T that we want to be allocated for the initial large batch of
-      big subjobs. Same goes for the number and size of the smaller buckets.
+    - For new atoms that we don't have historic times for, we will assign them the average time of the known atoms that
+      are most similar to them, i.e., that share the longest '/'-separated prefix of their command (such as the
+      directory of a test file). If there are no similar atoms, we will assign them the highest atom time value in
+      order to avoid underestimating the length of unknown atoms.
+    - If the variances of the atom times are known, atoms whose times vary by more than HIGH_VARIANCE_THRESHOLD of
+      their expected time are kept out of the 'big chunk' subjobs and put in the 'small chunk' subjobs, which run at
+      the end of the build where the overruns of these atoms can be absorbed by the other executors.
+    - The percentage of T that is allocated to the initial large batch of big subjobs, and the number of smaller
+      buckets, default to BIG_CHUNK_FRACTION and SMALL_SUBJOBS_PER_EXECUTOR. They are tuned per job based on how the
+      job's previous builds ended (see AtomGroupingTuner).
+    - If the speed factors of the executors that the build will run on are known, N is the number of those executors
+      and each 'big chunk' subjob gets a share of the work that is proportional to the speed of one of them. The
+      scheduler sends the largest subjobs to the fastest slaves, so that all the executors still end around the same
+      time.
+    - If the overheads of subjobs are known (see AtomGroupingTuner), the cost per atom is added to the expected time of
+      every atom, and the number of 'small chunk' subjobs is chosen to balance the cost per subjob against how unevenly
+      the executors end. With k small subjobs per executor, each executor pays k times the cost per subjob, and the
+      executors end up to one small subjob (T * (1 - big chunk fraction) / kN) apart. The sum of these is smallest when
+      k = sqrt(T * (1 - big chunk fraction) / (N * cost per subjob)), so jobs with cheap subjobs are split finely and
+      jobs with expensive subjobs get fewer, larger subjobs. The tuned number of small subjobs per executor scales this
+      relative to SMALL_SUBJOBS_PER_EXECUTOR.
     """
     BIG_CHUNK_FRACTION = 0.8
+    SMALL_SUBJOBS_PER_EXECUTOR = 2
+    HIGH_VARIANCE_THRESHOLD = 0.5  # the standard deviation, as a fraction of the expected time, of high-variance atoms
+    MAX_SMALL_SUBJOBS_PER_EXECUTOR = 16
 
-    def __init__(self, atoms, max_executors, atom_time_map, project_directory):
+    def __init__(self, atoms, max_executors, atom_time_map, project_directory, executor_speed_factors=None,
+                 big_chunk_fraction=None, small_subjobs_per_executor=None, atom_time_variances=None,
+                 subjob_overhead=None, atom_overhead=None):
         """
         :param atoms: the list of atoms for this build
         :type atoms: list[app.master.atom.Atom]
@@ -62,11 +85,32 @@ class TimeBasedAtomGrouper(object):
         :param atom_time_map: a dictionary containing the historic times for atoms for this particular job
         :type atom_time_map: dict[str, float]
         :type project_directory: str
+        :param executor_speed_factors: the speed factors of the executors this build is expected to run on, fastest
+            first. If None or empty, the build is expected to run on max_executors equally fast executors.
+        :type executor_speed_factors: list[float] | None
+        :param big_chunk_fraction: the fraction of the total estimated runtime to put in 'big chunk' subjobs, or None
+            for BIG_CHUNK_FRACTION
+        :type big_chunk_fraction: float | None
+        :param small_subjobs_per_executor: the approximate number of 'small chunk' subjobs to create per executor, or
+            None for SMALL_SUBJOBS_PER_EXECUTOR
+        :type small_subjobs_per_executor: int | None
+        :param atom_time_variances: the variances of the historic times of the atoms, or None if they are not known
+        :type atom_time_variances: dict[str, float] | None
+        :param subjob_overhead: the seconds each subjob costs on top of running its atoms, or None if not known
+        :type subjob_overhead: float | None
+        :param atom_overhead: the seconds each atom costs on top of its historic time, or None if not known
+        :type atom_overhead: float | None
         """
         self._atoms = atoms
         self._max_executors = max_executors
         self._atom_time_map = atom_time_map
         self._project_directory = project_directory
+        self._executor_speed_factors = executor_speed_factors or [1.0] * max_executors
+        self._big_chunk_fraction = big_chunk_fraction or self.BIG_CHUNK_FRACTION
+        self._small_subjobs_per_executor = small_subjobs_per_executor or self.SMALL_SUBJOBS_PER_EXECUTOR
+        self._atom_time_variances = atom_time_variances or {}
+        self._subjob_overhead = subjob_overhead
+        self._atom_overhead = atom_overhead or 0.0
 
     def groupings(self):
         """
@@ -83,23 +127,46 @@ class TimeBasedAtomGrouper(object):
             grouper = AtomGrouper(self._atoms, self._max_executors)
             return grouper.groupings()
 
-        # 2). Sort them by decreasing time, and add them to an OrderedDict
-        atoms_by_decreasing_time = sorted(self._atoms, key=lambda atom: atom.expected_time, reverse=True)
-        sorted_atom_times_left = OrderedDict([(atom, atom.expected_time) for atom in atoms_by_decreasing_time])
+        # 2). Sort them by time so that the longest atom that fits in a subjob can be found quickly. High-variance
+        # atoms are held back for the 'small chunk' stage.
+        stable_atoms, high_variance_atoms = self._partition_high_variance_atoms(self._atoms)
+        atoms_left = _SortedAtoms(stable_atoms)
 
         # 3). Group them!
 
-        # Calculate what the target 'big subjob' time is going to be for each executor's initial subjob
-        big_subjob_time = (total_estimated_runtime * self.BIG_CHUNK_FRACTION) / self._max_executors
+        # Calculate what the target 'big subjob' time is going to be for each executor's initial subjob. Faster
+        # executors get proportionally more of the work.
+        num_executors = len(self._executor_speed_factors)
+        total_speed = sum(self._executor_speed_factors)
+        big_subjob_times = [total_estimated_runtime * self._big_chunk_fraction * speed_factor / total_speed
+                            for speed_factor in self._executor_speed_factors]
         # Calculate what the target 'small subjob' time is going to be
-        small_subjob_time = (total_estimated_runtime * (1.0 - self.BIG_CHUNK_FRACTION)) / (2 * self._max_executors)
-        # _group_atoms_into_sized_buckets() will remove elements from sorted_atom_times_left.
-        subjobs = self._group_atoms_into_sized_buckets(sorted_atom_times_left, big_subjob_time, self._max_executors)
-        small_subjobs = self._group_atoms_into_sized_buckets(sorted_atom_times_left, small_subjob_time, None)
+        small_chunk_runtime = total_estimated_runtime * (1.0 - self._big_chunk_fraction)
+        small_subjob_time = small_chunk_runtime / (
+            self._num_small_subjobs_per_executor(small_chunk_runtime, num_executors) * num_executors)
+        # _group_atoms_into_sized_buckets() will remove elements from atoms_left.
+        subjobs = self._group_atoms_into_sized_buckets(atoms_left, big_subjob_times, num_executors)
+        if high_variance_atoms:
+            atoms_left = _SortedAtoms(atoms_left.pop_all() + high_variance_atoms)
+        small_subjobs = self._group_atoms_into_sized_buckets(atoms_left, [small_subjob_time], None)
 
         subjobs.extend(small_subjobs)
         return subjobs
 
+    def _num_small_subjobs_per_executor(self, small_chunk_runtime, num_executors):
+        """
+        :param small_chunk_runtime: the total estimated runtime of the 'small chunk' subjobs
+        :type small_chunk_runtime: float
+        :type num_executors: int
+        :return: the number of 'small chunk' subjobs to create per executor
+        :rtype: float
+        """
+        if not self._subjob_overhead or small_chunk_runtime <= 0:
+            return self._small_subjobs_per_executor
+        num_small_subjobs = math.sqrt(small_chunk_runtime / (num_executors * self._subjob_overhead))
+        num_small_subjobs *= self._small_subjobs_per_executor / self.SMALL_SUBJOBS_PER_EXECUTOR
+        return min(max(num_small_subjobs, 1), self.MAX_SMALL_SUBJOBS_PER_EXECUTOR)
+
     def _set_expected_atom_times(self, new_atoms, old_atoms_with_times, project_directory):
         """
         Set the expected runtime (new_atom.expected_time) of each atom in new_atoms using historic timing data.
@@ -126,7 +193,7 @@ class TimeBasedAtomGrouper(object):
                 atoms_without_timing_data.append(new_atom)
                 continue
 
-            new_atom.expected_time = old_atoms_with_times[new_atom.command_string]
+            new_atom.expected_time = old_atoms_with_times[new_atom.command_string] + self._atom_overhead
 
             # Discover largest single atom time to use as conservative estimates for atoms with unknown times
             if max_atom_time < new_atom.expected_time:
@@ -136,69 +203,192 @@ class TimeBasedAtomGrouper(object):
             # sent to the slave to be run.
             total_time += new_atom.expected_time
 
-        # For the atoms without historic timing data, assign them the largest atom time we have
-        for new_atom in atoms_without_timing_data:
-            new_atom.expected_time = max_atom_time
-
         if len(new_atoms) == len(atoms_without_timing_data):
             raise _AtomTimingDataError
 
-        total_time += (max_atom_time * len(atoms_without_timing_data))
+        # For the atoms without historic timing data, assign them the average time of the most similar known atoms, or
+        # the largest atom time we have if there are none.
+        prefix_time_totals = {}
+        if atoms_without_timing_data:
+            prefix_time_totals = self._prefix_time_totals(
+                new_atom for new_atom in new_atoms if new_atom.command_string in old_atoms_with_times)
+        for new_atom in atoms_without_timing_data:
+            new_atom.expected_time = max_atom_time
+            for prefix in reversed(self._command_prefixes(new_atom.command_string)):
+                if prefix in prefix_time_totals:
+                    prefix_total_time, prefix_num_atoms = prefix_time_totals[prefix]
+                    new_atom.expected_time = prefix_total_time / prefix_num_atoms
+                    break
+            total_time += new_atom.expected_time
+
         return total_time
 
-    def _group_atoms_into_sized_buckets(self, sorted_atom_time_dict, target_group_time, max_groups_to_create):
+    def _prefix_time_totals(self, atoms_with_timing_data):
+        """
+        :type atoms_with_timing_data: collections.Iterable[app.master.atom.Atom]
+        :return: the total expected time and the number of the atoms under each command prefix (see
+            _command_prefixes()), by prefix
+        :rtype: dict[str, list]
+        """
+        prefix_time_totals = {}
+        for atom in atoms_with_timing_data:
+            for prefix in self._command_prefixes(atom.command_string):
+                prefix_total = prefix_time_totals.setdefault(prefix, [0.0, 0])
+                prefix_total[0] += atom.expected_time
+                prefix_total[1] += 1
+        return prefix_time_totals
+
+    @staticmethod
+    def _command_prefixes(command_string):
+        """
+        :type command_string: str
+        :return: the '/'-separated proper prefixes of the command, shortest first. For example, the prefixes of
+            'nosetests test/unit/test_a.py' are 'nosetests test' and 'nosetests test/unit'.
+        :rtype: list[str]
+        """
+        components = command_string.split('/')
+        return ['/'.join(components[:length]) for length in range(1, len(components))]
+
+    def _partition_high_variance_atoms(self, atoms):
+        """
+        :type atoms: list[app.master.atom.Atom]
+        :return: the atoms whose times are predictable and the atoms whose times have a high variance
+        :rtype: (list[app.master.atom.Atom], list[app.master.atom.Atom])
         """
-        Given a sorted dictionary (Python FTW) of [atom, time] pairs in variable sorted_atom_time_dict, return a list
-        of lists of atoms that each are estimated to take target_group_time seconds. This method will generate at most
-        max_groups_to_create groupings, and will return once this limit is reached or when sorted_atom_time_dict is
-        empty.
+        if not self._atom_time_variances:
+            return atoms, []
+        stable_atoms, high_variance_atoms = [], []
+        for atom in atoms:
+            variance = self._atom_time_variances.get(atom.command_string, 0.0)
+            if variance > (self.HIGH_VARIANCE_THRESHOLD * atom.expected_time) ** 2:
+                high_variance_atoms.append(atom)
+            else:
+                stable_atoms.append(atom)
+        return stable_atoms, high_variance_atoms
+
+    def _group_atoms_into_sized_buckets(self, atoms_left, target_group_times, max_groups_to_create):
+        """
+        Group the atoms in atoms_left into a list of lists of atoms that are each estimated to take their entry of
+        target_group_times in seconds. This method will generate at most max_groups_to_create groupings, and will
+        return once this limit is reached or when atoms_left is empty.
+
+        Each group is filled first-fit-decreasing: it starts with the longest atom left, and then repeatedly takes the
+        longest atom left that still fits in the group's target time. Since atoms_left can find that atom in O(log n),
+        grouping n atoms takes O(n log n).
 
-        Note, this method will modify sorted_atom_time_dict's state by removing elements as needed (often from the
-        middle of the collection).
+        Note, this method will modify atoms_left's state by removing the atoms that it groups.
 
-        :param sorted_atom_time_dict: the sorted (longest first), double-ended queue containing [atom, time] pairs.
-            This OrderedDict will have elements removed from this method.
-        :type sorted_atom_time_dict: OrderedDict[app.master.atom.Atom, float]
-        :param target_group_time: how long each subjob should approximately take
-        :type target_group_time: float
+        :param atoms_left: the atoms that have not been grouped yet. Atoms will be removed from this by this method.
+        :type atoms_left: _SortedAtoms
+        :param target_group_times: how long each subjob should approximately take, in the order the subjobs are
+            created. The last target time is used for any further subjobs.
+        :type target_group_times: list[float]
         :param max_groups_to_create: the maximum number of subjobs to create. Once max_groups_to_create limit is
             reached, this method will return the subjobs that have already been grouped. If set to None, then there
             is no limit.
         :type max_groups_to_create: int|None
-        :return: the groups of grouped atoms, with each group taking an estimated target_group_time
+        :return: the groups of grouped atoms, with each group taking an estimated target time
         :rtype: list[list[app.master.atom.Atom]]
         """
         subjobs = []
-        subjob_time_so_far = 0
-        subjob_atoms = []
 
-        while (max_groups_to_create is None or len(subjobs) < max_groups_to_create) and len(sorted_atom_time_dict) > 0:
-            for atom, time in sorted_atom_time_dict.items():
-                if len(subjob_atoms) == 0 or (time + subjob_time_so_far) <= target_group_time:
-                    subjob_time_so_far += time
-                    subjob_atoms.append(atom)
-                    sorted_atom_time_dict.pop(atom)
+        while (max_groups_to_create is None or len(subjobs) < max_groups_to_create) and len(atoms_left) > 0:
+            target_group_time = target_group_times[min(len(subjobs), len(target_group_times) - 1)]
+            # Every subjob gets at least one atom, even if that atom alone takes longer than the target time.
+            atom = atoms_left.pop_longest()
+            subjob_atoms = []
+            subjob_time_so_far = 0
 
-                    # If (number of subjobs created so far + atoms left) is less than or equal to the total number of
-                    # subjobs we need to create, then have each remaining atom be a subjob and return.
-                    # The "+ 1" is here to account for the current subjob being generated, but that hasn't been
-                    # appended to subjobs yet.
-                    if max_groups_to_create is not None and (len(subjobs) + len(sorted_atom_time_dict) + 1) <= max_groups_to_create:
-                        subjobs.append(subjob_atoms)
+            while atom is not None:
+                subjob_atoms.append(atom)
+                subjob_time_so_far += atom.expected_time
 
-                        for atom, _ in sorted_atom_time_dict.items():
-                            sorted_atom_time_dict.pop(atom)
-                            subjobs.append([atom])
+                # If (number of subjobs created so far + atoms left) is less than or equal to the total number of
+                # subjobs we need to create, then have each remaining atom be a subjob and return.
+                # The "+ 1" is here to account for the current subjob being generated, but that hasn't been
+                # appended to subjobs yet.
+                if max_groups_to_create is not None and (len(subjobs) + len(atoms_left) + 1) <= max_groups_to_create:
+                    subjobs.append(subjob_atoms)
+                    subjobs.extend([atom] for atom in atoms_left.pop_all())
+                    return subjobs
 
-                        return subjobs
+                atom = atoms_left.pop_longest(max_time=target_group_time - subjob_time_so_far)
 
             subjobs.append(subjob_atoms)
-            subjob_atoms = []
-            subjob_time_so_far = 0
 
         return subjobs
 
 
+class _SortedAtoms(object):
+    """
+    A collection of atoms sorted by expected time, from which the longest atom that takes at most a given amount of
+    time can be removed in O(log n).
+
+    The atoms are kept in an array sorted by increasing time that is never modified. Removed atoms are skipped over
+    using a disjoint-set forest in which each array position points to the next position to its left that might still
+    hold an atom (path compression keeps these chains short).
+    """
+    def __init__(self, atoms):
+        """
+        :type atoms: list[app.master.atom.Atom]
+        """
+        # Atoms with equal times are found from the end of the array first, so they are put in reverse of their
+        # original order to keep the grouping stable.
+        self._atoms = sorted(reversed(atoms), key=lambda atom: atom.expected_time)
+        self._times = [atom.expected_time for atom in self._atoms]
+        # Slot i stands for the atom at index i - 1; slot 0 is a sentinel that means there is no atom left.
+        self._slot_parents = list(range(len(self._atoms) + 1))
+        self._num_atoms_left = len(self._atoms)
+
+    def __len__(self):
+        return self._num_atoms_left
+
+    def pop_longest(self, max_time=None):
+        """
+        Remove the longest atom that takes at most max_time. Of atoms with equal times, the one that came first in the
+        original list is removed first.
+
+        :param max_time: the maximum expected time of the atom, or None for no maximum
+        :type max_time: float | None
+        :return: the removed atom, or None if no atom takes at most max_time
+        :rtype: app.master.atom.Atom | None
+        """
+        num_atoms_short_enough = len(self._times) if max_time is None else bisect_right(self._times, max_time)
+        slot = self._find_slot(num_atoms_short_enough)
+        if slot == 0:
+            return None
+        self._slot_parents[slot] = slot - 1
+        self._num_atoms_left -= 1
+        return self._atoms[slot - 1]
+
+    def pop_all(self):
+        """
+        Remove all the atoms that are left.
+
+        :return: the removed atoms, longest first
+        :rtype: list[app.master.atom.Atom]
+        """
+        atoms = []
+        atom = self.pop_longest()
+        while atom is not None:
+            atoms.append(atom)
+            atom = self.pop_longest()
+        return atoms
+
+    def _find_slot(self, slot):
+        """
+        :return: the rightmost slot at or left of the specified slot whose atom has not been removed, or 0 if there is
+            no such slot
+        :rtype: int
+        """
+        root = slot
+        while self._slot_parents[root] != root:
+            root = self._slot_parents[root]
+        while self._slot_parents[slot] != root:
+            self._slot_parents[slot], slot = root, self._slot_parents[slot]
+        return root
+
+
 class _AtomTimingDataError(Exception):
     """
     An exception to represent the case where the atom timing data is either not present or incorrect.
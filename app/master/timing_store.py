@@ -0,0 +1,205 @@
+import json
+import math
+import os
+import sqlite3
+from threading import Lock
+
+from app.util import log
+import app.util.fs
+
+
+class AtomTimingStatistics(object):
+    """
+    The statistics of the historic times of one atom.
+    """
+    def __init__(self, mean, variance, p90, num_samples, recent_times=None):
+        """
+        :param mean: the exponentially weighted moving average of the atom's time in seconds
+        :type mean: float
+        :param variance: the exponentially weighted moving variance of the atom's time
+        :type variance: float
+        :param p90: the 90th percentile of the atom's recent times in seconds
+        :type p90: float
+        :param num_samples: the number of times the atom's time has been recorded
+        :type num_samples: int
+        :param recent_times: the atom's most recent times in seconds, oldest first
+        :type recent_times: list[float] | None
+        """
+        self.mean = mean
+        self.variance = variance
+        self.p90 = p90
+        self.num_samples = num_samples
+        self.recent_times = recent_times or [mean]
+
+    def percentile(self, fraction):
+        """
+        :param fraction: the percentile as a fraction, e.g., 0.9 for the 90th percentile
+        :type fraction: float
+        :return: the nearest-rank percentile of the atom's recent times in seconds
+        :rtype: float
+        """
+        return TimingStore._percentile(self.recent_times, fraction)
+
+
+class TimingStore(object):
+    """
+    Stores the historic times of atoms in an SQLite database, keyed by job and atom command. The times of the atoms
+    that passed are recorded after every build, and the statistics of each atom (see AtomTimingStatistics) are updated
+    in place, so a build only has to read and write the rows of its own atoms rather than the timing data of the whole
+    job.
+
+    Jobs are identified by the path of their timing file (see ProjectType.timing_file_path()). Timing data of a job
+    that was stored in that file before this store existed is imported the first time the job is looked up.
+
+    The database connection is shared by all threads, so every operation holds a lock while it uses it.
+    """
+    EWMA_WEIGHT = 0.3  # the weight of the newest time in the moving average and variance
+    MAX_RECENT_TIMES = 20  # the number of recent times per atom that the 90th percentile is calculated from
+    _MAX_QUERY_PARAMETERS = 500  # stay well below SQLite's default limit of 999 parameters per statement
+
+    def __init__(self, database_path):
+        """
+        :param database_path: the path of the SQLite database file. It is created when timing data is first recorded.
+        :type database_path: str
+        """
+        self._logger = log.get_logger(__name__)
+        self._database_path = database_path
+        self._connection = None
+        self._connection_lock = Lock()
+
+    def atom_statistics(self, job_key, atom_commands):
+        """
+        :param job_key: the path of the job's timing file
+        :type job_key: str
+        :param atom_commands: the commands of the atoms to look up
+        :type atom_commands: list[str]
+        :return: the statistics of each of the atoms that has timing data, by atom command
+        :rtype: dict[str, AtomTimingStatistics]
+        """
+        with self._connection_lock:
+            self._import_timing_file_if_new(job_key)
+            if self._connection is None and not os.path.isfile(self._database_path):
+                return {}  # Nothing has been recorded yet, so there is no need to create the database.
+            rows = self._select_atom_rows(self._get_connection(), job_key, atom_commands)
+        return {atom: AtomTimingStatistics(mean, variance, p90, num_samples, json.loads(recent_times))
+                for atom, (mean, variance, p90, num_samples, recent_times) in rows.items()}
+
+    def expected_times(self, job_key, atom_commands):
+        """
+        :param job_key: the path of the job's timing file
+        :type job_key: str
+        :param atom_commands: the commands of the atoms to look up
+        :type atom_commands: list[str]
+        :return: the expected time of each of the atoms that has timing data, by atom command
+        :rtype: dict[str, float]
+        """
+        return {atom: statistics.mean for atom, statistics in self.atom_statistics(job_key, atom_commands).items()}
+
+    def record_atom_times(self, job_key, atom_times):
+        """
+        Update the statistics of the specified atoms with the times they took in a build.
+
+        :param job_key: the path of the job's timing file
+        :type job_key: str
+        :param atom_times: the number of seconds each atom took, by atom command
+        :type atom_times: dict[str, float]
+        """
+        with self._connection_lock, self._get_connection() as connection:
+            self._import_timing_file_if_new(job_key)
+            rows = self._select_atom_rows(connection, job_key, list(atom_times))
+            updated_rows = []
+            for atom, atom_time in atom_times.items():
+                mean, variance, _, num_samples, recent_times = rows.get(atom, (atom_time, 0.0, None, 0, '[]'))
+                # Exponentially weighted moving average and variance, updated incrementally.
+                difference = atom_time - mean
+                increment = self.EWMA_WEIGHT * difference
+                mean += increment
+                variance = (1 - self.EWMA_WEIGHT) * (variance + difference * increment)
+                recent_times = (json.loads(recent_times) + [atom_time])[-self.MAX_RECENT_TIMES:]
+                updated_rows.append((job_key, atom, mean, variance, self._percentile(recent_times, 0.9),
+                                     num_samples + 1, json.dumps(recent_times)))
+            connection.executemany('INSERT OR REPLACE INTO atom_timings VALUES (?, ?, ?, ?, ?, ?, ?)', updated_rows)
+
+    def close(self):
+        """
+        Close the connection to the database. The store reconnects if it is used again.
+        """
+        with self._connection_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _import_timing_file_if_new(self, job_key):
+        """
+        Import the job's timing file into the store if the store has no timing data for the job yet. The caller must
+        hold the connection lock.
+
+        :param job_key: the path of the job's timing file
+        :type job_key: str
+        """
+        if not os.path.isfile(job_key):
+            return
+        connection = self._get_connection()
+        if connection.execute('SELECT 1 FROM atom_timings WHERE job = ? LIMIT 1', (job_key,)).fetchone():
+            return
+
+        try:
+            with open(job_key) as timing_file:
+                atom_times = json.load(timing_file)
+        except ValueError:
+            self._logger.warning('Failed to load timing data from file that exists {}', job_key)
+            return
+
+        self._logger.info('Importing timing data for {} atoms from {}.', len(atom_times), job_key)
+        with connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO atom_timings VALUES (?, ?, ?, 0, ?, 1, ?)',
+                [(job_key, atom, atom_time, atom_time, json.dumps([atom_time]))
+                 for atom, atom_time in atom_times.items()])
+
+    def _select_atom_rows(self, connection, job_key, atom_commands):
+        """
+        :type connection: sqlite3.Connection
+        :type job_key: str
+        :type atom_commands: list[str]
+        :return: the (mean, variance, p90, num_samples, recent_times) row of each atom that is stored, by atom command
+        :rtype: dict[str, tuple]
+        """
+        rows = {}
+        for batch_start in range(0, len(atom_commands), self._MAX_QUERY_PARAMETERS):
+            batch = atom_commands[batch_start:batch_start + self._MAX_QUERY_PARAMETERS]
+            cursor = connection.execute(
+                'SELECT atom, mean, variance, p90, num_samples, recent_times FROM atom_timings '
+                'WHERE job = ? AND atom IN ({})'.format(', '.join('?' * len(batch))), [job_key] + batch)
+            for atom, *row in cursor:
+                rows[atom] = tuple(row)
+        return rows
+
+    def _get_connection(self):
+        """
+        Get the connection to the database, creating the database if it does not exist yet. The caller must hold the
+        connection lock.
+
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            if os.path.dirname(self._database_path):
+                app.util.fs.create_dir(os.path.dirname(self._database_path))
+            connection = sqlite3.connect(self._database_path, timeout=30, check_same_thread=False)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS atom_timings ('
+                'job TEXT NOT NULL, atom TEXT NOT NULL, mean REAL NOT NULL, variance REAL NOT NULL, p90 REAL NOT NULL, '
+                'num_samples INTEGER NOT NULL, recent_times TEXT NOT NULL, PRIMARY KEY (job, atom)) WITHOUT ROWID')
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _percentile(values, fraction):
+        """
+        :type values: list[float]
+        :type fraction: float
+        :return: the nearest-rank percentile of the values
+        :rtype: float
+        """
+        sorted_values = sorted(values)
+        return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
@@ -1,7 +1,9 @@
 import os
 import shutil
+from threading import Lock
 from urllib.parse import urlparse
 
+from app.project_type.git_mirror_cache import GitMirrorCache
 from app.project_type.project_type import ProjectType
 from app.util import fs, log
 from app.util.conf.configuration import Configuration
@@ -17,6 +19,11 @@ class Git(ProjectType):
     """
     CLONE_DEPTH = 50
     DIRECTORY_PERMISSIONS = 0o700
+    WORKTREES_DIRECTORY = os.path.join('.git', 'clusterrunner_worktrees')  # relative to the repo directory
+
+    # Builds of the same repo that each have their own worktree share the repo, so updates to it are serialized.
+    _repo_locks = {}
+    _repo_locks_lock = Lock()
 
     @staticmethod
     def _generate_path_from_repo_url(base_sys_path, url):
@@ -72,9 +79,22 @@ class Git(ProjectType):
         """
         return Git._generate_path_from_repo_url(Configuration['timings_directory'], url)
 
+    @staticmethod
+    def get_mirror_directory(url):
+        """
+        Generates a sys path for the mirror of the repo that clones of it on this host share (see GitMirrorCache)
+        :param url: The remote 'origin' url for the git repo
+        :type url: str
+
+        :return: A path for the mirror of the git repo
+        :rtype: str
+        """
+        return Git._generate_path_from_repo_url(Configuration['git_mirror_directory'], url)
+
     # todo: Deprecate the "branch" parameter and create a new one named "ref" to replace it.
     def __init__(self, url, build_project_directory='', project_directory='', remote='origin', branch='master',
-                 config=None, job_name=None, remote_files=None, atoms_override=None):
+                 config=None, job_name=None, remote_files=None, atoms_override=None, sparse_checkout_paths=None,
+                 peer_host=None):
         """
         Note: the first line of each parameter docstring will be exposed as command line argument documentation for the
         clusterrunner build client.
@@ -97,15 +117,30 @@ class Git(ProjectType):
         :type remote_files: dict[str, str] | None
         :param atoms_override: The list of overridden atoms (if specified, will not run atomizer).
         :type atoms_override: list[str] | None
+        :param sparse_checkout_paths: The paths in the repo to check out (if specified, will not check out the rest).
+        :type sparse_checkout_paths: list[str] | None
+        :param peer_host: The host of another slave to fetch the commit from (falls back to url if that fails).
+        :type peer_host: str | None
         """
         super().__init__(config, job_name, remote_files, atoms_override)
         self._url = url
         self._remote = remote
         self._branch = branch
+        self._project_directory_in_repo = project_directory
+        self._sparse_checkout_paths = sparse_checkout_paths
+        self._peer_host = peer_host
+        self._mirror_cache = GitMirrorCache(Configuration['git_mirror_directory'],
+                                            Configuration['git_mirror_cache_size_gb'])
         self._repo_directory = self.get_full_repo_directory(self._url)
         self._timing_file_directory = self.get_timing_file_directory(self._url)
         self._local_ref = None
         self._logger = log.get_logger(__name__)
+        # With git_worktrees, the build checks out the commit in its own worktree of the repo instead of in the repo
+        # itself, so that several builds of the repo can be prepared at the same time.
+        self._worktree_directory = None
+        if Configuration['git_worktrees']:
+            self._worktree_directory = os.path.join(self._repo_directory, self.WORKTREES_DIRECTORY,
+                                                    os.path.basename(build_project_directory))
 
         # We explicitly set the repo directory to 700 so we don't inadvertently expose the repo to access by other users
         fs.create_dir(self._repo_directory, self.DIRECTORY_PERMISSIONS)
@@ -115,7 +150,7 @@ class Git(ProjectType):
         # Create a symlink from the generated build project directory to the actual project directory.
         # This is done in order to switch between the master's and the slave's copies of the repo while not
         # having to do something hacky in order to user the master's generated atoms on the slaves.
-        actual_project_directory = os.path.join(self._repo_directory, project_directory)
+        actual_project_directory = os.path.join(self._worktree_directory or self._repo_directory, project_directory)
         try:
             os.unlink(build_project_directory)
         except FileNotFoundError:
@@ -143,17 +178,118 @@ class Git(ProjectType):
             # continue to fetch the same HEAD, even if the master resets the user-specified branch for another build.
             param_overrides['branch'] = self._local_ref
 
+        # Slaves only check out the paths that the job needs, if the job config lists them. The master checks out the
+        # whole repo, since the atomizers may need any of it.
+        if self._job_config is not None and self._job_config.sparse_checkout_paths:
+            param_overrides['sparse_checkout_paths'] = self._job_config.sparse_checkout_paths
+
         return param_overrides
 
+    def can_be_fetched_from_slaves(self):
+        """
+        Slaves that get the project from the master all fetch the same local ref of the master's repo, which every slave
+        that has fetched it also has (see _fetch_into_repo()), so they can fetch it from each other instead.
+
+        :rtype: bool
+        """
+        return Configuration['get_project_from_master']
+
+    def peer_param_overrides(self, peer_host):
+        """
+        The slave fetches from the clone of the master's repo on the peer slave, which is in the same place as its own
+        clone if the slaves are configured alike. If it is not, or the peer is lost, the slave fetches from the master.
+
+        :type peer_host: str
+        :rtype: dict[str, str]
+        """
+        return {'peer_host': peer_host}
+
+    def cached_source(self):
+        """
+        The repo is cloned into a directory that is derived from its url and is kept between builds, so a later build
+        of the same repo only has to fetch the commits it does not have yet.
+
+        :return: The url of the repo and the commit hash that was fetched (or None if it has not been fetched yet)
+        :rtype: (str, str|None)
+        """
+        commit_hash = self._local_ref.rsplit('/', 1)[-1] if self._local_ref else None
+        return self._url, commit_hash
+
+    def has_build_specific_copy(self):
+        """
+        With git_worktrees, each build has its own worktree of the repo. Only fetching into the repo that the worktrees
+        share is serialized (see _fetch_project()).
+
+        :rtype: bool
+        """
+        return self._worktree_directory is not None
+
+    def remove_build_specific_copy(self):
+        """
+        Remove the build's worktree of the repo, if it has one. The commits it had checked out stay in the repo.
+        """
+        if self._worktree_directory is None:
+            return
+        with self._repo_lock():
+            try:
+                self._execute_git_command_in_repo_and_raise_on_failure(
+                    git_command='worktree remove --force {}'.format(self._worktree_directory),
+                    error_msg='Could not remove worktree.'
+                )
+            except RuntimeError:
+                self._logger.warning('Failed to remove worktree "{}".', self._worktree_directory)
+
     def _fetch_project(self):
         """
         Clones the project if necessary, fetches from the remote repo and resets to the requested commit
         """
+        if self._worktree_directory is None:
+            fetch_head_hash = self._fetch_into_repo()
+            self._reset_and_clean(fetch_head_hash, self._repo_directory)
+            return
+
+        with self._repo_lock():
+            fetch_head_hash = self._fetch_into_repo()
+            # The worktree of a build that crashed may still be on disk, and "git worktree add" fails if it is.
+            if os.path.exists(self._worktree_directory):
+                shutil.rmtree(self._worktree_directory)
+            # Worktrees that were deleted without "git worktree remove" (e.g., by a restart) are no longer registered.
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='worktree prune',
+                error_msg='Could not prune worktrees.'
+            )
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='worktree add --detach --no-checkout {} {}'.format(self._worktree_directory,
+                                                                               fetch_head_hash),
+                error_msg='Could not add worktree.'
+            )
+
+        # Checking out the commit only writes to the build's own worktree, so it does not need to hold the repo lock.
+        self._reset_and_clean(fetch_head_hash, self._worktree_directory)
+
+    def _fetch_into_repo(self):
+        """
+        Clones the repo if necessary and fetches the requested commit into it
+
+        :return: The full hash of the fetched commit
+        :rtype: str
+        """
         # If shallow_clones is set to True, then we need to specify the --depth=1 argument to all git fetch
         # and clone invocations.
-        git_clone_fetch_depth_arg = ''
+        git_clone_fetch_args = ''
         if Configuration['shallow_clones']:
-            git_clone_fetch_depth_arg = '--depth=1'
+            git_clone_fetch_args = '--depth=1'
+        # Partial clones only download the contents of files as they are checked out, which together with a sparse
+        # checkout means slaves only download the files that the job needs.
+        git_filter_arg = '--filter=blob:none' if Configuration['git_partial_clones'] else ''
+        git_clone_fetch_args = '{} {}'.format(git_clone_fetch_args, git_filter_arg).strip()
+
+        mirror_directory = None
+        if self._mirror_cache.is_enabled():
+            mirror_directory = self.get_mirror_directory(self._url)
+            # Mirrors are never shallow, since git cannot borrow objects from a shallow repo.
+            self._mirror_cache.update_mirror(mirror_directory, self._url, self._branch, git_filter_arg,
+                                             self._execute_git_command_in_repo_and_raise_on_failure)
 
         existing_repo_is_shallow = os.path.isfile(os.path.join(self._repo_directory, '.git', 'shallow'))
 
@@ -167,15 +303,33 @@ class Git(ProjectType):
             self._execute_git_command_in_repo_and_raise_on_failure('rev-parse')  # rev-parse succeeds if repo exists
         except RuntimeError:
             self._logger.notice('No valid repo in "{}". Cloning fresh from "{}".', self._repo_directory, self._url)
-            self._execute_git_command_in_repo_and_raise_on_failure(
-                git_command='clone {} {} {}'. format(git_clone_fetch_depth_arg, self._url, self._repo_directory),
+            # The clone borrows the objects that the mirror already has instead of downloading them again.
+            git_reference_arg = '--reference {}'.format(mirror_directory) if mirror_directory else ''
+            self._execute_git_command_from_peer_or_remote(
+                git_command='clone {} {} {{}} {}'. format(git_clone_fetch_args, git_reference_arg,
+                                                         self._repo_directory),
+                remote=self._url,
                 error_msg='Could not clone repo.'
             )
+            if self._peer_host:
+                # Later builds fetch from the original remote, even if the repo was cloned from the peer.
+                self._execute_git_command_in_repo_and_raise_on_failure(
+                    git_command='remote set-url origin {}'.format(self._url),
+                    error_msg='Could not configure repo.'
+                )
+            if mirror_directory:
+                self._mirror_cache.register_clone(mirror_directory, self._repo_directory)
+            # Slaves that fetch from the master's repo can then make partial clones of it.
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='config uploadpack.allowFilter true',
+                error_msg='Could not configure repo.'
+            )
 
         # Must add the --update-head-ok in the scenario that the current branch of the working directory
         # is equal to self._branch, otherwise the git fetch will exit with a non-zero exit code.
-        self._execute_git_command_in_repo_and_raise_on_failure(
-            git_command='fetch {} --update-head-ok {} {}'.format(git_clone_fetch_depth_arg, self._remote, self._branch),
+        self._execute_git_command_from_peer_or_remote(
+            git_command='fetch {} --update-head-ok {{}} {}'.format(git_clone_fetch_args, self._branch),
+            remote=self._remote,
             error_msg='Could not fetch specified branch "{}" from remote "{}".'.format(self._branch, self._remote)
         )
 
@@ -193,18 +347,105 @@ class Git(ProjectType):
             error_msg='Could not update local ref.'
         )
 
+        return fetch_head_hash
+
+    def _reset_and_clean(self, commit_hash, working_directory):
+        """
+        Resets the working tree to the commit and removes all untracked files
+
+        :type commit_hash: str
+        :param working_directory: The repo or worktree directory to reset
+        :type working_directory: str
+        """
+        git_directory = os.path.join(working_directory, self._execute_git_command_in_repo_and_raise_on_failure(
+            git_command='rev-parse --git-dir',
+            error_msg='Could not find git directory.',
+            cwd=working_directory
+        ).strip())
+        sparse_checkout_file_path = os.path.join(git_directory, 'info', 'sparse-checkout')
+        # A repo that a previous build checked out sparsely is widened to the whole repo before sparse checkout is
+        # disabled, since disabling it does not check out the missing files.
+        is_widening_sparse_checkout = not self._sparse_checkout_paths and os.path.isfile(sparse_checkout_file_path)
+        if self._sparse_checkout_paths or is_widening_sparse_checkout:
+            fs.write_file(self._sparse_checkout_patterns(), sparse_checkout_file_path)
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='config core.sparseCheckout true',
+                error_msg='Could not enable sparse checkout.',
+                cwd=working_directory
+            )
+
         # The '--' argument acts as a delimiter to differentiate values that can be "tree-ish" or a "path"
         self._execute_git_command_in_repo_and_raise_on_failure(
-            git_command='reset --hard {} --'.format(fetch_head_hash),
-            error_msg='Could not reset Git repo.'
+            git_command='reset --hard {} --'.format(commit_hash),
+            error_msg='Could not reset Git repo.',
+            cwd=working_directory
         )
 
+        if self._sparse_checkout_paths or is_widening_sparse_checkout:
+            # Files that were excluded by the previous sparse checkout patterns are only checked out by read-tree.
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='read-tree -mu HEAD',
+                error_msg='Could not apply sparse checkout.',
+                cwd=working_directory
+            )
+        if is_widening_sparse_checkout:
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='config core.sparseCheckout false',
+                error_msg='Could not disable sparse checkout.',
+                cwd=working_directory
+            )
+            os.remove(sparse_checkout_file_path)
+
         self._execute_git_command_in_repo_and_raise_on_failure(
             git_command='clean -dfx',
-            error_msg='Could not clean Git repo.'
+            error_msg='Could not clean Git repo.',
+            cwd=working_directory
         )
 
-    def _execute_git_command_in_repo_and_raise_on_failure(self, git_command, error_msg='Error executing git command.'):
+    def _sparse_checkout_patterns(self):
+        """
+        :return: The contents of the sparse-checkout file: the sparse checkout paths and clusterrunner.yaml, or the
+            whole repo if there are no sparse checkout paths
+        :rtype: str
+        """
+        if not self._sparse_checkout_paths:
+            return '/*\n'
+        yaml_file_path = os.path.join(self._project_directory_in_repo, Configuration['project_yaml_filename'])
+        return ''.join('/{}\n'.format(path.strip('/')) for path in self._sparse_checkout_paths + [yaml_file_path])
+
+    def _execute_git_command_from_peer_or_remote(self, git_command, remote, error_msg):
+        """
+        Execute a git command that downloads from a remote (e.g., "fetch {}") with the peer slave's clone of the repo
+        as the remote, if there is a peer slave, and again with the specified remote if that fails.
+
+        :param git_command: The git command to execute, with a {} placeholder for the remote
+        :type git_command: string
+        :param remote: The url or name of the remote to use if there is no peer slave or it fails
+        :type remote: string
+        :param error_msg: The human readable error message to log if the command fails
+        :type error_msg: string
+        :return: The output of the process (stdout and stderr)
+        :rtype: string
+        """
+        if self._peer_host:
+            peer_url = 'ssh://{}{}'.format(self._peer_host, self._repo_directory)
+            try:
+                return self._execute_git_command_in_repo_and_raise_on_failure(git_command.format(peer_url), error_msg)
+            except RuntimeError:
+                self._logger.warning('Could not get the project from peer slave "{}". Getting it from "{}" instead.',
+                                     self._peer_host, remote)
+        return self._execute_git_command_in_repo_and_raise_on_failure(git_command.format(remote), error_msg)
+
+    def _repo_lock(self):
+        """
+        :return: The lock that serializes updates to this repo by builds that each have their own worktree of it
+        :rtype: Lock
+        """
+        with self._repo_locks_lock:
+            return self._repo_locks.setdefault(self._repo_directory, Lock())
+
+    def _execute_git_command_in_repo_and_raise_on_failure(self, git_command, error_msg='Error executing git command.',
+                                                          cwd=None):
         """
         Execute the given git command. If it exits with a failing exit code then raise an exception.
 
@@ -215,6 +456,8 @@ class Git(ProjectType):
         :type git_command: string
         :param error_msg: The human readable error message to log if the command fails
         :type error_msg: string
+        :param cwd: The directory to execute the command in, or None for the repo directory
+        :type cwd: string | None
         :return: The output of the process (stdout and stderr)
         :rtype: string
         """
@@ -228,7 +471,7 @@ class Git(ProjectType):
             'GIT_SSH_ARGS': git_ssh_args,  # GIT_SSH_ARGS is not used by git; it is used by our git_ssh.sh wrapper.
         }
         command = 'git ' + git_command
-        return self._execute_and_raise_on_failure(command, error_msg, cwd=self._repo_directory, env_vars=env_vars)
+        return self._execute_and_raise_on_failure(command, error_msg, cwd=cwd or self._repo_directory, env_vars=env_vars)
 
     def execute_command_in_project(self, *args, **kwargs):
         """
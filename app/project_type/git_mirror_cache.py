@@ -0,0 +1,192 @@
+import os
+import shutil
+from threading import Lock
+
+from app.util import fs, log
+
+
+class GitMirrorCache(object):
+    """
+    Keeps a bare mirror of each git repo that is cloned on this host, which clones of the repo use as an alternate
+    object store (see "git clone --reference"). The commits a build fetches are fetched into the mirror first, so a
+    repo is only ever downloaded once per host: the clones of it (e.g., after the clone was deleted or a new
+    repo_directory was configured) and the fetches into them get the objects from the mirror instead. Mirrors can also
+    be seeded ahead of time, e.g., in the machine image of autoscaled slaves.
+
+    The least recently used mirrors are removed once the mirrors take up more than the configured disk quota. Before a
+    mirror is removed, the clones that use it get their own copy of its objects, since they would be corrupted
+    otherwise.
+    """
+    CLONES_FILE_NAME = 'clusterrunner_clones'  # lists the clones that use a mirror, one path per line
+
+    # Mirrors are shared by all the builds on this host, so updates to each of them are serialized.
+    _mirror_locks = {}
+    _mirror_locks_lock = Lock()
+    _eviction_lock = Lock()
+
+    def __init__(self, mirror_directory, max_size_gb):
+        """
+        :param mirror_directory: the directory that the mirrors are kept in
+        :type mirror_directory: str
+        :param max_size_gb: the disk quota of the mirrors in gigabytes, or 0 to disable the cache
+        :type max_size_gb: float
+        """
+        self._logger = log.get_logger(__name__)
+        self._mirror_directory = mirror_directory
+        self._max_size_bytes = max_size_gb * 1024 ** 3
+
+    def is_enabled(self):
+        """
+        :rtype: bool
+        """
+        return self._max_size_bytes > 0
+
+    def update_mirror(self, mirror_path, url, branch, clone_args, execute_git_command):
+        """
+        Create the mirror of the repo if it does not exist yet and fetch the branch into it.
+
+        :param mirror_path: the path of the repo's mirror, in the mirror directory
+        :type mirror_path: str
+        :param url: the url of the repo
+        :type url: str
+        :param branch: the branch or ref to fetch
+        :type branch: str
+        :param clone_args: extra arguments for "git clone" and "git fetch", e.g., "--filter=blob:none"
+        :type clone_args: str
+        :param execute_git_command: executes a git command, raising a RuntimeError if it fails (see
+            Git._execute_git_command_in_repo_and_raise_on_failure())
+        :type execute_git_command: callable
+        """
+        with self._mirror_lock(mirror_path):
+            if not os.path.isfile(os.path.join(mirror_path, 'HEAD')):
+                self._logger.notice('Creating mirror of "{}" in "{}".', url, mirror_path)
+                fs.create_dir(os.path.dirname(mirror_path))
+                execute_git_command(
+                    git_command='clone --bare {} {} {}'.format(clone_args, url, mirror_path),
+                    error_msg='Could not create mirror of repo.',
+                    cwd=os.path.dirname(mirror_path)
+                )
+            execute_git_command(
+                git_command='fetch {} {} {}'.format(clone_args, url, branch),
+                error_msg='Could not fetch "{}" into mirror.'.format(branch),
+                cwd=mirror_path
+            )
+            # Keep the fetched commit reachable so that "git gc" in the mirror does not remove objects that the clones
+            # which use the mirror depend on.
+            fetch_head_hash = execute_git_command(
+                git_command='rev-parse FETCH_HEAD',
+                error_msg='Could not rev-parse FETCH_HEAD of mirror.',
+                cwd=mirror_path
+            ).strip()
+            execute_git_command(
+                git_command='update-ref refs/clusterrunner/{0} {0}'.format(fetch_head_hash),
+                error_msg='Could not update mirror ref.',
+                cwd=mirror_path
+            )
+            os.utime(mirror_path)  # Mark the mirror as recently used.
+
+        self._evict_least_recently_used_mirrors(mirror_path, execute_git_command)
+
+    def register_clone(self, mirror_path, clone_path):
+        """
+        Record that a clone uses the mirror as an alternate object store, so that the clone can be given its own copy of
+        the objects before the mirror is removed.
+
+        :type mirror_path: str
+        :type clone_path: str
+        """
+        with self._mirror_lock(mirror_path):
+            with open(os.path.join(mirror_path, self.CLONES_FILE_NAME), 'a') as clones_file:
+                clones_file.write(clone_path + '\n')
+
+    def _evict_least_recently_used_mirrors(self, current_mirror_path, execute_git_command):
+        """
+        :param current_mirror_path: the mirror that is being used, which is never removed
+        :type current_mirror_path: str
+        :type execute_git_command: callable
+        """
+        with self._eviction_lock:
+            mirror_sizes = {mirror_path: self._directory_size(mirror_path) for mirror_path in self._mirror_paths()}
+            total_size = sum(mirror_sizes.values())
+            if total_size <= self._max_size_bytes:
+                return
+            for mirror_path in sorted(mirror_sizes, key=os.path.getmtime):
+                if total_size <= self._max_size_bytes:
+                    break
+                if mirror_path == current_mirror_path:
+                    continue
+                mirror_lock = self._mirror_lock(mirror_path)
+                if not mirror_lock.acquire(blocking=False):
+                    continue  # The mirror is being updated, so it is in use.
+                try:
+                    self._remove_mirror(mirror_path, execute_git_command)
+                except RuntimeError:
+                    self._logger.warning('Failed to remove mirror "{}".', mirror_path)
+                    continue
+                finally:
+                    mirror_lock.release()
+                total_size -= mirror_sizes[mirror_path]
+
+    def _remove_mirror(self, mirror_path, execute_git_command):
+        """
+        Give the clones that use the mirror their own copy of its objects and remove it.
+
+        :type mirror_path: str
+        :type execute_git_command: callable
+        """
+        self._logger.notice('Removing least recently used mirror "{}".', mirror_path)
+        clones_file_path = os.path.join(mirror_path, self.CLONES_FILE_NAME)
+        clone_paths = set()
+        if os.path.isfile(clones_file_path):
+            with open(clones_file_path) as clones_file:
+                clone_paths = set(clones_file.read().split())
+
+        for clone_path in clone_paths:
+            alternates_file_path = os.path.join(clone_path, '.git', 'objects', 'info', 'alternates')
+            if not os.path.isfile(alternates_file_path):
+                continue
+            # This is what "git clone --dissociate" does: repack the objects borrowed from the mirror into the clone.
+            execute_git_command(
+                git_command='repack -a -d',
+                error_msg='Could not repack clone that uses mirror.',
+                cwd=clone_path
+            )
+            os.remove(alternates_file_path)
+
+        shutil.rmtree(mirror_path)
+
+    def _mirror_paths(self):
+        """
+        :return: the paths of all the mirrors, which are bare repos that may be nested in directories for each host
+        :rtype: list[str]
+        """
+        mirror_paths = []
+        for directory_path, directory_names, file_names in os.walk(self._mirror_directory):
+            if 'HEAD' in file_names and 'objects' in directory_names:
+                mirror_paths.append(directory_path)
+                directory_names[:] = []  # Do not walk into the mirror.
+        return mirror_paths
+
+    def _mirror_lock(self, mirror_path):
+        """
+        :type mirror_path: str
+        :rtype: Lock
+        """
+        with self._mirror_locks_lock:
+            return self._mirror_locks.setdefault(mirror_path, Lock())
+
+    @staticmethod
+    def _directory_size(directory_path):
+        """
+        :type directory_path: str
+        :return: the total size of the files in the directory in bytes
+        :rtype: int
+        """
+        total_size = 0
+        for sub_directory_path, _, file_names in os.walk(directory_path):
+            for file_name in file_names:
+                try:
+                    total_size += os.path.getsize(os.path.join(sub_directory_path, file_name))
+                except FileNotFoundError:
+                    pass  # The file was removed while walking, e.g., by "git gc".
+        return total_size
@@ -3,7 +3,7 @@ import inspect
 import os
 import re
 import signal
-from subprocess import TimeoutExpired, STDOUT
+from subprocess import PIPE, TimeoutExpired, STDOUT
 from tempfile import TemporaryFile
 from threading import Event
 import time
@@ -13,6 +13,7 @@ from app.master.job_config import JobConfig
 from app.util import log
 from app.util.conf.configuration import Configuration
 from app.util.process_utils import Popen_with_delayed_expansion, get_environment_variable_setter_command
+from app.util.safe_thread import SafeThread
 
 
 class ProjectType(object):
@@ -62,6 +63,56 @@ class ProjectType(object):
         """
         return {}
 
+    def can_be_fetched_from_slaves(self):
+        """
+        Whether slaves can get this project from other slaves that have already fetched it for the same build (see
+        peer_param_overrides()), instead of every slave getting it from the same place. Override in subclasses that
+        support it.
+
+        :rtype: bool
+        """
+        return False
+
+    def peer_param_overrides(self, peer_host):
+        """
+        Produce a set of values to override the project type params for use on a slave machine (in addition to
+        slave_param_overrides()), so that the slave gets the project from another slave that has already fetched it.
+
+        :param peer_host: The host of the slave that has already fetched the project
+        :type peer_host: str
+        :return: A set of values to override original project type params
+        :rtype: dict[str, str]
+        """
+        return {}
+
+    def cached_source(self):
+        """
+        Get the source of this project that is kept on disk between builds, so that later builds of the same project
+        can reuse it. Override in subclasses whose fetch_project() keeps such a copy.
+
+        :return: The url of the repo and the commit hash that was fetched (or None if it is not known yet), or None if
+            this project type does not keep a copy of its source
+        :rtype: (str, str|None)|None
+        """
+        return None
+
+    def has_build_specific_copy(self):
+        """
+        Whether fetch_project() gives this build its own copy of the project to work in. Builds of the same project
+        that each have their own copy can be prepared at the same time, so the project type must then serialize any
+        updates to state that the copies share. Override in subclasses that keep such copies.
+
+        :rtype: bool
+        """
+        return False
+
+    def remove_build_specific_copy(self):
+        """
+        Remove the copy of the project that fetch_project() made for this build, if there is one (see
+        has_build_specific_copy()).
+        """
+        pass
+
     def job_config(self):
         """
         Return the job config found in this project_type and matching any job_name parameter passed in
@@ -135,6 +186,7 @@ class ProjectType(object):
         :type timeout: int | None
         """
         self.run_job_config_teardown(timeout=timeout)
+        self.remove_build_specific_copy()
         self._logger.info('ProjectType teardown complete.')
 
     def run_job_config_setup(self):
@@ -250,6 +302,65 @@ class ProjectType(object):
         combined_command_output = '\n'.join([console_output] + clusterrunner_error_msgs)
         return combined_command_output, exit_code
 
+    def stream_command_in_project(self, command, output_line_callback, extra_environment_vars=None, timeout=None):
+        """
+        Execute a command in the context of the project, passing each line of its standard output to a callback as soon
+        as the command writes it. Unlike execute_command_in_project(), the standard error output is kept separate.
+
+        :param command: the shell command to execute
+        :type command: string
+        :param output_line_callback: called with each line of the standard output (without the line ending)
+        :type output_line_callback: callable
+        :param extra_environment_vars: additional environment variables to set for command execution
+        :type extra_environment_vars: dict[str, str]
+        :param timeout: A maximum number of seconds before the process is terminated, or None for no timeout
+        :type timeout: int | None
+        :return: a tuple of (the standard error output of the command, the exit code of the command)
+        :rtype: (string, int)
+        """
+        environment_setter = self.shell_environment_command(extra_environment_vars)
+        command = self.command_in_project('{} {}'.format(environment_setter, command))
+        self._logger.debug('Streaming command in project: {}', command)
+
+        error_file = TemporaryFile()
+        pipe = Popen_with_delayed_expansion(
+            command,
+            shell=True,
+            stdout=PIPE,
+            stderr=error_file,
+            start_new_session=True,  # Starts a new process group (so we can kill it without killing clusterrunner).
+        )
+
+        # The standard output is read on this thread, so the command is watched on another one that terminates it on a
+        # timeout or when the kill event is set. Terminating the command closes its output, which ends the loop below.
+        clusterrunner_error_msgs = []
+        watcher_thread = SafeThread(
+            target=lambda: clusterrunner_error_msgs.extend(self._wait_for_pipe_to_close(pipe, command, timeout)),
+            name='CommandWatcher-{}'.format(pipe.pid),
+            daemon=True,
+        )
+        watcher_thread.start()
+        try:
+            for output_line in pipe.stdout:
+                output_line_callback(output_line.decode('utf-8', errors='replace').rstrip('\r\n'))
+        except Exception:
+            self._logger.warning('Terminating PID: {} after its output could not be handled.', pipe.pid)
+            try:
+                os.killpg(pipe.pid, signal.SIGTERM)
+            except (AttributeError, PermissionError, ProcessLookupError):
+                pipe.kill()
+            raise
+        finally:
+            pipe.stdout.close()
+            watcher_thread.join()
+
+        error_output = self._read_file_contents_and_close(error_file)
+        exit_code = pipe.returncode if pipe.returncode is not None else -1  # Make sure we always return an int.
+        if exit_code != 0:
+            self._logger.notice('Command exited with non-zero exit code.\nCommand: {}\nExit code: {}\n', command,
+                                exit_code)
+        return '\n'.join([error_output] + clusterrunner_error_msgs), exit_code
+
     def _wait_for_pipe_to_close(self, pipe, command, timeout):
         """
         Wait for the pipe to close (after command completes) or until timeout. If timeout is reached, then
@@ -427,7 +538,8 @@ class ProjectType(object):
     def project_id(self):
         """
         Get a string that uniquely identifies the project involved.  Build requests for the same project will have
-        their own serial request handler.  This allows us to parallelize the atomization of builds which are for
+        their own serial request handler (unless each build has its own copy of the project; see
+        has_build_specific_copy()).  This allows us to parallelize the atomization of builds which are for
         different projects (since their fetching and atomization commands will not collide).
         :return: string
         """
@@ -1,6 +1,8 @@
+from collections import OrderedDict
 from enum import Enum
-from queue import Queue
+from queue import Empty, Queue
 import sys
+from threading import Lock
 import time
 
 import requests
@@ -9,7 +11,10 @@ from app.common.cluster_service import ClusterService
 from app.project_type.project_type import SetupFailureError
 from app.slave.subjob_executor import SubjobExecutor
 from app.util import analytics, log, util
-from app.util.exceptions import BadRequestError
+from app.util.conf.configuration import Configuration
+from app.util.counter import Counter
+from app.util.dispatch_pool import DispatchPool
+from app.util.exceptions import BadRequestError, ItemNotFoundError
 from app.util.network import Network
 from app.util.safe_thread import SafeThread
 from app.util.secret import Secret
@@ -22,6 +27,7 @@ from app.util.url_builder import UrlBuilder
 class ClusterSlave(ClusterService):
 
     API_VERSION = 'v1'
+    _MAX_REPORTED_COMMITS_PER_REPO = 20
 
     def __init__(self, port, host, num_executors=10):
         """
@@ -50,11 +56,22 @@ class ClusterSlave(ClusterService):
         self._master_url = None
         self._network = Network(min_connection_poolsize=num_executors)
         self._master_api = None  # wait until we connect to a master first
+        self._heartbeat_thread = None
 
-        self._project_type = None  # this will be instantiated during build setup
-        self._current_build_id = None
-        self._build_teardown_coin = None
-        self._base_executor_index = None
+        # The repos (and the commits in them) that builds have fetched on this slave, most recent last. These are
+        # reported to the master so that it can prefer slaves that already have a build's source when allocating.
+        self._cached_commits_by_repo_url = OrderedDict()  # type: OrderedDict[str, list[str]]
+        self._cached_sources_lock = Lock()
+
+        # A slave can run several builds at once; the master decides how many of our executors each build may use.
+        self._builds_by_id = OrderedDict()  # type: OrderedDict[int, _SlaveBuild]
+
+        # Setup and teardown for a build run in order on the build pool. Each build uses at least one executor, so
+        # there can never be more builds to set up or tear down than there are executors. The subjob pool has twice
+        # as many workers as executors so that an executor can start its next subjob while the results of its previous
+        # subjob are still being sent to the master.
+        self._build_pool = DispatchPool(max_workers=num_executors, name='Build')
+        self._subjob_pool = DispatchPool(max_workers=2 * num_executors, name='Subjob')
 
     def api_representation(self):
         """
@@ -65,12 +82,23 @@ class ClusterSlave(ClusterService):
         return {
             'is_alive': self.is_alive,
             'master_url': self._master_url,
-            'current_build_id': self._current_build_id,
+            'current_build_id': self._current_build_id(),
+            'current_build_ids': list(self._builds_by_id.keys()),
             'slave_id': self._slave_id,
             'executors': executors_representation,
             'session_id': SessionId.get(),
+            'build_pool': self._build_pool.api_representation(),
+            'subjob_pool': self._subjob_pool.api_representation(),
         }
 
+    def _current_build_id(self):
+        """
+        :return: the id of the most recently setup build that is running on this slave, or None if there is none
+        :rtype: int | None
+        """
+        build_ids = list(self._builds_by_id.keys())
+        return build_ids[-1] if build_ids else None
+
     def get_status(self):
         """
         Just returns a dumb message and prints it to the console.
@@ -79,9 +107,10 @@ class ClusterSlave(ClusterService):
 
     def setup_build(self, build_id, project_type_params, build_executor_start_index):
         """
-        Usually called once per build to do build-specific setup. Will block any subjobs from executing until setup
-        completes. The actual setup is performed on another thread and will unblock subjobs (via an Event) once it
-        finishes.
+        Usually called once per build to do build-specific setup. This records a _SlaveBuild for the build and submits
+        the actual setup to the build DispatchPool, keyed by the build id, so that this call does not block. Once the
+        setup finishes, the master is notified (SETUP_COMPLETED or SETUP_FAILED), and it only sends the build's subjobs
+        after setup has completed. The subjobs then run on the subjob DispatchPool.
 
         :param build_id: The id of the build to run setup on
         :type build_id: int
@@ -92,112 +121,148 @@ class ClusterSlave(ClusterService):
         :type build_executor_start_index: int
         """
         self._logger.info('Executing setup for build {} (type: {}).', build_id, project_type_params.get('type'))
-        self._current_build_id = build_id
-        self._build_teardown_coin = SingleUseCoin()  # protects against build_teardown being executed multiple times
+        if build_id in self._builds_by_id:
+            raise BadRequestError('Tried to setup build {} but it is already running on this slave.'.format(build_id))
 
         # create an project_type instance for build-level operations
-        self._project_type = util.create_project_type(project_type_params)
-
-        # verify all executors are idle
-        if not self._idle_executors.full():
-            raise RuntimeError('Slave tried to setup build but not all executors are idle. ({}/{} executors idle.)'
-                               .format(self._idle_executors.qsize(), self._num_executors))
+        build = _SlaveBuild(build_id, util.create_project_type(project_type_params), build_executor_start_index)
+        self._builds_by_id[build_id] = build
 
-        # Collect all the executors to pass to project_type.fetch_project(). This will create a new project_type for
-        # each executor (for subjob-level operations).
-        executors = list(self._idle_executors.queue)
-        SafeThread(
-            target=self._async_setup_build,
-            name='Bld{}-Setup'.format(build_id),
-            args=(executors, project_type_params, build_executor_start_index)
-        ).start()
+        # Executors are not reserved for a particular build (other builds may be running on some of them right now),
+        # so every executor gets a project_type for this build. This will create a new project_type for each executor
+        # (for subjob-level operations).
+        executors = list(self.executors_by_id.values())
+        self._build_pool.submit(self._async_setup_build, build, executors, project_type_params, key=build_id)
 
-    def _async_setup_build(self, executors, project_type_params, build_executor_start_index):
+    def _async_setup_build(self, build, executors, project_type_params):
         """
         Called from setup_build(). Do asynchronous setup for the build so that we can make the call to setup_build()
         non-blocking.
 
+        :type build: _SlaveBuild
         :type executors: list[SubjobExecutor]
         :type project_type_params: dict
-        :type build_executor_start_index: int
         """
-        self._base_executor_index = build_executor_start_index
         try:
-            self._project_type.fetch_project()
+            build.project_type.fetch_project()
+            self._record_cached_source(build.project_type)
             for executor in executors:
-                executor.configure_project_type(project_type_params)
-            self._project_type.run_job_config_setup()
+                executor.configure_project_type(project_type_params, build.build_id)
+            build.project_type.run_job_config_setup()
 
         except SetupFailureError as ex:
             self._logger.error(ex)
-            self._logger.info('Notifying master that build setup has failed for build {}.', self._current_build_id)
-            self._notify_master_of_state_change(SlaveState.SETUP_FAILED)
+            self._logger.info('Notifying master that build setup has failed for build {}.', build.build_id)
+            self._notify_master_of_state_change(SlaveState.SETUP_FAILED, build.build_id)
 
         else:
-            self._logger.info('Notifying master that build setup is complete for build {}.', self._current_build_id)
-            self._notify_master_of_state_change(SlaveState.SETUP_COMPLETED)
+            self._logger.info('Notifying master that build setup is complete for build {}.', build.build_id)
+            self._notify_master_of_state_change(SlaveState.SETUP_COMPLETED, build.build_id)
+
+    def _record_cached_source(self, project_type):
+        """
+        Remember the source that a build has just fetched, so that it is included in our next heartbeat.
+
+        :type project_type: ProjectType
+        """
+        cached_source = project_type.cached_source()
+        if cached_source is None:
+            return
+        repo_url, commit_hash = cached_source
+        with self._cached_sources_lock:
+            cached_commits = self._cached_commits_by_repo_url.pop(repo_url, [])
+            if commit_hash is not None:
+                if commit_hash in cached_commits:
+                    cached_commits.remove(commit_hash)
+                cached_commits.append(commit_hash)
+            self._cached_commits_by_repo_url[repo_url] = cached_commits[-self._MAX_REPORTED_COMMITS_PER_REPO:]
+
+    def _cached_sources(self):
+        """
+        :return: the commits that have been fetched on this slave, keyed by the url of the repo they were fetched from
+        :rtype: dict[str, list[str]]
+        """
+        with self._cached_sources_lock:
+            return {repo_url: list(commits) for repo_url, commits in self._cached_commits_by_repo_url.items()}
 
     def teardown_build(self, build_id=None):
         """
         Called at the end of each build on each slave before it reports back to the master that it is idle again.
 
-        :param build_id: The build id to teardown -- this parameter is used solely for correctness checking of the
-            master, to make sure that the master is not erroneously sending teardown commands for other builds.
+        :param build_id: The build id to teardown. If None, the most recently setup build is torn down.
         :type build_id: int | None
         """
-        if self._current_build_id is None:
+        if not self._builds_by_id:
             raise BadRequestError('Tried to teardown a build but no build is active on this slave.')
 
-        if build_id is not None and build_id != self._current_build_id:
-            raise BadRequestError('Tried to teardown build {}, '
-                                  'but slave is running build {}!'.format(build_id, self._current_build_id))
-        SafeThread(
-            target=self._async_teardown_build,
-            name='Bld{}-Teardwn'.format(build_id)
-        ).start()
+        build_id = build_id if build_id is not None else self._current_build_id()
+        if build_id not in self._builds_by_id:
+            raise BadRequestError('Tried to teardown build {}, but slave is running builds {}!'
+                                  .format(build_id, list(self._builds_by_id.keys())))
+        self._build_pool.submit(self._async_teardown_build, build_id, key=build_id)
 
-    def _async_teardown_build(self):
+    def _async_teardown_build(self, build_id):
         """
         Called from teardown_build(). Do asynchronous teardown for the build so that we can make the call to
         teardown_build() non-blocking. Also take care of posting back to the master when teardown is complete.
+
+        :type build_id: int
         """
-        self._do_build_teardown_and_reset()
-        while not self._idle_executors.full():
+        build = self._builds_by_id.get(build_id)
+        self._do_build_teardown_and_reset(build_id=build_id)
+        while build and build.num_executors_in_use.value() > 0:
             time.sleep(1)
-        self._send_master_idle_notification()
+        self._send_master_idle_notification(build_id)
 
-    def _do_build_teardown_and_reset(self, timeout=None):
+    def _do_build_teardown_and_reset(self, timeout=None, build_id=None):
         """
-        Kill any currently running subjobs. Run the teardown_build commands for the current build (with an optional
-        timeout). Clear attributes related to the currently running build.
+        Kill any currently running subjobs. Run the teardown_build commands for the specified build (with an optional
+        timeout). Clear attributes related to that build.
 
         :param timeout: A maximum time in seconds to allow the teardown process to run before killing
         :type timeout: int | None
+        :param build_id: The build to tear down, or None to tear down all builds running on this slave
+        :type build_id: int | None
         """
-        # Kill all subjob executors' processes. This only has an effect if we are tearing down before a build completes.
+        build_ids = [build_id] if build_id is not None else list(self._builds_by_id.keys())
+        for build_id_to_teardown in build_ids:
+            self._do_single_build_teardown_and_reset(build_id_to_teardown, timeout=timeout)
+
+    def _do_single_build_teardown_and_reset(self, build_id, timeout=None):
+        """
+        :type build_id: int
+        :type timeout: int | None
+        """
+        # Kill the build's subjob executor processes. This only has an effect if we are tearing down before a build
+        # completes.
         for executor in self.executors_by_id.values():
-            executor.kill()
+            executor.kill(build_id)
 
-        # Order matters! Spend the coin if it has been initialized.
-        if not self._build_teardown_coin or not self._build_teardown_coin.spend() or not self._project_type:
+        # Order matters! Spend the coin if the build exists.
+        build = self._builds_by_id.get(build_id)
+        if not build or not build.teardown_coin.spend():
             return  # There is no build to tear down or teardown is already in progress.
 
-        self._logger.info('Executing teardown for build {}.', self._current_build_id)
+        self._logger.info('Executing teardown for build {}.', build_id)
         # todo: Catch exceptions raised during teardown_build so we don't skip notifying master of idle/disconnect.
-        self._project_type.teardown_build(timeout=timeout)
-        self._logger.info('Build teardown complete for build {}.', self._current_build_id)
-        self._current_build_id = None
-        self._project_type = None
-        self._base_executor_index = None
+        build.project_type.teardown_build(timeout=timeout)
+        for executor in self.executors_by_id.values():
+            executor.teardown_project_type(build_id)
+        self._logger.info('Build teardown complete for build {}.', build_id)
+        self._builds_by_id.pop(build_id, None)
 
-    def _send_master_idle_notification(self):
+    def _send_master_idle_notification(self, build_id=None):
+        """
+        :param build_id: the build that just finished teardown, if any
+        :type build_id: int | None
+        """
         if not self._is_master_responsive():
             self._logger.notice('Could not post idle notification to master because master is unresponsive.')
             return
 
         # Notify master that this slave is finished with teardown and ready for a new build.
         self._logger.info('Notifying master that this slave is ready for new builds.')
-        self._notify_master_of_state_change(SlaveState.IDLE)
+        self._notify_master_of_state_change(SlaveState.IDLE, build_id)
 
     def _disconnect_from_master(self):
         """
@@ -234,11 +299,37 @@ class ClusterSlave(ClusterService):
         self._slave_id = int(response.json().get('slave_id'))
         self._logger.info('Slave {}:{} connected to master on {}.', self.host, self.port, self._master_url)
 
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_thread = SafeThread(target=self._heartbeat_loop, name='Heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+
         # We disconnect from the master before build_teardown so that the master stops sending subjobs. (Teardown
         # callbacks are executed in the reverse order that they're added, so we add the build_teardown callback first.)
         UnhandledExceptionHandler.singleton().add_teardown_callback(self._do_build_teardown_and_reset, timeout=30)
         UnhandledExceptionHandler.singleton().add_teardown_callback(self._disconnect_from_master)
 
+    def _heartbeat_loop(self):
+        """
+        Periodically tell the master that this slave is still alive, along with the state of its executors. The master
+        considers a slave that stops sending heartbeats dead, and requeues the subjobs that were executing on it.
+        """
+        while self.is_alive:
+            time.sleep(Configuration['heartbeat_interval'])
+            if self.is_alive:
+                self._send_heartbeat()
+
+    def _send_heartbeat(self):
+        heartbeat_url = self._master_api.url('slave', self._slave_id, 'heartbeat')
+        executors_state = [executor.api_representation() for executor in self.executors_by_id.values()]
+        try:
+            heartbeat = {
+                'executors': executors_state,
+                'cached_sources': self._cached_sources(),
+            }
+            self._network.post_with_digest(heartbeat_url, heartbeat, Secret.get())
+        except requests.ConnectionError:
+            self._logger.warning('Could not send heartbeat to master on {}.', self._master_url)
+
     def _is_master_responsive(self):
         """
         Ping the master to check if it is still alive. Code using this method should treat the return value as a
@@ -260,7 +351,8 @@ class ClusterSlave(ClusterService):
     def start_working_on_subjob(self, build_id, subjob_id, atomic_commands):
         """
         Begin working on a subjob with the given build id and subjob id. This just starts the subjob execution
-        asynchronously on a separate thread.
+        asynchronously on the subjob pool. If all executors are busy (because the master dispatches more than one
+        subjob per executor), the subjob waits there for the next executor to become idle.
 
         :type build_id: int
         :type subjob_id: int
@@ -268,38 +360,63 @@ class ClusterSlave(ClusterService):
         :return: The text to return in the API response.
         :rtype: dict[str, int]
         """
-        if build_id != self._current_build_id:
-            raise BadRequestError('Attempted to start subjob {} for build {}, '
-                                  'but current build id is {}.'.format(subjob_id, build_id, self._current_build_id))
+        build = self._builds_by_id.get(build_id)
+        if build is None:
+            raise BadRequestError('Attempted to start subjob {} for build {}, but current build ids are {}.'
+                                  .format(subjob_id, build_id, list(self._builds_by_id.keys())))
 
-        # get idle executor from queue to claim it as in-use (or block until one is available)
-        executor = self._idle_executors.get()
+        # get idle executor from queue to claim it as in-use; if none is available, the subjob's task will wait for one
+        # instead so that we do not block the request thread.
+        try:
+            executor = self._idle_executors.get(block=False)
+        except Empty:
+            executor = None
+        build.num_executors_in_use.increment()
 
-        # Start a thread to execute the job (after waiting for setup to complete)
-        SafeThread(
-            target=self._execute_subjob,
-            args=(build_id, subjob_id, executor, atomic_commands),
-            name='Bld{}-Sub{}'.format(build_id, subjob_id),
-        ).start()
+        # Execute the job on the subjob pool (after waiting for setup to complete)
+        self._subjob_pool.submit(self._execute_subjob, build, subjob_id, executor, atomic_commands)
 
         self._logger.info('Slave ({}:{}) has received subjob. (Build {}, Subjob {})', self.host, self.port, build_id,
                           subjob_id)
-        return {'executor_id': executor.id}
+        return {'executor_id': executor.id if executor else None}
+
+    def release_unstarted_atoms(self, build_id, subjob_id):
+        """
+        Stop executing a subjob after the atom that is currently executing so that the master can hand the subjob's
+        remaining atoms to other executors.
+
+        :type build_id: int
+        :type subjob_id: int
+        :return: The text to return in the API response.
+        :rtype: dict[str, int]
+        """
+        for executor in self.executors_by_id.values():
+            num_atoms_to_execute = executor.release_unstarted_atoms(build_id, subjob_id)
+            if num_atoms_to_execute is not None:
+                self._logger.info('Released atoms after atom {} of subjob {} (build {}).', num_atoms_to_execute - 1,
+                                  subjob_id, build_id)
+                return {'num_atoms_to_execute': num_atoms_to_execute}
+
+        raise ItemNotFoundError('Subjob {} of build {} is not executing on this slave.'.format(subjob_id, build_id))
 
-    def _execute_subjob(self, build_id, subjob_id, executor, atomic_commands):
+    def _execute_subjob(self, build, subjob_id, executor, atomic_commands):
         """
         This is the method for executing a subjob asynchronously. This performs the work required by executing the
         specified command, then does a post back to the master results endpoint to signal that the work is done.
 
-        :type build_id: int
+        :type build: _SlaveBuild
         :type subjob_id: int
-        :type executor: SubjobExecutor
+        :param executor: the executor to run the subjob on, or None to wait for the next idle executor
+        :type executor: SubjobExecutor | None
         :type atomic_commands: list[str]
         """
+        if executor is None:
+            executor = self._idle_executors.get()
+        build_id = build.build_id
         subjob_event_data = {'build_id': build_id, 'subjob_id': subjob_id, 'executor_id': executor.id}
 
         analytics.record_event(analytics.SUBJOB_EXECUTION_START, **subjob_event_data)
-        results_file = executor.execute_subjob(build_id, subjob_id, atomic_commands, self._base_executor_index)
+        results_file = executor.execute_subjob(build_id, subjob_id, atomic_commands, build.base_executor_index)
         analytics.record_event(analytics.SUBJOB_EXECUTION_FINISH, **subjob_event_data)
 
         results_url = self._master_api.url('build', build_id, 'subjob', subjob_id, 'result')
@@ -310,19 +427,25 @@ class ClusterSlave(ClusterService):
         files = {'file': ('payload', open(results_file, 'rb'), 'application/x-compressed')}
 
         self._idle_executors.put(executor)  # work is done; mark executor as idle
+        build.num_executors_in_use.decrement()
         self._network.post(results_url, data=data, files=files)  # todo: check return code
 
         self._logger.info('Build {}, Subjob {} completed and sent results to master.', build_id, subjob_id)
 
-    def _notify_master_of_state_change(self, new_state):
+    def _notify_master_of_state_change(self, new_state, build_id=None):
         """
         Send a state notification to the master. This is used to notify the master of events occurring on the slave
         related to build execution progress.
 
         :type new_state: SlaveState
+        :param build_id: the build the state change applies to, since the slave may be running several builds
+        :type build_id: int | None
         """
         state_url = self._master_api.url('slave', self._slave_id)
-        self._network.put_with_digest(state_url, request_params={'slave': {'state': new_state}},
+        slave_params = {'state': new_state}
+        if build_id is not None:
+            slave_params['build_id'] = build_id
+        self._network.put_with_digest(state_url, request_params={'slave': slave_params},
                                       secret=Secret.get(), error_on_failure=True)
 
     def kill(self):
@@ -332,6 +455,25 @@ class ClusterSlave(ClusterService):
         sys.exit(0)
 
 
+class _SlaveBuild(object):
+    """
+    The slave's bookkeeping for one of the builds it is running.
+    """
+    def __init__(self, build_id, project_type, base_executor_index):
+        """
+        :type build_id: int
+        :param project_type: the project_type instance for build-level operations
+        :type project_type: ProjectType
+        :param base_executor_index: how many executors have already been allocated on other slaves for this build
+        :type base_executor_index: int
+        """
+        self.build_id = build_id
+        self.project_type = project_type
+        self.base_executor_index = base_executor_index
+        self.teardown_coin = SingleUseCoin()  # protects against build_teardown being executed multiple times
+        self.num_executors_in_use = Counter()
+
+
 class SlaveState(str, Enum):
     """
     An enum of possible slave states. Also inherits from string to allow comparisons with other strings (which is
@@ -1,5 +1,6 @@
 import os
 import shutil
+from threading import Lock
 import time
 
 from app.master.build import BuildArtifact
@@ -17,10 +18,14 @@ class SubjobExecutor(object):
         :type executor_id: int
         """
         self.id = executor_id
-        self._project_type = None
+        # A slave can be shared by several builds, so an executor keeps a project_type for each build it may run.
+        self._project_types_by_build_id = {}
         self._logger = log.get_logger(__name__)
         self._current_build_id = None
         self._current_subjob_id = None
+        self._current_atom_id = None
+        self._num_atoms_to_execute = None
+        self._current_subjob_lock = Lock()  # protects the current subjob's atom bookkeeping from release requests
         self._index_in_build = None
 
     def api_representation(self):
@@ -34,21 +39,34 @@ class SubjobExecutor(object):
             'current_subjob': self._current_subjob_id,
         }
 
-    def configure_project_type(self, project_type_params):
+    def configure_project_type(self, project_type_params, build_id=None):
         """
-        Configure the project_type that this executor will use to execute subjobs. If there is alredy a previous
-        project_type configured, tear it down.
+        Configure the project_type that this executor will use to execute subjobs for the specified build. If there is
+        already a project_type configured for that build, tear it down.
 
         :type project_type_params: dict[str, str]
+        :type build_id: int | None
         """
-        if self._project_type:
-            self._project_type.teardown_executor()
+        self.teardown_project_type(build_id)
+        project_type = util.create_project_type(project_type_params)
+        project_type.setup_executor()
+        self._project_types_by_build_id[build_id] = project_type
 
-        self._project_type = util.create_project_type(project_type_params)
-        self._project_type.setup_executor()
+    def teardown_project_type(self, build_id=None):
+        """
+        Tear down the project_type configured for the specified build, if any.
+
+        :type build_id: int | None
+        """
+        project_type = self._project_types_by_build_id.pop(build_id, None)
+        if project_type:
+            project_type.teardown_executor()
 
-    def run_job_config_setup(self):
-        self._project_type.run_job_config_setup()
+    def run_job_config_setup(self, build_id=None):
+        """
+        :type build_id: int | None
+        """
+        self._project_types_by_build_id[build_id].run_job_config_setup()
 
     def execute_subjob(self, build_id, subjob_id, atomic_commands, base_executor_index):
         """
@@ -63,15 +81,25 @@ class SubjobExecutor(object):
         """
         self._logger.info('Executing subjob (Build {}, Subjob {})...', build_id, subjob_id)
 
+        project_type = self._project_types_by_build_id[build_id]
+
         # Set the current task
-        self._current_build_id = build_id
-        self._current_subjob_id = subjob_id
+        with self._current_subjob_lock:
+            self._current_build_id = build_id
+            self._current_subjob_id = subjob_id
+            self._current_atom_id = 0
+            self._num_atoms_to_execute = len(atomic_commands)
 
         # Maintain a list of atom artifact directories for compression and sending back to master
         atom_artifact_dirs = []
 
         # execute every atom and keep track of time elapsed for each
         for atom_id, atomic_command in enumerate(atomic_commands):
+            with self._current_subjob_lock:
+                if atom_id >= self._num_atoms_to_execute:
+                    break  # The remaining atoms were released to be executed elsewhere.
+                self._current_atom_id = atom_id
+
             atom_artifact_dir = BuildArtifact.atom_artifact_directory(
                 build_id,
                 subjob_id,
@@ -93,11 +121,12 @@ class SubjobExecutor(object):
 
             atom_artifact_dirs.append(atom_artifact_dir)
 
-            job_name = self._project_type.job_name
+            job_name = project_type.job_name
             atom_event_data = {'build_id': build_id, 'atom_id': atom_id, 'job_name': job_name, 'subjob_id': subjob_id}
             analytics.record_event(analytics.ATOM_START, **atom_event_data)
 
-            exit_code = self._execute_atom_command(atomic_command, atom_environment_vars, atom_artifact_dir)
+            exit_code = self._execute_atom_command(project_type, atomic_command, atom_environment_vars,
+                                                   atom_artifact_dir)
 
             atom_event_data['exit_code'] = exit_code
             analytics.record_event(analytics.ATOM_FINISH, **atom_event_data)
@@ -113,23 +142,52 @@ class SubjobExecutor(object):
         fs_util.compress_directories(targets_to_archive_paths, tarfile_path)
 
         # Reset the current task
-        self._current_build_id = None
-        self._current_subjob_id = None
+        with self._current_subjob_lock:
+            self._current_build_id = None
+            self._current_subjob_id = None
+            self._current_atom_id = None
+            self._num_atoms_to_execute = None
 
         return tarfile_path
 
-    def kill(self):
+    def release_unstarted_atoms(self, build_id, subjob_id):
         """
-        Shutdown this executor. Kill any subprocesses the executor is currently executing.
+        Stop executing the specified subjob after the atom that is currently executing, so that the subjob's remaining
+        atoms can be executed elsewhere.
+
+        :type build_id: int
+        :type subjob_id: int
+        :return: the number of the subjob's atoms that this executor will execute, or None if this executor is not
+            executing the specified subjob
+        :rtype: int | None
         """
-        if self._project_type:
-            self._project_type.kill_subprocesses()
+        with self._current_subjob_lock:
+            if (build_id, subjob_id) != (self._current_build_id, self._current_subjob_id):
+                return None
+            self._num_atoms_to_execute = min(self._num_atoms_to_execute, self._current_atom_id + 1)
+            return self._num_atoms_to_execute
 
-    def _execute_atom_command(self, atomic_command, atom_environment_vars, atom_artifact_dir):
+    def kill(self, build_id=None):
+        """
+        Shutdown this executor. Kill any subprocesses the executor is currently executing for the specified build, or
+        for all builds if no build is specified.
+
+        :type build_id: int | None
+        """
+        if build_id is None:
+            project_types = list(self._project_types_by_build_id.values())
+        else:
+            project_types = [self._project_types_by_build_id.get(build_id)]
+        for project_type in project_types:
+            if project_type:
+                project_type.kill_subprocesses()
+
+    def _execute_atom_command(self, project_type, atomic_command, atom_environment_vars, atom_artifact_dir):
         """
         Run the main command for this atom. Output the command, console output and exit code to
         files in the atom artifact directory. Return the exit code.
 
+        :type project_type: ProjectType
         :type atomic_command: str
         :type atom_environment_vars: dict[str, str]
         :type atom_artifact_dir: str
@@ -137,11 +195,11 @@ class SubjobExecutor(object):
         """
         fs_util.create_dir(atom_artifact_dir)
         # This console_output_file must be opened in 'w+b' mode in order to be interchangeable with the
-        # TemporaryFile instance that gets instantiated in self._project_type.execute_command_in_project.
+        # TemporaryFile instance that gets instantiated in project_type.execute_command_in_project.
         with open(os.path.join(atom_artifact_dir, BuildArtifact.OUTPUT_FILE), mode='w+b') as console_output_file:
             start_time = time.time()
-            _, exit_code = self._project_type.execute_command_in_project(atomic_command, atom_environment_vars,
-                                                                         output_file=console_output_file)
+            _, exit_code = project_type.execute_command_in_project(atomic_command, atom_environment_vars,
+                                                                   output_file=console_output_file)
             elapsed_time = time.time() - start_time
 
         exit_code_output_path = os.path.join(atom_artifact_dir, BuildArtifact.EXIT_CODE_FILE)
@@ -0,0 +1,255 @@
+from collections import defaultdict, deque
+import json
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
+from tornado.ioloop import IOLoop
+
+from app.util.log import get_logger
+from app.util.network import ENCODED_BODY, RequestFailedError
+from app.util.secret import Secret
+
+
+class AsyncNetwork(object):
+    """
+    A non-blocking counterpart to Network, built on Tornado's AsyncHTTPClient. Every request method is a coroutine that
+    must be run on the IOLoop, so a request does not occupy a thread for its whole duration.
+
+    The request methods mirror those of Network (including the *_with_digest() methods, the retries on connection
+    errors, and the requests.ConnectionError that is raised when retries run out) so that callers can move over from
+    Network one call at a time.
+    """
+    def __init__(self, max_concurrent_requests=100, max_concurrent_requests_per_host=10):
+        """
+        :param max_concurrent_requests: The maximum number of requests in flight at once; further requests are queued
+        :type max_concurrent_requests: int
+        :param max_concurrent_requests_per_host: The maximum number of requests in flight to a single host at once. This
+            also bounds the number of connections the http client keeps open to each host.
+        :type max_concurrent_requests_per_host: int
+        """
+        self._logger = get_logger(__name__)
+        self._max_concurrent_requests = max_concurrent_requests
+        self._request_slots_by_host = defaultdict(lambda: _RequestSlots(max_concurrent_requests_per_host))
+        self._http_client = None  # created on first use so that it is bound to the IOLoop the requests run on
+
+    @gen.coroutine
+    def get(self, url, **kwargs):
+        """
+        Send a GET request to a url. Keyword arguments are the same as for _request().
+
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        response = yield self._request('GET', url, **kwargs)
+        return response
+
+    @gen.coroutine
+    def post(self, url, data=None, **kwargs):
+        """
+        Send a POST request to a url, retrying with exponential backoff on connection errors. Keyword arguments are the
+        same as for _request().
+
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        response = yield self._request_with_retries('POST', url, data=data, **kwargs)
+        return response
+
+    def post_with_digest(self, url, request_params, secret, error_on_failure=False):
+        """
+        Post to a url with the Message Authentication Digest
+        :type url: str
+        :type request_params: dict [str, any]
+        :param secret: the secret used to produce the message auth digest
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        encoded_body = self.encode_body(request_params)
+        return self.post(url, encoded_body, headers=Secret.header(encoded_body, secret),
+                         error_on_failure=error_on_failure)
+
+    @gen.coroutine
+    def put(self, url, data=None, **kwargs):
+        """
+        Send a PUT request to a url, retrying with exponential backoff on connection errors. Keyword arguments are the
+        same as for _request().
+
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        response = yield self._request_with_retries('PUT', url, data=data, **kwargs)
+        return response
+
+    def put_with_digest(self, url, request_params, secret, error_on_failure=False):
+        """
+        Put to a url with the Message Authentication Digest
+        :type url: str
+        :type request_params: dict [str, any]
+        :param secret: the secret used to produce the message auth digest
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        encoded_body = self.encode_body(request_params)
+        return self.put(url, encoded_body, headers=Secret.header(encoded_body, secret),
+                        error_on_failure=error_on_failure)
+
+    def encode_body(self, body_decoded):
+        """
+        :type body_decoded: dict [str, str]
+        :rtype: str
+        """
+        return json.dumps(body_decoded)
+
+    @gen.coroutine
+    def _request_with_retries(self, method, url, initial_delay=0.1, total_delay=15, exponential_factor=2, **kwargs):
+        """
+        The non-blocking equivalent of decorating a request method with retry_on_exception_exponential_backoff. The
+        IOLoop is free to run other requests while waiting to retry.
+
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        delay = initial_delay
+        total_delay_so_far = 0
+        while True:
+            try:
+                response = yield self._request(method, url, **kwargs)
+                return response
+            except requests.ConnectionError as ex:
+                if total_delay_so_far > total_delay:
+                    raise  # final attempt failed
+                self._logger.warning('{} request to {} raised {}("{}"). Retrying in {} seconds.',
+                                     method, url, type(ex).__name__, ex, delay)
+                yield _sleep(delay)
+                total_delay_so_far += delay
+                delay *= exponential_factor
+
+    @gen.coroutine
+    def _request(self, method, url, data=None, headers=None, should_encode_body=True, error_on_failure=False,
+                 timeout=None):
+        """
+        Send a request once the concurrency limit for the url's host allows it.
+
+        :param method: The request method
+        :type method: str
+        :param url: The request url
+        :type url: str
+        :param data: The request body data. As in Network, a dict is json-encoded and nested inside a new dict, which
+            is then form-encoded; the receiving end (ClusterBaseHandler) undoes this.
+        :type data: dict|str|bytes|None
+        :type headers: dict[str, str] | None
+        :param should_encode_body: If False, a dict body is form-encoded without the extra json-encoding step
+        :type should_encode_body: bool
+        :param error_on_failure: If true, raise an error when the response is not in the 200s
+        :type error_on_failure: bool
+        :param timeout: The number of seconds to wait for the response, or None for the http client's default. A
+            request that times out raises a requests.ConnectionError, like one that gets no response at all.
+        :type timeout: float | None
+        :rtype: tornado.concurrent.Future[AsyncResponse]
+        """
+        headers = dict(headers or {})
+        body = data
+        if isinstance(body, dict):
+            if should_encode_body:
+                body = {ENCODED_BODY: self.encode_body(body)}
+            body = urlencode(body)
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        if body is None and method in ('POST', 'PUT'):
+            body = ''  # the http client requires a body for these methods
+
+        request = HTTPRequest(url, method=method, headers=headers, body=body, connect_timeout=timeout,
+                              request_timeout=timeout)
+        request_slots = self._request_slots_by_host[urlsplit(url).netloc]
+        yield request_slots.acquire()
+        try:
+            tornado_response = yield self._get_http_client().fetch(request)
+        except HTTPError as ex:
+            # Tornado raises for responses that are not in the 200s; those are returned just like Network does. Code
+            # 599 is used by some http client implementations for errors where no response was received at all.
+            if ex.response is None or ex.code == 599:
+                raise requests.ConnectionError('{} request to {} failed: {}'.format(method, url, ex)) from ex
+            tornado_response = ex.response
+        except (IOError, OSError) as ex:
+            raise requests.ConnectionError('{} request to {} failed: {}'.format(method, url, ex)) from ex
+        finally:
+            request_slots.release()
+
+        response = AsyncResponse(tornado_response)
+        if not response.ok and error_on_failure:
+            raise RequestFailedError('Request to {} failed with status_code {} and response "{}"'.
+                                     format(url, str(response.status_code), response.text))
+        return response
+
+    def _get_http_client(self):
+        """
+        :rtype: AsyncHTTPClient
+        """
+        if self._http_client is None:
+            self._http_client = AsyncHTTPClient(force_instance=True, max_clients=self._max_concurrent_requests)
+        return self._http_client
+
+
+class AsyncResponse(object):
+    """
+    Exposes the parts of a Tornado HTTPResponse that callers of Network use on a requests.Response.
+    """
+    def __init__(self, tornado_response):
+        """
+        :type tornado_response: tornado.httpclient.HTTPResponse
+        """
+        self.status_code = tornado_response.code
+        self.headers = tornado_response.headers
+        self.content = tornado_response.body or b''
+
+    @property
+    def ok(self):
+        """ :rtype: bool """
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self):
+        """ :rtype: str """
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        """ :rtype: dict """
+        return json.loads(self.text)
+
+
+class _RequestSlots(object):
+    """
+    A counting semaphore for coroutines. This is only used from the IOLoop thread so it needs no locking.
+    """
+    def __init__(self, num_slots):
+        """
+        :type num_slots: int
+        """
+        self._num_free_slots = num_slots
+        self._waiters = deque()
+
+    def acquire(self):
+        """
+        :return: a future that resolves once a slot has been acquired
+        :rtype: Future
+        """
+        future = Future()
+        if self._num_free_slots > 0:
+            self._num_free_slots -= 1
+            future.set_result(None)
+        else:
+            self._waiters.append(future)
+        return future
+
+    def release(self):
+        if self._waiters:
+            self._waiters.popleft().set_result(None)  # hand the slot directly to the next waiter
+        else:
+            self._num_free_slots += 1
+
+
+def _sleep(seconds):
+    """
+    :return: a future that resolves after the specified number of seconds without blocking the IOLoop
+    :rtype: Future
+    """
+    future = Future()
+    io_loop = IOLoop.current()
+    io_loop.add_timeout(io_loop.time() + seconds, lambda: future.set_result(None))
+    return future
@@ -92,10 +92,24 @@ class BaseConfigLoader(object):
         # the same way how the master gets the project.
         conf.set('get_project_from_master', False)
 
+        # The number of seconds between the heartbeats that slaves send to the master
+        conf.set('heartbeat_interval', 10.0)
+
         # Should we have shallow or full clones of the repository?
         # The master must have full clones, as slaves fetch from the master, and one cannot fetch from a shallow clone.
         conf.set('shallow_clones', False)
 
+        # When true, each build of a git project checks out its commit in its own worktree of the shared repo, so that
+        # builds of the same repo can be prepared at the same time. Only fetching into the shared repo is serialized.
+        conf.set('git_worktrees', False)
+
+        # The disk quota in gigabytes of the bare mirrors of git repos that clones on this host share objects with. Set
+        # to 0 to clone without mirrors.
+        conf.set('git_mirror_cache_size_gb', 0.0)
+
+        # When true, git repos are cloned without the contents of files, which are downloaded as they are checked out
+        conf.set('git_partial_clones', False)
+
     def configure_postload(self, conf):
         """
         After the clusterrunner.conf file has been loaded, generate the paths which descend from the base_directory
@@ -107,6 +121,8 @@ class BaseConfigLoader(object):
 
         conf.set('log_file', join(log_dir, conf.get('log_filename')))
         conf.set('eventlog_file', join(log_dir, conf.get('eventlog_filename')))
+        # where the mirrors of git repos are kept, shared by the master and slave on the same host
+        conf.set('git_mirror_directory', join(base_directory, 'repos', 'mirrors'))
 
     def load_from_config_file(self, config, config_filename):
         """
@@ -141,6 +157,22 @@ class BaseConfigLoader(object):
             'git_strict_host_key_checking',
             'cors_allowed_origins_regex',
             'get_project_from_master',
+            'speculative_execution_multiplier',
+            'dynamic_subjob_splitting',
+            'subjob_dispatch_depth',
+            'max_slave_dispatch_threads',
+            'slave_liveness_probe_interval',
+            'heartbeat_interval',
+            'max_missed_heartbeats',
+            'atom_time_percentile',
+            'max_cached_atomizations',
+            'max_concurrent_atomizer_commands',
+            'streaming_atomization_batch_size',
+            'allocate_slaves_while_atomizing',
+            'project_distribution_fan_out',
+            'git_worktrees',
+            'git_mirror_cache_size_gb',
+            'git_partial_clones',
         ]
 
     def _load_section_from_config_file(self, config, config_filename, section):
@@ -189,6 +221,9 @@ class BaseConfigLoader(object):
         elif isinstance(default_value, int):
             config.set(key, int(value))
 
+        elif isinstance(default_value, float):
+            config.set(key, float(value))
+
         elif isinstance(default_value, list):
             # The ConfigObj library converts comma delimited strings to lists.  In the case on a single element, we
             # need to do the conversion ourselves.
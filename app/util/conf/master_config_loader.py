@@ -18,6 +18,40 @@ class MasterConfigLoader(BaseConfigLoader):
         conf.set('log_filename', 'clusterrunner_master.log')
         conf.set('eventlog_filename', 'eventlog_master.log')
         conf.set('shallow_clones', False)
+        # Once a build has no unstarted subjobs left, a subjob that has been running for this many times its expected
+        # time (based on historic timing data) is duplicated onto an idle executor. Set to 0 to disable.
+        conf.set('speculative_execution_multiplier', 2.0)
+        # When a build is running low on unstarted subjobs, split unstarted subjobs in two and take unstarted atoms
+        # from running subjobs so that idle executors can share the remaining work. Off by default.
+        conf.set('dynamic_subjob_splitting', False)
+        # The number of subjobs the master keeps dispatched to each executor. Values above 1 let slaves queue up their
+        # next subjob so that executors do not sit idle while results are sent to the master.
+        conf.set('subjob_dispatch_depth', 1)
+        # The maximum number of threads the master uses to send subjobs to slaves, shared by all slaves.
+        conf.set('max_slave_dispatch_threads', 32)
+        # The number of seconds between background liveness probes of each slave. A slave that does not respond within
+        # this time is considered dead.
+        conf.set('slave_liveness_probe_interval', 15.0)
+        # A slave that misses this many heartbeats in a row is considered dead, and its subjobs are requeued.
+        conf.set('max_missed_heartbeats', 3)
+        # The percentile (0-100) of each atom's recent times that atoms are grouped into subjobs by. Higher values make
+        # subjobs of atoms with unpredictable times less likely to overrun. Set to 0 to use the moving average.
+        conf.set('atom_time_percentile', 0.0)
+        # The number of atomizer outputs the master caches by commit, so that builds of a commit that has already been
+        # atomized skip running its atomizer commands. Set to 0 to disable.
+        conf.set('max_cached_atomizations', 500)
+        # The maximum number of a build's atomizer commands that the master executes at the same time.
+        conf.set('max_concurrent_atomizer_commands', 4)
+        # When set, the master groups atoms into subjobs in batches of this many as the atomizers output them, and
+        # starts executing the first subjobs while the atomizers are still running. Set to 0 to atomize up front.
+        conf.set('streaming_atomization_batch_size', 0)
+        # When true, slaves are allocated to a build and set up for it as soon as the master has fetched the project,
+        # while the master is still atomizing, as if the build could use all of its max_executors.
+        conf.set('allocate_slaves_while_atomizing', False)
+        # When set (and slaves get the project from the master), slaves that have set up a build serve the project to
+        # the build's other slaves, and each slave or the master serves at most this many slaves at a time, so that the
+        # master does not serve every slave itself. Set to 0 to have every slave get the project from the master.
+        conf.set('project_distribution_fan_out', 0)
 
     def configure_postload(self, conf):
         """
@@ -38,3 +72,6 @@ class MasterConfigLoader(BaseConfigLoader):
         # where to store results on the master
         conf.set('results_directory', join(base_directory, 'results', 'master'))
         conf.set('timings_directory', join(base_directory, 'timings', 'master'))  # timing data
+        conf.set('timing_database_path', join(base_directory, 'timings', 'master', 'timings.sqlite3'))
+        # where the output of atomizer commands is cached
+        conf.set('atomization_cache_directory', join(base_directory, 'atomizations', 'master'))
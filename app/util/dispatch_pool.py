@@ -0,0 +1,131 @@
+from collections import deque, OrderedDict
+from threading import Condition
+
+from app.util.safe_thread import SafeThread
+
+
+class DispatchPool(object):
+    """
+    A bounded pool of long-lived worker threads that runs submitted tasks. This is used instead of starting a new
+    thread for every request or subjob, which churns through thousands of short-lived threads on a large cluster.
+
+    Tasks submitted with the same key are run one at a time in the order they were submitted (e.g., all requests to
+    one slave), while tasks with different keys run concurrently. Tasks submitted without a key are not ordered.
+    """
+    def __init__(self, max_workers, name='Dispatch'):
+        """
+        :param max_workers: the maximum number of tasks to run concurrently
+        :type max_workers: int
+        :param name: the prefix of the names of this pool's worker threads
+        :type name: str
+        """
+        self._max_workers = max(1, max_workers)
+        self._name = name
+        self._pending_tasks_by_key = OrderedDict()  # type: OrderedDict[object, deque]
+        self._running_keys = set()
+        self._num_workers = 0
+        self._num_idle_workers = 0
+        self._num_pending_tasks = 0
+        self._condition = Condition()
+
+    def submit(self, target, *args, key=None, **kwargs):
+        """
+        Queue a task to be run on one of the pool's worker threads. A new worker thread is only started if none are
+        idle and the pool is not already at its maximum size.
+
+        :param target: the callable to run
+        :type target: callable
+        :param key: tasks with the same key are run one at a time, in the order they were submitted
+        :type key: collections.Hashable | None
+        """
+        with self._condition:
+            if key is None:
+                key = object()  # a unique key, so the task is not ordered relative to any other task
+            self._pending_tasks_by_key.setdefault(key, deque()).append((target, args, kwargs))
+            self._num_pending_tasks += 1
+            if self._num_idle_workers == 0 and self._num_workers < self._max_workers:
+                self._num_workers += 1
+                SafeThread(target=self._work, name='{}-{}'.format(self._name, self._num_workers), daemon=True).start()
+            self._condition.notify()
+
+    def queue_depth(self):
+        """
+        :return: the number of submitted tasks that have not started running yet
+        :rtype: int
+        """
+        with self._condition:
+            return self._num_pending_tasks
+
+    def num_busy_workers(self):
+        """
+        :return: the number of worker threads that are currently running a task
+        :rtype: int
+        """
+        with self._condition:
+            return self._num_workers - self._num_idle_workers
+
+    def api_representation(self):
+        """
+        Gets a dict representing this resource which can be returned in an API response.
+        :rtype: dict [str, mixed]
+        """
+        with self._condition:
+            return {
+                'max_workers': self._max_workers,
+                'num_workers': self._num_workers,
+                'num_busy_workers': self._num_workers - self._num_idle_workers,
+                'queue_depth': self._num_pending_tasks,
+            }
+
+    def _work(self):
+        """
+        The main loop of each worker thread. An exception raised by a task ends the worker thread and is funneled
+        through the unhandled exception handler, just as it would be if the task were run on its own SafeThread.
+        """
+        try:
+            while True:
+                with self._condition:
+                    self._num_idle_workers += 1
+                    key = self._next_runnable_key()
+                    while key is None:
+                        self._condition.wait()
+                        key = self._next_runnable_key()
+                    self._num_idle_workers -= 1
+                    target, args, kwargs = self._pop_pending_task(key)
+
+                try:
+                    target(*args, **kwargs)
+                finally:
+                    with self._condition:
+                        self._running_keys.discard(key)
+                        self._condition.notify_all()  # the next task with this key may now be runnable
+        finally:
+            with self._condition:
+                self._num_workers -= 1
+
+    def _next_runnable_key(self):
+        """
+        Find the key of the oldest pending task that is not waiting on a running task with the same key. This must be
+        called while holding self._condition.
+
+        :rtype: object | None
+        """
+        for key in self._pending_tasks_by_key:
+            if key not in self._running_keys:
+                return key
+        return None
+
+    def _pop_pending_task(self, key):
+        """
+        Remove the oldest pending task with the specified key and mark the key as running. This must be called while
+        holding self._condition.
+
+        :rtype: tuple
+        """
+        pending_tasks = self._pending_tasks_by_key[key]
+        task = pending_tasks.popleft()
+        if not pending_tasks:
+            del self._pending_tasks_by_key[key]
+        self._running_keys.add(key)
+        self._num_pending_tasks -= 1
+        return task
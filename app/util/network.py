@@ -121,8 +121,8 @@ class Network(object):
 
         resp = self._session.request(method, url, data=data_to_send, *args, **kwargs)
         if not resp.ok and error_on_failure:
-            raise _RequestFailedError('Request to {} failed with status_code {} and response "{}"'.
-                                      format(url, str(resp.status_code), resp.text))
+            raise RequestFailedError('Request to {} failed with status_code {} and response "{}"'.
+                                     format(url, str(resp.status_code), resp.text))
         return resp
 
     @staticmethod
@@ -172,5 +172,8 @@ class Network(object):
             return None
 
 
-class _RequestFailedError(Exception):
-    pass
+class RequestFailedError(Exception):
+    """
+    Raised by Network and AsyncNetwork when a request that was made with error_on_failure gets a response that is not
+    in the 200s.
+    """
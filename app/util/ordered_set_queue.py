@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 from queue import Queue
 
 
@@ -16,8 +16,30 @@ class OrderedSetQueue(Queue):
     def _get(self):
         return self.queue.pop()
 
-
-class OrderedSet(collections.MutableSet):
+    def snapshot(self):
+        """
+        :return: the items currently in the queue, in the order that get() would return them
+        :rtype: list
+        """
+        with self.mutex:
+            return list(reversed(self.queue))
+
+    def remove(self, item):
+        """
+        Remove an item from the queue if it is in the queue.
+
+        :return: whether the item was in the queue
+        :rtype: bool
+        """
+        with self.mutex:
+            if item not in self.queue:
+                return False
+            self.queue.discard(item)
+            self.not_full.notify()
+            return True
+
+
+class OrderedSet(collections.abc.MutableSet):
     """
     Set that remembers original insertion order.
     Code from http://code.activestate.com/recipes/576694/
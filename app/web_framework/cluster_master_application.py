@@ -52,7 +52,8 @@ class ClusterMasterApplication(ClusterApplication):
                     RouteNode(r'queue', _QueueHandler),
                     RouteNode(r'slave', _SlavesHandler, 'slaves').add_children([
                         RouteNode(r'(\d+)', _SlaveHandler, 'slave').add_children([
-                            RouteNode(r'shutdown', _SlaveShutdownHandler, 'shutdown')
+                            RouteNode(r'shutdown', _SlaveShutdownHandler, 'shutdown'),
+                            RouteNode(r'heartbeat', _SlaveHeartbeatHandler, 'heartbeat'),
                         ]),
                         RouteNode(r'shutdown', _SlavesShutdownHandler, 'shutdown')
                     ]),
@@ -297,8 +298,9 @@ class _SlaveHandler(_ClusterMasterBaseAPIHandler):
     @authenticated
     def put(self, slave_id):
         new_slave_state = self.decoded_body.get('slave', {}).get('state')
+        build_id = self.decoded_body.get('slave', {}).get('build_id')
         slave = self._cluster_master.get_slave(int(slave_id))
-        self._cluster_master.handle_slave_state_update(slave, new_slave_state)
+        self._cluster_master.handle_slave_state_update(slave, new_slave_state, build_id)
 
         self._write_status({
             'slave': slave.api_representation()
@@ -323,6 +325,16 @@ class _SlaveShutdownHandler(_ClusterMasterBaseAPIHandler):
         self._cluster_master.set_shutdown_mode_on_slaves(slaves_to_shutdown)
 
 
+class _SlaveHeartbeatHandler(_ClusterMasterBaseAPIHandler):
+    @authenticated
+    def post(self, slave_id):
+        executors_state = self.decoded_body.get('executors', [])
+        cached_sources = self.decoded_body.get('cached_sources')
+        slave = self._cluster_master.get_slave(int(slave_id))
+        self._cluster_master.handle_slave_heartbeat(slave, executors_state, cached_sources)
+        self._write_status()
+
+
 class _SlavesShutdownHandler(_ClusterMasterBaseAPIHandler):
     @authenticated
     def post(self):
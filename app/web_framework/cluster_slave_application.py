@@ -28,6 +28,7 @@ class ClusterSlaveApplication(ClusterApplication):
                             RouteNode(r'teardown', _TeardownHandler),
                             RouteNode(r'subjob', _SubjobsHandler, 'subjobs').add_children([
                                 RouteNode(r'(\d+)', _SubjobHandler, 'subjob').add_children([
+                                    RouteNode(r'release_atoms', _SubjobReleaseAtomsHandler),
                                     RouteNode(r'atom', _AtomsHandler, 'atoms').add_children([
                                         RouteNode(r'(\d+)', _AtomHandler).add_children([
                                             RouteNode(r'console', _AtomConsoleHandler)
@@ -122,6 +123,13 @@ class _SubjobHandler(_ClusterSlaveBaseAPIHandler):
         self.write(response)
 
 
+class _SubjobReleaseAtomsHandler(_ClusterSlaveBaseAPIHandler):
+    @authenticated
+    def post(self, build_id, subjob_id):
+        response = self._cluster_slave.release_unstarted_atoms(int(build_id), int(subjob_id))
+        self._write_status(response)
+
+
 class _AtomsHandler(_ClusterSlaveBaseAPIHandler):
     pass
 
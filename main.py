@@ -116,6 +116,10 @@ def _parse_args(args):
         help='remote file to use in the project with the format of: <NAME> <URL>',
         action='append',
         nargs=2)
+    build_parser.add_argument(
+        '--priority',
+        type=int,
+        help='the priority of this build; builds with a higher priority are allocated slaves first. Defaults to 0.')
 
     _add_project_type_subparsers(build_parser)
     build_parser.set_defaults(subcommand_class=BuildSubcommand)
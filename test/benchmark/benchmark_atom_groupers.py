@@ -0,0 +1,123 @@
+"""
+Compare the TimeBasedAtomGrouper with the OrderedDict-based implementation it replaced, on synthetic builds.
+
+For each build size this prints how long each grouper takes to group the atoms and the makespan of the resulting
+subjobs, i.e., how long the build would take if the subjobs were run in order on equally fast executors, each
+executor taking the next subjob as soon as it is free.
+
+Usage: python -m test.benchmark.benchmark_atom_groupers [--executors N] [--seed N] [NUM_ATOMS ...]
+"""
+import argparse
+from collections import OrderedDict
+import heapq
+import random
+import time
+
+from app.master.atom import Atom
+from app.master.time_based_atom_grouper import TimeBasedAtomGrouper
+
+
+class _OrderedDictAtomGrouper(TimeBasedAtomGrouper):
+    """
+    The grouping engine that TimeBasedAtomGrouper used before the sorted-array engine: every subjob rescans the
+    OrderedDict of ungrouped atoms from the start. The original popped atoms while iterating over the OrderedDict,
+    which raises a RuntimeError on current Pythons, so this iterates over a copy of its items instead (which is just
+    as slow).
+    """
+    def groupings(self):
+        total_estimated_runtime = self._set_expected_atom_times(
+            self._atoms, self._atom_time_map, self._project_directory)
+        atoms_by_decreasing_time = sorted(self._atoms, key=lambda atom: atom.expected_time, reverse=True)
+        sorted_atom_times_left = OrderedDict([(atom, atom.expected_time) for atom in atoms_by_decreasing_time])
+
+        big_subjob_time = (total_estimated_runtime * self.BIG_CHUNK_FRACTION) / self._max_executors
+        small_subjob_time = (total_estimated_runtime * (1.0 - self.BIG_CHUNK_FRACTION)) / (2 * self._max_executors)
+        subjobs = self._group_atoms_into_sized_buckets(sorted_atom_times_left, big_subjob_time, self._max_executors)
+        subjobs.extend(self._group_atoms_into_sized_buckets(sorted_atom_times_left, small_subjob_time, None))
+        return subjobs
+
+    def _group_atoms_into_sized_buckets(self, sorted_atom_time_dict, target_group_time, max_groups_to_create):
+        subjobs = []
+        subjob_time_so_far = 0
+        subjob_atoms = []
+
+        while (max_groups_to_create is None or len(subjobs) < max_groups_to_create) and len(sorted_atom_time_dict) > 0:
+            for atom, atom_time in list(sorted_atom_time_dict.items()):
+                if len(subjob_atoms) == 0 or (atom_time + subjob_time_so_far) <= target_group_time:
+                    subjob_time_so_far += atom_time
+                    subjob_atoms.append(atom)
+                    sorted_atom_time_dict.pop(atom)
+
+                    if max_groups_to_create is not None and \
+                            (len(subjobs) + len(sorted_atom_time_dict) + 1) <= max_groups_to_create:
+                        subjobs.append(subjob_atoms)
+                        subjobs.extend([atom] for atom in sorted_atom_time_dict)
+                        sorted_atom_time_dict.clear()
+                        return subjobs
+
+            subjobs.append(subjob_atoms)
+            subjob_atoms = []
+            subjob_time_so_far = 0
+
+        return subjobs
+
+
+def makespan(subjobs, num_executors):
+    """
+    :param subjobs: the grouped atoms, in the order they are dispatched
+    :type subjobs: list[list[Atom]]
+    :type num_executors: int
+    :return: the time at which the last executor finishes
+    :rtype: float
+    """
+    executor_free_times = [0.0] * num_executors
+    for subjob in subjobs:
+        free_time = heapq.heappop(executor_free_times)
+        heapq.heappush(executor_free_times, free_time + sum(atom.expected_time for atom in subjob))
+    return max(executor_free_times)
+
+
+def synthetic_atom_times(num_atoms, rng):
+    """
+    Atom times in real test suites are heavily skewed: most atoms take a few seconds and a few take minutes.
+
+    :type num_atoms: int
+    :type rng: random.Random
+    :rtype: dict[str, float]
+    """
+    return {'atom_{}'.format(i): round(rng.lognormvariate(1.0, 1.2), 3) for i in range(num_atoms)}
+
+
+def run_benchmark(num_atoms, num_executors, seed):
+    """
+    :rtype: list[(str, float, float, int)]
+    """
+    atom_time_map = synthetic_atom_times(num_atoms, random.Random(seed))
+    results = []
+    for grouper_class in (_OrderedDictAtomGrouper, TimeBasedAtomGrouper):
+        atoms = [Atom(command_string) for command_string in atom_time_map]
+        grouper = grouper_class(atoms, num_executors, atom_time_map, '')
+        start_time = time.perf_counter()
+        subjobs = grouper.groupings()
+        grouping_time = time.perf_counter() - start_time
+        results.append((grouper_class.__name__, grouping_time, makespan(subjobs, num_executors), len(subjobs)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('num_atoms', nargs='*', type=int, default=[1000, 10000, 50000])
+    parser.add_argument('--executors', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('{:>8}  {:<24}{:>14}{:>14}{:>10}'.format('atoms', 'grouper', 'grouping (s)', 'makespan (s)', 'subjobs'))
+    for num_atoms in args.num_atoms:
+        for grouper_name, grouping_time, build_makespan, num_subjobs in run_benchmark(
+                num_atoms, args.executors, args.seed):
+            print('{:>8}  {:<24}{:>14.3f}{:>14.1f}{:>10}'.format(
+                num_atoms, grouper_name, grouping_time, build_makespan, num_subjobs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+"""
+Simulate builds on a virtual cluster, to see how the master's scheduling holds up on a given fleet without running one.
+
+A job's timing file (or a synthetic atom time distribution) is replayed through the master's real scheduling code:
+the SubjobCalculator groups the atoms into subjobs, the SlaveAllocator hands out slaves, and each BuildScheduler sends
+subjobs to them, splits subjobs and releases atoms from running subjobs at the tail of the build. Only the slaves are
+simulated. Each virtual slave has a number of executors and a speed (drawn around 1.0 with the configured variance),
+every request between the master and a slave takes the dispatch latency, and every subjob result takes the upload cost
+to reach the master. Time is virtual, so a simulated build takes a fraction of a second however long it would run.
+
+Builds are run one after another on the same fleet, so later builds are scheduled with the slave speeds that the
+master has measured during earlier builds. For each build this prints:
+    - the makespan: the time from the build being queued until its last result reached the master
+    - the executor idle time: the executor seconds during the makespan that no subjob was running
+    - the tail waste: the part of the executor idle time after each executor finished its last subjob of the build
+
+Speculative execution is disabled in the simulation, since the master measures how long subjobs have been running with
+the wall clock.
+
+Usage: python -m test.benchmark.cluster_simulator [--timing-file PATH | --synthetic NUM_ATOMS] [--slaves N] ...
+"""
+import argparse
+from collections import deque
+import heapq
+from itertools import count
+import json
+import os
+import random
+import tempfile
+
+import logbook
+
+from app.master.build import Build
+from app.master.build_fsm import BuildEvent
+from app.master.build_request import BuildRequest
+from app.master.build_scheduler_pool import BuildSchedulerPool
+from app.master.job_config import JobConfig
+from app.master.slave import Slave
+from app.master.slave_allocator import SlaveAllocator
+from app.master.subjob_calculator import SubjobCalculator
+from app.master.timing_store import TimingStore
+from app.project_type.project_type import ProjectType
+from app.util.conf.configuration import Configuration
+from app.util.conf.master_config_loader import MasterConfigLoader
+from app.util.unhandled_exception_handler import UnhandledExceptionHandler
+from test.benchmark.benchmark_atom_groupers import synthetic_atom_times
+
+
+class ClusterSimulation(object):
+    """
+    A fleet of virtual slaves and the master scheduling objects that builds are run through.
+    """
+    def __init__(self, atom_times, num_slaves, executors_per_slave, dispatch_latency=0.05, upload_cost=0.5,
+                 setup_time=30.0, speed_variance=0.0, atom_time_noise=0.0, max_executors=None, seed=0):
+        """
+        :param atom_times: the time each atom takes on a slave with a speed of 1.0, by atom command
+        :type atom_times: dict[str, float]
+        :type num_slaves: int
+        :type executors_per_slave: int
+        :param dispatch_latency: the number of seconds each request between the master and a slave takes
+        :type dispatch_latency: float
+        :param upload_cost: the number of seconds it takes a slave to send the results of a subjob to the master
+        :type upload_cost: float
+        :param setup_time: the number of seconds it takes a slave to set up a build
+        :type setup_time: float
+        :param speed_variance: the variance of the log of the slave speeds (0 makes every slave equally fast)
+        :type speed_variance: float
+        :param atom_time_noise: the variance of the log of the factor by which each atom execution deviates from the
+            atom's time (0 makes every atom take exactly its time)
+        :type atom_time_noise: float
+        :param max_executors: the max_executors of the job, or None for no limit
+        :type max_executors: int | None
+        :type seed: int
+        """
+        self._atom_times = atom_times
+        self._dispatch_latency = dispatch_latency
+        self._upload_cost = upload_cost
+        self._setup_time = setup_time
+        self._atom_time_noise_sigma = atom_time_noise ** 0.5
+        self._max_executors = max_executors or JobConfig.DEFAULT_MAX_EXECUTORS
+        self._rng = random.Random(seed)
+        self._clock = _VirtualClock()
+
+        self._temp_dir = tempfile.TemporaryDirectory(prefix='clusterrunner_simulation_')
+        Configuration['results_directory'] = os.path.join(self._temp_dir.name, 'results')
+        Configuration['atomization_cache_directory'] = os.path.join(self._temp_dir.name, 'atomizations')
+        self._timing_file_path = os.path.join(self._temp_dir.name, 'simulated_job.timing.json')
+        with open(self._timing_file_path, 'w') as timing_file:
+            json.dump(atom_times, timing_file)
+
+        self._scheduler_pool = BuildSchedulerPool()
+        self._slave_allocator = SlaveAllocator(self._scheduler_pool)
+        self._subjob_calculator = SubjobCalculator(
+            self._executor_speed_factors, TimingStore(os.path.join(self._temp_dir.name, 'timings.sqlite3')))
+        speed_sigma = speed_variance ** 0.5
+        self._slaves = [_SimulatedSlave(self, executors_per_slave, self._rng.lognormvariate(0, speed_sigma))
+                        for _ in range(num_slaves)]
+        for slave in self._slaves:
+            self._slave_allocator.add_idle_slave(slave)
+
+        self._current_build = None
+        self._num_subjobs_completed = 0
+        self._build_finish_time = None
+
+    @property
+    def now(self):
+        """
+        :return: the current virtual time, in seconds since the simulation started
+        :rtype: float
+        """
+        return self._clock.now
+
+    def call_later(self, delay, callback, *args):
+        """
+        :type delay: float
+        :type callback: callable
+        """
+        self._clock.call_later(delay, callback, *args)
+
+    def run_build(self):
+        """
+        Run a build of the job on the fleet and wait (in virtual time) until all of its results have been received and
+        all of its slaves have been torn down.
+
+        :rtype: SimulatedBuildReport
+        """
+        project_type = _SimulatedProjectType(list(self._atom_times), self._timing_file_path, self._max_executors)
+        build = _SimulatedBuild(project_type)
+        build.prepare(self._subjob_calculator)
+        num_subjobs = len(build.all_subjobs())
+
+        self._current_build = build
+        self._num_subjobs_completed = 0
+        self._build_finish_time = None
+        start_time = self.now
+        for slave in self._slaves:
+            slave.reset_executor_statistics(start_time)
+
+        self._scheduler_pool.add_build_waiting_for_slaves(build)
+        self._allocate_idle_slaves()
+        self._clock.run(after_each_event=self._allocate_idle_slaves)
+        if self._build_finish_time is None:
+            raise RuntimeError('Simulated build {} did not finish.'.format(build.build_id()))
+
+        makespan = self._build_finish_time - start_time
+        executor_busy_time, executor_last_finish_times = 0.0, []
+        for slave in self._slaves:
+            executor_busy_time += sum(slave.executor_busy_times)
+            executor_last_finish_times.extend(slave.executor_last_finish_times)
+        num_executors = len(executor_last_finish_times)
+        total_work = sum(self._atom_times.values())
+        total_speed = sum(slave.true_speed * slave.num_executors for slave in self._slaves)
+        return SimulatedBuildReport(
+            num_subjobs=num_subjobs,
+            makespan=makespan,
+            lower_bound=total_work / total_speed,
+            executor_idle_time=makespan * num_executors - executor_busy_time,
+            tail_waste=sum(self._build_finish_time - last_finish_time
+                           for last_finish_time in executor_last_finish_times),
+        )
+
+    def report_result(self, slave, subjob, actual_atom_times):
+        """
+        Handle a subjob result that has reached the master, as ClusterMaster.handle_result_reported_from_slave() does.
+
+        :type slave: _SimulatedSlave
+        :type subjob: app.master.subjob.Subjob
+        :param actual_atom_times: the number of seconds each of the subjob's atoms took on the slave
+        :type actual_atom_times: list[float]
+        """
+        build = self._current_build
+        try:
+            if build.complete_subjob(subjob.subjob_id()):
+                timed_atoms = [(atom.expected_time, actual_time)
+                               for atom, actual_time in zip(subjob.atoms, actual_atom_times) if atom.expected_time]
+                if timed_atoms:
+                    slave.record_atom_times(expected_time=sum(expected for expected, _ in timed_atoms),
+                                            actual_time=sum(actual for _, actual in timed_atoms))
+                self._num_subjobs_completed += 1
+                if self._num_subjobs_completed == len(build.all_subjobs()):
+                    self._build_finish_time = self.now
+        finally:
+            self._scheduler_pool.get(build).execute_next_subjob_or_free_executor(slave)
+
+    def begin_subjob_executions(self, slave, build):
+        """
+        Handle a slave reporting that it has set up a build, as ClusterMaster._handle_setup_success_on_slave() does.
+
+        :type slave: _SimulatedSlave
+        :type build: Build
+        """
+        self._scheduler_pool.get(build).begin_subjob_executions_on_slave(slave)
+
+    def add_idle_slave(self, slave):
+        """
+        Handle a slave reporting that it is idle after a teardown.
+
+        :type slave: _SimulatedSlave
+        """
+        self._slave_allocator.add_idle_slave(slave)
+
+    def atom_execution_time(self, command_string, slave):
+        """
+        :type command_string: str
+        :type slave: _SimulatedSlave
+        :return: the number of seconds one execution of the atom takes on the slave
+        :rtype: float
+        """
+        noise = self._rng.lognormvariate(0, self._atom_time_noise_sigma) if self._atom_time_noise_sigma else 1.0
+        return self._atom_times[command_string] * noise / slave.true_speed
+
+    def _allocate_idle_slaves(self):
+        """
+        Do the work of the SlaveAllocator's allocation loop, which cannot run on its own thread here since it would
+        block waiting for builds and slaves instead of letting virtual time pass.
+        """
+        for _ in range(len(self._slaves)):
+            if self._scheduler_pool.next_fair_share_build_scheduler() is None:
+                return
+            claimed_slave = self._slave_allocator.take_idle_slave()
+            if claimed_slave is None:
+                return
+            self._slave_allocator.allocate_slave(claimed_slave)
+
+    def _executor_speed_factors(self):
+        """
+        :return: the speed factor of each executor of the fleet, fastest first (see ClusterMaster)
+        :rtype: list[float]
+        """
+        speed_factors = []
+        for slave in self._slaves:
+            speed_factors.extend([slave.speed_factor] * slave.num_executors)
+        return sorted(speed_factors, reverse=True)
+
+
+class SimulatedBuildReport(object):
+    """
+    The statistics of a simulated build. All times are in seconds.
+    """
+    def __init__(self, num_subjobs, makespan, lower_bound, executor_idle_time, tail_waste):
+        """
+        :param num_subjobs: the number of subjobs the atoms were grouped into (before any were split)
+        :type num_subjobs: int
+        :type makespan: float
+        :param lower_bound: the makespan the build would have if its work was spread perfectly over the executors
+        :type lower_bound: float
+        :type executor_idle_time: float
+        :type tail_waste: float
+        """
+        self.num_subjobs = num_subjobs
+        self.makespan = makespan
+        self.lower_bound = lower_bound
+        self.executor_idle_time = executor_idle_time
+        self.tail_waste = tail_waste
+
+
+class _VirtualClock(object):
+    """
+    A discrete event loop: callbacks are run in order of the virtual time they were scheduled for.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        self._event_sequence = count()  # breaks ties between events for the same time in the order they were scheduled
+
+    def call_later(self, delay, callback, *args):
+        """
+        :type delay: float
+        :type callback: callable
+        """
+        heapq.heappush(self._events, (self.now + delay, next(self._event_sequence), callback, args))
+
+    def run(self, after_each_event):
+        """
+        Run events until there are none left.
+
+        :param after_each_event: called after each event
+        :type after_each_event: callable
+        """
+        while self._events:
+            self.now, _, callback, args = heapq.heappop(self._events)
+            callback(*args)
+            after_each_event()
+
+
+class _SimulatedProjectType(ProjectType):
+    """
+    A project type whose atoms are given up front (like a build request with atoms_override) and whose timing file is
+    the one being replayed (it is imported into the simulation's timing store when the first build is prepared).
+    """
+    def __init__(self, atom_commands, timing_file_path, max_executors):
+        """
+        :type atom_commands: list[str]
+        :type timing_file_path: str
+        :type max_executors: int
+        """
+        super().__init__(job_name='simulated_job', atoms_override=atom_commands)
+        self._simulated_timing_file_path = timing_file_path
+        self._job_config = JobConfig(name='simulated_job', setup_build=None, teardown_build=None, command=[],
+                                     atomizer=None, max_executors=max_executors,
+                                     max_executors_per_slave=JobConfig.DEFAULT_MAX_EXECUTORS)
+
+    def _fetch_project(self):
+        pass
+
+    def timing_file_path(self, job_name):
+        return self._simulated_timing_file_path
+
+    def project_id(self):
+        return 'simulated_project'
+
+
+class _SimulatedBuild(Build):
+    """
+    A build whose postbuild tasks only mark it finished, so that the replayed timing file is not overwritten.
+    """
+    def __init__(self, project_type):
+        """
+        :type project_type: _SimulatedProjectType
+        """
+        super().__init__(BuildRequest({'type': 'simulated'}))
+        self._project_type = project_type
+
+    def _perform_async_postbuild_tasks(self):
+        self._postbuild_tasks_are_finished = True
+        self._state_machine.trigger(BuildEvent.POSTBUILD_TASKS_COMPLETE)
+
+
+class _SimulatedSlave(Slave):
+    """
+    The master's view of a slave, with the requests it sends to the slave replaced by events on the virtual clock.
+
+    Like a real slave, a virtual slave queues the subjobs it is sent until one of its executors is free, and an
+    executor is free to start its next subjob while the results of its previous subjob are being sent to the master.
+    """
+    def __init__(self, simulation, num_executors, true_speed):
+        """
+        :type simulation: ClusterSimulation
+        :type num_executors: int
+        :param true_speed: how fast the slave executes atoms compared to the times in the timing file
+        :type true_speed: float
+        """
+        super().__init__('simulated-slave-{}:43001'.format(Slave._slave_id_counter.value() + 1), num_executors)
+        self._network = _NullNetwork()
+        self._simulation = simulation
+        self.true_speed = true_speed
+        self._idle_executor_indices = list(range(num_executors))
+        self._queued_subjobs = deque()
+        self._executions_by_subjob_key = {}
+        self.executor_busy_times = [0.0] * num_executors
+        self.executor_last_finish_times = [0.0] * num_executors
+
+    def reset_executor_statistics(self, start_time):
+        """
+        :param start_time: the time that the build the statistics are gathered for was queued
+        :type start_time: float
+        """
+        self.executor_busy_times = [0.0] * self.num_executors
+        self.executor_last_finish_times = [start_time] * self.num_executors
+
+    def setup(self, build, executor_start_index, num_executors=None):
+        super().setup(build, executor_start_index, num_executors)
+        self._simulation.call_later(2 * self._simulation._dispatch_latency + self._simulation._setup_time,
+                                    self._simulation.begin_subjob_executions, self, build)
+
+    def teardown(self, build_id=None):
+        super().teardown(build_id)
+        self._simulation.call_later(2 * self._simulation._dispatch_latency, self._simulation.add_idle_slave, self)
+
+    def start_subjob(self, subjob):
+        self._simulation.call_later(self._simulation._dispatch_latency, self._receive_subjob, subjob)
+
+    def release_unstarted_atoms(self, subjob):
+        execution = self._executions_by_subjob_key.get(self._subjob_key(subjob))
+        if execution is None:
+            return None  # The subjob has not started executing yet (or has already finished).
+
+        elapsed_time = self._simulation.now - execution.start_time
+        num_atoms_started = 0
+        while num_atoms_started < len(execution.atom_times) and elapsed_time >= 0:
+            elapsed_time -= execution.atom_times[num_atoms_started]
+            num_atoms_started += 1
+        if num_atoms_started >= len(execution.atom_times):
+            return None
+
+        execution.atom_times = execution.atom_times[:num_atoms_started]
+        execution.finish_time = execution.start_time + sum(execution.atom_times)
+        self._simulation.call_later(execution.finish_time - self._simulation.now, self._finish_execution, execution,
+                                    execution.finish_time)
+        return num_atoms_started
+
+    def _receive_subjob(self, subjob):
+        self._queued_subjobs.append(subjob)
+        self._start_queued_subjobs()
+
+    def _start_queued_subjobs(self):
+        while self._queued_subjobs and self._idle_executor_indices:
+            subjob = self._queued_subjobs.popleft()
+            atom_times = [self._simulation.atom_execution_time(atom.command_string, self) for atom in subjob.atoms]
+            execution = _Execution(subjob, self._idle_executor_indices.pop(0), self._simulation.now, atom_times)
+            self._executions_by_subjob_key[self._subjob_key(subjob)] = execution
+            self._simulation.call_later(execution.finish_time - self._simulation.now, self._finish_execution,
+                                        execution, execution.finish_time)
+
+    def _finish_execution(self, execution, finish_time):
+        if finish_time != execution.finish_time:
+            return  # The execution was cut short by release_unstarted_atoms() and has a later event for its new end.
+
+        del self._executions_by_subjob_key[self._subjob_key(execution.subjob)]
+        self.executor_busy_times[execution.executor_index] += finish_time - execution.start_time
+        self.executor_last_finish_times[execution.executor_index] = finish_time
+        self._idle_executor_indices.append(execution.executor_index)
+        self._idle_executor_indices.sort()
+        self._simulation.call_later(self._simulation._upload_cost + self._simulation._dispatch_latency,
+                                    self._simulation.report_result, self, execution.subjob, execution.atom_times)
+        self._start_queued_subjobs()
+
+    def _subjob_key(self, subjob):
+        return subjob.build_id(), subjob.subjob_id()
+
+
+class _Execution(object):
+    """
+    A subjob that is executing on a virtual slave.
+    """
+    def __init__(self, subjob, executor_index, start_time, atom_times):
+        """
+        :type subjob: app.master.subjob.Subjob
+        :type executor_index: int
+        :type start_time: float
+        :type atom_times: list[float]
+        """
+        self.subjob = subjob
+        self.executor_index = executor_index
+        self.start_time = start_time
+        self.atom_times = atom_times
+        self.finish_time = start_time + sum(atom_times)
+
+
+class _NullNetwork(object):
+    """
+    Stands in for a Slave's Network; the simulated slaves react to the master's calls directly instead.
+    """
+    def get(self, *args, **kwargs):
+        pass
+
+    def post(self, *args, **kwargs):
+        pass
+
+    def post_with_digest(self, *args, **kwargs):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    atom_source = parser.add_mutually_exclusive_group()
+    atom_source.add_argument('--timing-file', help='a job timing file to replay')
+    atom_source.add_argument('--synthetic', type=int, default=5000, metavar='NUM_ATOMS',
+                             help='the number of atoms with synthetic times to simulate if no timing file is given')
+    parser.add_argument('--builds', type=int, default=3, help='the number of builds to run one after another')
+    parser.add_argument('--slaves', type=int, default=10)
+    parser.add_argument('--executors-per-slave', type=int, default=4)
+    parser.add_argument('--max-executors', type=int)
+    parser.add_argument('--dispatch-latency', type=float, default=0.05)
+    parser.add_argument('--upload-cost', type=float, default=0.5)
+    parser.add_argument('--setup-time', type=float, default=30.0)
+    parser.add_argument('--speed-variance', type=float, default=0.0)
+    parser.add_argument('--atom-time-noise', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.timing_file:
+        with open(args.timing_file) as timing_file:
+            atom_times = json.load(timing_file)
+    else:
+        atom_times = synthetic_atom_times(args.synthetic, random.Random(args.seed))
+
+    # The handler sets up signal handlers, so it has to be created on the main thread before any SafeThread runs.
+    UnhandledExceptionHandler.singleton()
+    MasterConfigLoader().configure_defaults(Configuration.singleton())
+    Configuration['speculative_execution_multiplier'] = 0
+
+    with logbook.NullHandler().applicationbound():
+        simulation = ClusterSimulation(
+            atom_times, args.slaves, args.executors_per_slave, dispatch_latency=args.dispatch_latency,
+            upload_cost=args.upload_cost, setup_time=args.setup_time, speed_variance=args.speed_variance,
+            atom_time_noise=args.atom_time_noise, max_executors=args.max_executors, seed=args.seed)
+        print('{:>6}{:>10}{:>15}{:>15}{:>20}{:>16}'.format(
+            'build', 'subjobs', 'makespan (s)', 'ideal (s)', 'executor idle (s)', 'tail waste (s)'))
+        for build_number in range(1, args.builds + 1):
+            report = simulation.run_build()
+            print('{:>6}{:>10}{:>15.1f}{:>15.1f}{:>20.1f}{:>16.1f}'.format(
+                build_number, report.num_subjobs, report.makespan, report.lower_bound, report.executor_idle_time,
+                report.tail_waste))
+
+
+if __name__ == '__main__':
+    main()
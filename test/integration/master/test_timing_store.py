@@ -0,0 +1,37 @@
+from genty import genty, genty_dataset
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from app.master.timing_store import TimingStore
+from app.util import fs
+from test.framework.base_integration_test_case import BaseIntegrationTestCase
+
+
+@genty
+class TestTimingStore(BaseIntegrationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_directory = TemporaryDirectory()
+        self.addCleanup(temp_directory.cleanup)
+        self._timing_file_path = os.path.join(temp_directory.name, 'job.timing.json')
+        self._timing_store = TimingStore(os.path.join(temp_directory.name, 'timings.sqlite3'))
+        self.addCleanup(self._timing_store.close)
+
+    @genty_dataset(
+        mutually_exclusive=({'1': 1, '2': 2}, {'3': 3}, {'1': 1, '2': 2, '3': 3}),
+        entire_overlap=({'1': 1, '2': 2}, {'1': 3, '2': 4}, {'1': 1.6, '2': 2.6}),
+        some_overlap=({'1': 1, '2': 2}, {'2': 4, '3': 5}, {'1': 1, '2': 2.6, '3': 5}),
+    )
+    def test_record_atom_times_merges_new_times_into_existing_timing_data(
+            self, existing_timing_data, new_timing_data, expected_final_timing_data):
+        fs.write_file(json.dumps(existing_timing_data), self._timing_file_path)
+
+        self._timing_store.record_atom_times(self._timing_file_path, new_timing_data)
+
+        # Atoms that were timed before are updated with a moving average weighted by TimingStore.EWMA_WEIGHT.
+        expected_times = self._timing_store.expected_times(self._timing_file_path, list(expected_final_timing_data))
+        self.assertEqual(expected_times.keys(), expected_final_timing_data.keys())
+        for atom, expected_time in expected_final_timing_data.items():
+            self.assertAlmostEqual(expected_times[atom], expected_time)
@@ -0,0 +1,110 @@
+from genty import genty, genty_dataset
+
+from app.master.atom_grouping_tuner import AtomGroupingTuner, build_subjob_overheads, build_tail_idle_fraction, \
+    grouping_parameters_file_path
+from app.util import analytics
+from app.util.exceptions import ItemNotReadyError
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+@genty
+class TestAtomGroupingTuner(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mock_get_events = self.patch('app.master.atom_grouping_tuner.analytics.get_events')
+        self.mock_isfile = self.patch('app.master.atom_grouping_tuner.os.path.isfile')
+        self.mock_isfile.return_value = False
+        self.mock_write_file = self.patch('app.master.atom_grouping_tuner.app.util.fs.write_file')
+
+    def test_grouping_parameters_are_stored_next_to_the_timing_file(self):
+        self.assertEqual(grouping_parameters_file_path('/var/timings/project/job.timing.json'),
+                         '/var/timings/project/job.grouping.json')
+
+    def test_tail_idle_fraction_is_the_executor_time_after_each_executors_last_result(self):
+        self.mock_get_events.return_value = [
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, executor_id=None),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 60.0, executor_id=1),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 100.0, executor_id=2),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 40.0, executor_id=1, build_id=2),
+        ]
+
+        self.assertAlmostEqual(build_tail_idle_fraction(build_id=1), 0.2,
+                               msg='Executor 1 was idle for the last 40s of the 200 executor seconds.')
+
+    def test_tail_idle_fraction_is_unknown_if_analytics_are_not_initialized(self):
+        self.mock_get_events.side_effect = ItemNotReadyError
+
+        self.assertIsNone(build_tail_idle_fraction(build_id=1))
+
+    @genty_dataset(
+        large_tail_shrinks_big_chunks=(50.0, 0.75, 3),
+        small_tail_grows_big_chunks=(99.0, 0.85, 1),
+        tail_near_target_keeps_parameters=(92.0, 0.8, 2),
+    )
+    def test_tuning_moves_work_between_big_and_small_chunks_based_on_tail_idle_time(
+            self,
+            last_result_time_of_first_executor,
+            expected_big_chunk_fraction,
+            expected_small_subjobs_per_executor,
+    ):
+        self.mock_get_events.return_value = [
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0),
+            self._event(analytics.MASTER_RECEIVED_RESULT, last_result_time_of_first_executor, executor_id=1),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 100.0, executor_id=2),
+        ]
+        tuner = AtomGroupingTuner('/var/timings/project/job.timing.json')
+
+        tuner.tune(build_id=1)
+
+        self.assertEqual(tuner.big_chunk_fraction, expected_big_chunk_fraction)
+        self.assertEqual(tuner.small_subjobs_per_executor, expected_small_subjobs_per_executor)
+        self.assertEqual(self.mock_write_file.called, expected_big_chunk_fraction != 0.8)
+
+    def test_subjob_overheads_are_fit_to_a_cost_per_subjob_and_a_cost_per_atom(self):
+        self.mock_get_events.return_value = [
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=0),
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=1),
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=2),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 13.0, subjob_id=0),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 22.0, subjob_id=1),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 24.0, subjob_id=2),
+        ]
+        subjob_work = {0: (1, 10.0), 1: (5, 15.0), 2: (2, 20.0)}
+
+        subjob_overhead, atom_overhead = build_subjob_overheads(build_id=1, subjob_work=subjob_work)
+
+        self.assertAlmostEqual(subjob_overhead, 2.0, msg='Each subjob should cost 2s on top of its atoms.')
+        self.assertAlmostEqual(atom_overhead, 1.0, msg='Each atom should cost 1s on top of its own time.')
+
+    def test_subjobs_that_were_sent_to_slaves_more_than_once_are_left_out_of_the_overheads(self):
+        self.mock_get_events.return_value = [
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=0),
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=1),
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 20.0, subjob_id=1),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 12.0, subjob_id=0),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 40.0, subjob_id=1),
+        ]
+
+        self.assertIsNone(build_subjob_overheads(build_id=1, subjob_work={0: (1, 10.0), 1: (1, 10.0)}),
+                          'There should not be enough subjobs left to measure the overheads.')
+
+    def test_tuning_averages_measured_overheads_into_the_stored_parameters(self):
+        self.mock_get_events.return_value = [
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=0),
+            self._event(analytics.MASTER_TRIGGERED_SUBJOB, 0.0, subjob_id=1),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 13.0, subjob_id=0),
+            self._event(analytics.MASTER_RECEIVED_RESULT, 93.0, subjob_id=1),
+        ]
+        tuner = AtomGroupingTuner('/var/timings/project/job.timing.json')
+        tuner.subjob_overhead, tuner.atom_overhead = 1.0, 0.0
+
+        tuner.tune(build_id=1, subjob_work={0: (2, 10.0), 1: (2, 90.0)})
+
+        self.assertEqual(tuner.subjob_overhead, 2.0, 'The 3s measured should be averaged with the previous 1s.')
+        self.assertEqual(tuner.atom_overhead, 0.0)
+        self.assertTrue(self.mock_write_file.called)
+
+    def _event(self, tag, timestamp, executor_id=0, build_id=1, subjob_id=0):
+        return {'__tag__': tag, '__timestamp__': timestamp, 'build_id': build_id, 'subjob_id': subjob_id,
+                'slave_id': 1, 'executor_id': executor_id}
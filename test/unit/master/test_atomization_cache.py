@@ -0,0 +1,56 @@
+from unittest.mock import Mock, mock_open
+
+from app.master.atomization_cache import AtomizationCache
+from app.project_type.project_type import ProjectType
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestAtomizationCache(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mock_isfile = self.patch('app.master.atomization_cache.os.path.isfile')
+        self.mock_isfile.return_value = False
+        self.mock_write_file = self.patch('app.master.atomization_cache.app.util.fs.write_file')
+        self.mock_listdir = self.patch('app.master.atomization_cache.os.listdir')
+        self.mock_listdir.return_value = []
+        self.patch('app.master.atomization_cache.os.utime')
+
+    def test_atom_values_are_looked_up_by_the_commit_they_were_stored_for(self):
+        cache = AtomizationCache('/var/atomizations', max_entries=10)
+        cache.store_atom_values(self._mock_project('commit_a'), 'TEST_FILE', 'find . -name test_*.py', ['test_a.py'])
+        (stored_contents, stored_path), _ = self.mock_write_file.call_args
+        self.mock_isfile.side_effect = lambda path: path == stored_path
+        self.patch('app.master.atomization_cache.open', new=mock_open(read_data=stored_contents), create=True)
+
+        self.assertEqual(cache.atom_values(self._mock_project('commit_a'), 'TEST_FILE', 'find . -name test_*.py'),
+                         ['test_a.py'])
+        self.assertIsNone(cache.atom_values(self._mock_project('commit_b'), 'TEST_FILE', 'find . -name test_*.py'))
+        self.assertIsNone(cache.atom_values(self._mock_project('commit_a'), 'TEST_FILE', 'find . -name *_test.py'))
+
+    def test_atom_values_are_not_cached_for_projects_without_a_known_commit(self):
+        cache = AtomizationCache('/var/atomizations', max_entries=10)
+        project = self._mock_project(commit_hash=None)
+
+        cache.store_atom_values(project, 'TEST_FILE', 'find . -name test_*.py', ['test_a.py'])
+
+        self.assertFalse(self.mock_write_file.called)
+        self.assertIsNone(cache.atom_values(project, 'TEST_FILE', 'find . -name test_*.py'))
+
+    def test_least_recently_used_entries_are_removed_when_the_cache_is_full(self):
+        self.mock_listdir.return_value = ['new.json', 'old.json', 'recent.json']
+        last_used_times = {'/var/atomizations/new.json': 30.0, '/var/atomizations/old.json': 10.0,
+                           '/var/atomizations/recent.json': 20.0}
+        self.patch('app.master.atomization_cache.os.path.getmtime').side_effect = last_used_times.get
+        mock_remove = self.patch('app.master.atomization_cache.os.remove')
+        cache = AtomizationCache('/var/atomizations', max_entries=2)
+
+        cache.store_atom_values(self._mock_project('commit_a'), 'TEST_FILE', 'find . -name test_*.py', ['test_a.py'])
+
+        mock_remove.assert_called_once_with('/var/atomizations/old.json')
+
+    def _mock_project(self, commit_hash):
+        project = Mock(spec=ProjectType)
+        project.project_id.return_value = '/var/repos/project'
+        project.cached_source.return_value = ('ssh://example.com/project.git', commit_hash)
+        return project
@@ -1,5 +1,7 @@
+from threading import Event
 from unittest.mock import Mock
 
+from app.master.atomization_cache import AtomizationCache
 from app.master.atomizer import Atomizer, AtomizerError
 from app.project_type.project_type import ProjectType
 from app.util.process_utils import get_environment_variable_setter_command
@@ -40,3 +42,85 @@ class TestAtomizer(BaseUnitTestCase):
             atomizer.atomize_in_project(mock_project)
 
         mock_project.execute_command_in_project.assert_called_once_with(_FAKE_ATOMIZER_COMMAND)
+
+    def test_atomizer_uses_cached_atoms_instead_of_executing_the_atomizer_command(self):
+        mock_project = Mock(spec=ProjectType)
+        mock_cache = Mock(spec=AtomizationCache)
+        mock_cache.atom_values.return_value = ['$PROJECT_DIR/test_a.py']
+
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}])
+        actual_atoms = atomizer.atomize_in_project(mock_project, mock_cache)
+
+        self.assertEqual([atom.command_string for atom in actual_atoms],
+                         [get_environment_variable_setter_command('TEST_FILE', '$PROJECT_DIR/test_a.py')])
+        self.assertFalse(mock_project.execute_command_in_project.called)
+        self.assertFalse(mock_cache.store_atom_values.called)
+
+    def test_atomizer_output_is_stored_in_the_cache_when_it_is_not_cached(self):
+        mock_project = Mock(spec=ProjectType)
+        mock_project.execute_command_in_project.return_value = (_FAKE_ATOMIZER_COMMAND_OUTPUT, _SUCCESSFUL_EXIT_CODE)
+        mock_project.project_directory = '/tmp/test/directory'
+        mock_cache = Mock(spec=AtomizationCache)
+        mock_cache.atom_values.return_value = None
+
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}])
+        atomizer.atomize_in_project(mock_project, mock_cache)
+
+        mock_cache.store_atom_values.assert_called_once_with(
+            mock_project, 'TEST_FILE', _FAKE_ATOMIZER_COMMAND,
+            ['$PROJECT_DIR/test_a.py', '$PROJECT_DIR/test_b.py', '$PROJECT_DIR/test_c.py'])
+
+    def test_atomizer_commands_are_executed_concurrently_and_atoms_keep_the_order_of_the_commands(self):
+        second_command_started = Event()
+
+        def execute_command_in_project(command):
+            if command == 'first_command':
+                # The first command only finishes once the second one has started, i.e., if they run concurrently.
+                second_command_started.wait(timeout=5)
+                return ('first_atom' if second_command_started.is_set() else ''), _SUCCESSFUL_EXIT_CODE
+            second_command_started.set()
+            return 'second_atom', _SUCCESSFUL_EXIT_CODE
+
+        mock_project = Mock(spec=ProjectType)
+        mock_project.execute_command_in_project.side_effect = execute_command_in_project
+        mock_project.project_directory = '/tmp/test/directory'
+
+        atomizer = Atomizer([{'FIRST': 'first_command'}, {'SECOND': 'second_command'}])
+        actual_atoms = atomizer.atomize_in_project(mock_project)
+
+        self.assertEqual([atom.command_string for atom in actual_atoms], [
+            get_environment_variable_setter_command('FIRST', 'first_atom'),
+            get_environment_variable_setter_command('SECOND', 'second_atom'),
+        ])
+
+    def test_atomizer_passes_each_atom_to_the_callback_as_soon_as_the_atomizer_command_outputs_it(self):
+        atoms_received_during_execution = []
+
+        def stream_command_in_project(command, output_line_callback):
+            for output_line in ['/tmp/test/directory/test_a.py', '', '/tmp/test/directory/test_b.py']:
+                output_line_callback(output_line)
+                atoms_received_during_execution.append(len(actual_atoms))
+            return '', _SUCCESSFUL_EXIT_CODE
+
+        mock_project = Mock(spec=ProjectType)
+        mock_project.stream_command_in_project.side_effect = stream_command_in_project
+        mock_project.project_directory = '/tmp/test/directory'
+        actual_atoms = []
+
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}])
+        atomizer.atomize_in_project_incrementally(mock_project, actual_atoms.extend)
+
+        self.assertEqual(atoms_received_during_execution, [1, 1, 2])
+        self.assertEqual([atom.command_string for atom in actual_atoms], [
+            get_environment_variable_setter_command('TEST_FILE', '$PROJECT_DIR/test_a.py'),
+            get_environment_variable_setter_command('TEST_FILE', '$PROJECT_DIR/test_b.py'),
+        ])
+
+    def test_atomizer_raises_exception_when_streamed_atomize_command_fails(self):
+        mock_project = Mock(spec=ProjectType)
+        mock_project.stream_command_in_project.return_value = ('ERROR ERROR ERROR', _FAILING_EXIT_CODE)
+        mock_project.project_directory = '/tmp/test/directory'
+
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}])
+        with self.assertRaises(AtomizerError):
+            atomizer.atomize_in_project_incrementally(mock_project, Mock())
@@ -48,7 +48,28 @@ class TestBuild(BaseUnitTestCase):
 
         scheduler.allocate_slave(mock_slave)
 
-        mock_slave.setup.assert_called_once_with(build, executor_start_index=0)
+        mock_slave.setup.assert_called_once_with(build, executor_start_index=0, num_executors=5)
+
+    def test_slaves_get_the_project_from_slaves_that_have_set_up_the_build_if_project_distribution_is_enabled(self):
+        Configuration['project_distribution_fan_out'] = 1
+        mock_slaves = [self._create_mock_slave() for _ in range(3)]
+        build = self._create_test_build(BuildStatus.PREPARED)
+        build.project_type.can_be_fetched_from_slaves.return_value = True
+        scheduler = self.scheduler_pool.get(build)
+        scheduler.execute_next_subjob_or_free_executor = Mock()
+
+        for mock_slave in mock_slaves:
+            scheduler.allocate_slave(mock_slave)
+
+        for mock_slave in mock_slaves:
+            mock_slave.allocate_executors.assert_called_once_with(build, 5)
+        mock_slaves[0].start_setup.assert_called_once_with(build, 0, None)
+        self.assertFalse(mock_slaves[1].start_setup.called, 'The master should serve at most one slave at a time.')
+
+        scheduler.begin_subjob_executions_on_slave(mock_slaves[0])
+
+        mock_slaves[1].start_setup.assert_called_once_with(build, 5, mock_slaves[0])
+        mock_slaves[2].start_setup.assert_called_once_with(build, 10, None)
 
     def test_build_doesnt_use_more_than_max_executors(self):
         mock_slaves = [self._create_mock_slave(num_executors=5) for _ in range(3)]  # 15 total available executors
@@ -214,9 +235,9 @@ class TestBuild(BaseUnitTestCase):
 
     def test_teardown_called_on_slave_when_no_subjobs_remain(self):
         mock_slave = self._create_mock_slave(num_executors=1)
-        self._create_test_build(BuildStatus.FINISHED, num_subjobs=1, slaves=[mock_slave])
+        build = self._create_test_build(BuildStatus.FINISHED, num_subjobs=1, slaves=[mock_slave])
 
-        mock_slave.teardown.assert_called_with()
+        mock_slave.teardown.assert_called_with(build.build_id())
 
     def test_teardown_called_on_all_slaves_when_no_subjobs_remain(self):
         mock_slaves = [
@@ -224,18 +245,18 @@ class TestBuild(BaseUnitTestCase):
             self._create_mock_slave(num_executors=4),
             self._create_mock_slave(num_executors=3),
         ]
-        self._create_test_build(BuildStatus.FINISHED, num_subjobs=20, slaves=mock_slaves)
+        build = self._create_test_build(BuildStatus.FINISHED, num_subjobs=20, slaves=mock_slaves)
 
         for mock_slave in mock_slaves:
-            mock_slave.teardown.assert_called_with()
+            mock_slave.teardown.assert_called_with(build.build_id())
 
     def test_teardown_called_on_slave_when_slave_in_shutdown_mode(self):
         mock_slave = self._create_mock_slave(num_executors=5)
         mock_slave.start_subjob.side_effect = SlaveMarkedForShutdownError
 
-        self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
 
-        mock_slave.teardown.assert_called_with()
+        mock_slave.teardown.assert_called_with(build.build_id())
 
     def test_cancel_prevents_further_subjob_starts_and_sets_canceled(self):  # dev: this is flaky now
         mock_slave = self._create_mock_slave(num_executors=5)
@@ -308,6 +329,230 @@ class TestBuild(BaseUnitTestCase):
 
         self.assertEqual(mock_slave.teardown.call_count, 1, "Teardown should only be called once")
 
+    def test_tearing_down_slave_releases_its_executors_from_the_allocated_count(self):
+        mock_slave = self._create_mock_slave(num_executors=5)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=5, slaves=[mock_slave])
+        scheduler = self.scheduler_pool.get(build)
+        self.assertEqual(scheduler.num_executors_allocated, 5)
+        self._finish_test_build(build, assert_postbuild_tasks_complete=False)
+
+        for _ in range(5):
+            scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertEqual(mock_slave.teardown.call_count, 1)
+        self.assertEqual(scheduler.num_executors_allocated, 0)
+
+    def test_executors_with_no_subjobs_left_are_released_while_the_slave_is_still_busy(self):
+        mock_slave = self._create_mock_slave(num_executors=5)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=3, slaves=[mock_slave])
+        scheduler = self.scheduler_pool.get(build)
+
+        self.assertEqual(scheduler.num_executors_allocated, 3)
+        self.assertEqual(mock_slave.release_executor.call_count, 2)
+        self.assertEqual(mock_slave.teardown.call_count, 0, 'The slave should not be torn down while it is still '
+                                                            'executing subjobs for the build.')
+
+    def test_each_executor_is_dispatched_subjob_dispatch_depth_subjobs(self):
+        Configuration['subjob_dispatch_depth'] = 2
+        mock_slave = self._create_mock_slave(num_executors=2)
+
+        self._create_test_build(BuildStatus.BUILDING, num_subjobs=5, slaves=[mock_slave])
+
+        self.assertEqual(mock_slave.start_subjob.call_count, 4)
+        self.assertEqual(mock_slave.claim_executor.call_count, 2)
+
+    def test_executor_is_not_freed_while_it_still_has_subjobs_dispatched_to_it(self):
+        Configuration['subjob_dispatch_depth'] = 2
+        mock_slave = self._create_mock_slave(num_executors=2)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=4, slaves=[mock_slave])
+        scheduler = self.scheduler_pool.get(build)
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertEqual(mock_slave.free_executor.call_count, 0, 'Both executors still have a subjob dispatched.')
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertEqual(mock_slave.free_executor.call_count, 1)
+        self.assertEqual(scheduler.num_executors_allocated, 1)
+
+    def test_execute_next_subjob_stops_feeding_a_reclaimed_slave_and_requeues_the_build(self):
+        mock_slave = self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=3, slaves=[mock_slave])
+        scheduler = self.scheduler_pool.get(build)
+        self.scheduler_pool.reclaim_executors_for_higher_priority_builds = Mock(return_value=True)
+        self.scheduler_pool.add_build_waiting_for_slaves = Mock()
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertEqual(mock_slave.start_subjob.call_count, 1, 'Only the subjob started before the slave was '
+                                                                'reclaimed should have been sent to the slave.')
+        self.assertEqual(mock_slave.teardown.call_count, 1)
+        self.scheduler_pool.add_build_waiting_for_slaves.assert_called_once_with(build)
+
+    def test_executor_with_no_subjobs_left_speculatively_reexecutes_a_straggler(self):
+        slow_slave, fast_slave = self._create_mock_slave(num_executors=1), self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=2, slaves=[slow_slave, fast_slave])
+        scheduler = self.scheduler_pool.get(build)
+        straggler, fast_subjob = build.all_subjobs()
+        for subjob in build.all_subjobs():
+            for atom in subjob.atoms:
+                atom.expected_time = 1.0
+        straggler._start_time -= 100  # The straggler has run for far longer than the expected 3 seconds.
+
+        build.complete_subjob(fast_subjob.subjob_id())
+        scheduler.execute_next_subjob_or_free_executor(fast_slave)
+
+        fast_slave.start_subjob.assert_called_with(straggler)
+        self.assertEqual(straggler.speculative_slaves, [fast_slave])
+        self.assertEqual(fast_slave.teardown.call_count, 0, 'The executor should be reused instead of torn down.')
+
+    def test_largest_remaining_subjob_is_sent_to_the_fastest_slave(self):
+        slow_slave, fast_slave = self._create_mock_slave(num_executors=1), self._create_mock_slave(num_executors=1)
+        slow_slave.speed_factor, fast_slave.speed_factor = 0.5, 2.0
+        build = self._create_test_build(BuildStatus.PREPARED, num_subjobs=3)
+        scheduler = self.scheduler_pool.get(build)
+        small_subjob, large_subjob, medium_subjob = build.all_subjobs()
+        for subjob, atom_time in ((small_subjob, 1.0), (large_subjob, 10.0), (medium_subjob, 5.0)):
+            for atom in subjob.atoms:
+                atom.expected_time = atom_time
+        scheduler.allocate_slave(slow_slave)
+        scheduler.allocate_slave(fast_slave)
+
+        scheduler.begin_subjob_executions_on_slave(slow_slave)
+        scheduler.begin_subjob_executions_on_slave(fast_slave)
+
+        slow_slave.start_subjob.assert_called_once_with(medium_subjob)
+        fast_slave.start_subjob.assert_called_once_with(large_subjob)
+
+    def test_unstarted_subjob_is_split_when_there_are_fewer_subjobs_queued_than_executors_in_use(self):
+        Configuration['dynamic_subjob_splitting'] = True
+        mock_slave = self._create_mock_slave(num_executors=4)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=2, num_atoms_per_subjob=4,
+                                        slaves=[mock_slave])
+
+        self.assertGreater(len(build.all_subjobs()), 2, 'Subjobs should have been split to feed idle executors.')
+        self.assertEqual(sum(len(subjob.atoms) for subjob in build.all_subjobs()), 8,
+                         'Splitting subjobs should not add or lose atoms.')
+
+    def test_idle_executor_takes_over_atoms_released_from_a_running_subjob(self):
+        busy_slave, idle_slave = self._create_mock_slave(num_executors=1), self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=4,
+                                        slaves=[busy_slave])
+        scheduler = self.scheduler_pool.get(build)
+        running_subjob = build.all_subjobs()[0]
+        Configuration['dynamic_subjob_splitting'] = True
+        busy_slave.release_unstarted_atoms.return_value = 1
+        scheduler.allocate_slave(idle_slave)
+
+        scheduler.begin_subjob_executions_on_slave(idle_slave)
+
+        busy_slave.release_unstarted_atoms.assert_called_once_with(running_subjob)
+        self.assertEqual(len(running_subjob.atoms), 1)
+        released_subjobs = [subjob for subjob in build.all_subjobs() if subjob is not running_subjob]
+        self.assertEqual(sum(len(subjob.atoms) for subjob in released_subjobs), 3)
+        idle_slave.start_subjob.assert_called_once_with(build.subjob(1))
+
+    def test_running_subjob_is_asked_to_release_its_atoms_only_once_even_when_the_straggler_check_fires(self):
+        busy_slave = self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=4,
+                                        slaves=[busy_slave])
+        scheduler = self.scheduler_pool.get(build)
+        Configuration['dynamic_subjob_splitting'] = True
+        scheduler._schedule_straggler_check = Mock()
+        self.scheduler_pool.add_build_waiting_for_slaves = Mock()
+
+        scheduler._release_atoms_from_running_subjob()
+        for _ in range(2):
+            scheduler._check_for_stragglers()
+            scheduler._release_atoms_from_running_subjob()
+
+        busy_slave.release_unstarted_atoms.assert_called_once_with(build.all_subjobs()[0])
+
+    def test_running_subjob_is_asked_to_release_its_atoms_without_holding_the_subjob_assignment_lock(self):
+        busy_slave = self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=4,
+                                        slaves=[busy_slave])
+        scheduler = self.scheduler_pool.get(build)
+        Configuration['dynamic_subjob_splitting'] = True
+        lock_was_held_during_release = []
+        busy_slave.release_unstarted_atoms.side_effect = \
+            lambda subjob: lock_was_held_during_release.append(scheduler._subjob_assignment_lock.locked())
+
+        scheduler._release_atoms_from_running_subjob()
+
+        self.assertEqual(lock_was_held_during_release, [False])
+
+    def test_truncated_subjob_result_reported_before_its_atoms_are_split_off_requeues_the_unexecuted_atoms(self):
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=4)
+        subjob = build.all_subjobs()[0]
+        executed_atom_exit_code_files = {join(Configuration['results_directory'], '1', 'artifact_0_{}'.format(atom_id),
+                                              BuildArtifact.EXIT_CODE_FILE) for atom_id in range(3)}
+        self.patch('app.master.build.os.path.isfile').side_effect = executed_atom_exit_code_files.__contains__
+
+        build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD)
+
+        self.assertEqual(len(subjob.atoms), 3)
+        self.assertEqual(build._unstarted_subjobs.qsize(), 1)
+        self.assertEqual(len(build._unstarted_subjobs.get().atoms), 1)
+        self.assertEqual(build._status(), BuildStatus.BUILDING)
+
+    def test_removing_dead_slave_requeues_its_subjobs_and_waits_for_replacement_slaves(self):
+        dead_slave, live_slave = self._create_mock_slave(num_executors=1), self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=3, slaves=[dead_slave, live_slave])
+        scheduler = self.scheduler_pool.get(build)
+        lost_subjob = next(subjob for subjob in build.all_subjobs() if subjob.slave is dead_slave)
+        self.scheduler_pool.add_build_waiting_for_slaves = Mock()
+
+        scheduler.remove_dead_slave(dead_slave)
+
+        self.assertIsNone(lost_subjob.slave)
+        self.assertEqual(build._unstarted_subjobs.qsize(), 2, 'The lost subjob should be back on the queue.')
+        self.assertEqual(scheduler.num_executors_allocated, 1)
+        self.scheduler_pool.add_build_waiting_for_slaves.assert_called_once_with(build)
+
+    def test_requeued_subjob_is_not_sent_again_when_the_lost_slave_reports_its_result_late(self):
+        dead_slave, live_slave = self._create_mock_slave(num_executors=1), self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=3, slaves=[dead_slave, live_slave])
+        scheduler = self.scheduler_pool.get(build)
+        lost_subjob = next(subjob for subjob in build.all_subjobs() if subjob.slave is dead_slave)
+        self.scheduler_pool.add_build_waiting_for_slaves = Mock()
+        self.patch_object(build, '_handle_subjob_payload')
+        scheduler.remove_dead_slave(dead_slave)
+        build.complete_subjob(lost_subjob.subjob_id(), payload={'filename': 'results.tar.gz', 'body': ''})
+        replacement_slave = self._create_mock_slave(num_executors=2)
+        scheduler.allocate_slave(replacement_slave)
+
+        scheduler.begin_subjob_executions_on_slave(replacement_slave)
+
+        sent_subjobs = [call[0][0] for call in replacement_slave.start_subjob.call_args_list]
+        self.assertNotIn(lost_subjob, sent_subjobs)
+        self.assertEqual(len(sent_subjobs), 1)
+
+    def test_removing_dead_slave_does_not_requeue_subjob_that_is_speculatively_executing_elsewhere(self):
+        dead_slave, live_slave = self._create_mock_slave(num_executors=1), self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=2, slaves=[dead_slave, live_slave])
+        scheduler = self.scheduler_pool.get(build)
+        lost_subjob = next(subjob for subjob in build.all_subjobs() if subjob.slave is dead_slave)
+        lost_subjob.mark_speculatively_executing(live_slave)
+
+        scheduler.remove_dead_slave(dead_slave)
+
+        self.assertIs(lost_subjob.slave, dead_slave)
+        self.assertEqual(build._unstarted_subjobs.qsize(), 0)
+
+    def test_duplicate_subjob_result_is_ignored(self):
+        mock_slave = self._create_mock_slave(num_executors=1)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=2, slaves=[mock_slave])
+        self.patch_object(build, '_handle_subjob_payload')
+
+        build.complete_subjob(0, payload={'filename': 'results_0.tar.gz', 'body': ''})
+        build.complete_subjob(0, payload={'filename': 'results_0.tar.gz', 'body': ''})
+
+        self.assertEqual(build._handle_subjob_payload.call_count, 1)
+        self.assertIn('1 of 2 subjobs are complete', build.api_representation()['details'])
+
     def test_slave_is_fully_allocated_when_max_executors_per_slave_is_not_set(self):
         mock_slave = self._create_mock_slave(num_executors=10)
         job_config = self._create_job_config(max_executors_per_slave=float('inf'))
@@ -358,6 +603,99 @@ class TestBuild(BaseUnitTestCase):
 
         self.mock_util.fs.create_dir.assert_called_once_with(build._build_results_dir())
 
+    def test_streaming_prepare_adds_subjobs_in_batches_and_build_is_prepared_after_the_first_batch(self):
+        Configuration['streaming_atomization_batch_size'] = 2
+        build = self._create_test_build(BuildStatus.QUEUED)
+        build.project_type.job_config.return_value = self._create_job_config()
+        build.project_type.atoms_override = None
+        ready_for_slaves_callback = Mock()
+        states_after_each_batch = []
+
+        def group_atoms_incrementally(job_config, project_type, atom_groups_callback):
+            for batch_index in range(2):
+                atom_groups_callback([[Atom('NAME=batch{}_subjob{}'.format(batch_index, i))] for i in range(2)])
+                states_after_each_batch.append((build._status(), build.is_atomizing, len(build.all_subjobs())))
+
+        subjob_calculator = MagicMock(spec_set=SubjobCalculator)
+        subjob_calculator.group_atoms_incrementally.side_effect = group_atoms_incrementally
+        build.prepare(subjob_calculator, ready_for_slaves_callback)
+
+        self.assertEqual(states_after_each_batch, [(BuildState.PREPARED, True, 2), (BuildState.PREPARED, True, 4)])
+        self.assertFalse(build.is_atomizing)
+        self.assertEqual([subjob.subjob_id() for subjob in build.all_subjobs()], [0, 1, 2, 3])
+        self.assertEqual(ready_for_slaves_callback.call_count, 3, 'Callback should be called after each batch and once '
+                                                                'more when the atomizers have exited.')
+
+    def test_executor_waits_for_more_subjobs_instead_of_being_freed_while_the_build_is_atomizing(self):
+        Configuration['streaming_atomization_batch_size'] = 1
+        build = self._create_test_build(BuildStatus.QUEUED)
+        build.project_type.job_config.return_value = self._create_job_config()
+        build.project_type.atoms_override = None
+        mock_slave = self._create_mock_slave(num_executors=2)
+        scheduler = self.scheduler_pool.get(build)
+
+        def group_atoms_incrementally(job_config, project_type, atom_groups_callback):
+            atom_groups_callback([[Atom('NAME=first')]])
+            scheduler.allocate_slave(mock_slave)
+            scheduler.begin_subjob_executions_on_slave(mock_slave)
+            self.assertEqual(mock_slave.start_subjob.call_count, 1)
+            self.assertFalse(mock_slave.free_executor.called, 'Executor should wait while the build is atomizing.')
+            atom_groups_callback([[Atom('NAME=second')]])
+
+        subjob_calculator = MagicMock(spec_set=SubjobCalculator)
+        subjob_calculator.group_atoms_incrementally.side_effect = group_atoms_incrementally
+        build.prepare(subjob_calculator, scheduler.execute_subjobs_on_waiting_slaves)
+
+        self.assertEqual(mock_slave.start_subjob.call_count, 2, 'Waiting executor should get the subjob added later.')
+
+    def test_slaves_are_set_up_and_wait_for_subjobs_while_the_build_is_atomizing(self):
+        Configuration['allocate_slaves_while_atomizing'] = True
+        job_config = self._create_job_config()
+        build = self._create_test_build(BuildStatus.QUEUED)
+        build.project_type.job_config.return_value = job_config
+        build.project_type.atoms_override = None
+        mock_slave = self._create_mock_slave(num_executors=2)
+        scheduler = self.scheduler_pool.get(build)
+
+        def compute_subjobs_for_build(build_id, job_config, project_type):
+            self.assertEqual(build._status(), BuildState.PREPARED, 'Build should be prepared before atomizing.')
+            self.assertTrue(scheduler.needs_more_slaves())
+            scheduler.allocate_slave(mock_slave)
+            scheduler.begin_subjob_executions_on_slave(mock_slave)
+            self.assertFalse(mock_slave.start_subjob.called)
+            self.assertFalse(mock_slave.free_executor.called, 'Executors should wait while the build is atomizing.')
+            return self._create_subjobs(count=1, job_config=job_config)
+
+        subjob_calculator = self._create_mock_subjob_calc([])
+        subjob_calculator.compute_subjobs_for_build.side_effect = compute_subjobs_for_build
+        build.prepare(subjob_calculator, scheduler.execute_subjobs_on_waiting_slaves)
+
+        self.assertEqual(mock_slave.start_subjob.call_count, 1, 'Waiting executor should get the atomized subjob.')
+        self.assertEqual(mock_slave.free_executor.call_count, 1, 'Executor with no subjob should be freed.')
+
+    def test_executors_waiting_for_subjobs_are_kept_when_the_straggler_check_fires_while_the_build_is_atomizing(self):
+        Configuration['allocate_slaves_while_atomizing'] = True
+        job_config = self._create_job_config()
+        build = self._create_test_build(BuildStatus.QUEUED)
+        build.project_type.job_config.return_value = job_config
+        build.project_type.atoms_override = None
+        mock_slave = self._create_mock_slave(num_executors=2)
+        scheduler = self.scheduler_pool.get(build)
+        self.scheduler_pool.add_build_waiting_for_slaves = Mock()
+
+        def compute_subjobs_for_build(build_id, job_config, project_type):
+            scheduler.allocate_slave(mock_slave)
+            scheduler.begin_subjob_executions_on_slave(mock_slave)
+            scheduler._check_for_stragglers()
+            return self._create_subjobs(count=1, job_config=job_config)
+
+        subjob_calculator = self._create_mock_subjob_calc([])
+        subjob_calculator.compute_subjobs_for_build.side_effect = compute_subjobs_for_build
+        build.prepare(subjob_calculator, scheduler.execute_subjobs_on_waiting_slaves)
+
+        self.assertEqual(mock_slave.start_subjob.call_count, 1, 'Waiting executor should get the atomized subjob.')
+        self.assertEqual(mock_slave.free_executor.call_count, 1, 'Executor with no subjob should be freed.')
+
     def test_allocating_slave_to_build_sets_building_timestamp_only_on_first_slave_allocation(self):
         mock_slave1 = self._create_mock_slave()
         mock_slave2 = self._create_mock_slave()
@@ -428,6 +766,22 @@ class TestBuild(BaseUnitTestCase):
             build._all_subjobs_by_id[3]._atoms[3],
         ])
 
+    def test_times_of_passing_atoms_are_recorded_in_the_timing_store(self):
+        build = self._create_test_build(BuildStatus.PREPARED, num_subjobs=2, num_atoms_per_subjob=2)
+        build._build_artifact = MagicMock(spec_set=BuildArtifact)
+        build._build_artifact.get_failed_subjob_and_atom_ids.return_value = [(1, 0)]
+        for subjob in build.all_subjobs():
+            for atom_id, atom in enumerate(subjob.atoms):
+                atom.command_string = 'atom_{}_{}'.format(subjob.subjob_id(), atom_id)
+                atom.actual_time = 1.0 + atom_id
+            self.patch_object(subjob, 'read_timings')
+        mock_timing_store = self.patch('app.master.build.TimingStore').return_value
+
+        build._record_atom_timings()
+
+        mock_timing_store.record_atom_times.assert_called_once_with(
+            build._timing_file_path, {'atom_0_0': 1.0, 'atom_0_1': 2.0, 'atom_1_1': 2.0})
+
     def test_delete_temporary_build_artifact_files_skips_results_tarball(self):
         build = self._create_test_build(BuildStatus.BUILDING)
         self.mock_listdir.return_value = ['some_dir1', BuildArtifact.ARTIFACT_FILE_NAME]
@@ -532,7 +886,10 @@ class TestBuild(BaseUnitTestCase):
         :rtype: Slave | MagicMock
         """
         slave_spec = Slave('', 0)  # constructor values don't matter since this is just a spec object
-        mock_slave = MagicMock(spec_set=slave_spec, url=self._FAKE_SLAVE_URL, num_executors=num_executors)
+        mock_slave = MagicMock(spec_set=slave_spec, url=self._FAKE_SLAVE_URL, num_executors=num_executors,
+                               speed_factor=1.0)
+        mock_slave.num_unallocated_executors.return_value = num_executors
+        mock_slave.release_unstarted_atoms.return_value = None
 
         counter = Counter()
         mock_slave.claim_executor.side_effect = counter.increment
@@ -1,3 +1,5 @@
+from unittest.mock import ANY
+
 from genty import genty, genty_dataset
 
 from app.master.build_request_handler import BuildRequestHandler
@@ -23,4 +25,23 @@ class TestBuildRequestHandler(BaseUnitTestCase):
         if build_finish_called:
             build_mock.finish.assert_called_once_with()
         else:
-            self.assertFalse(build_mock.finish.called)
\ No newline at end of file
+            self.assertFalse(build_mock.finish.called)
+    @genty_dataset(
+        shared_copy=(False, True),
+        build_specific_copy=(True, False),
+    )
+    def test_prepare_build_async_holds_project_lock_only_if_build_has_no_copy_of_its_own(self, has_build_specific_copy,
+                                                                                        lock_acquired):
+        mock_project_lock = self.patch('threading.Lock').return_value
+        build_scheduler_mock = self.patch('app.master.build_scheduler.BuildScheduler').return_value
+        build_request_handler = BuildRequestHandler(build_scheduler_mock)
+        build_mock = self.patch('app.master.build.Build').return_value
+        build_mock.has_error = False
+        build_mock.all_subjobs.return_value = ['some subjob']
+        build_mock.project_type.has_build_specific_copy.return_value = has_build_specific_copy
+
+        build_request_handler._prepare_build_async(build_mock, mock_project_lock)
+
+        self.assertEqual(mock_project_lock.__enter__.called, lock_acquired)
+        build_mock.prepare.assert_called_once_with(ANY, ready_for_slaves_callback=ANY)
+        build_mock.project_type.remove_build_specific_copy.assert_called_once_with()
@@ -0,0 +1,93 @@
+from unittest.mock import Mock
+
+from app.master.build import Build
+from app.master.build_scheduler import BuildScheduler
+from app.master.build_scheduler_pool import BuildSchedulerPool
+from app.master.slave import Slave
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestBuildSchedulerPool(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._scheduler_pool = BuildSchedulerPool()
+        self._mock_schedulers_by_build_id = {}
+        self._scheduler_pool.get = lambda build: self._mock_schedulers_by_build_id[build.build_id()]
+
+    def test_next_fair_share_build_scheduler_returns_none_when_no_builds_are_waiting(self):
+        self.assertIsNone(self._scheduler_pool.next_fair_share_build_scheduler())
+
+    def test_next_fair_share_build_scheduler_prefers_build_with_fewest_executors_allocated(self):
+        big_build = self._add_waiting_build(build_id=1, num_executors_allocated=40)
+        small_build = self._add_waiting_build(build_id=2, num_executors_allocated=0)
+
+        self.assertIs(self._scheduler_pool.next_fair_share_build_scheduler(), small_build,
+                      'A build with no executors should get the next slave ahead of a large build queued before it.')
+        small_build.num_executors_allocated = 50
+        self.assertIs(self._scheduler_pool.next_fair_share_build_scheduler(), big_build)
+
+    def test_next_fair_share_build_scheduler_breaks_ties_by_waiting_order(self):
+        first_build = self._add_waiting_build(build_id=1, num_executors_allocated=5)
+        self._add_waiting_build(build_id=2, num_executors_allocated=5)
+
+        self.assertIs(self._scheduler_pool.next_fair_share_build_scheduler(), first_build)
+
+    def test_next_fair_share_build_scheduler_skips_builds_that_no_longer_need_slaves(self):
+        satisfied_build = self._add_waiting_build(build_id=1, num_executors_allocated=0)
+        unsatisfied_build = self._add_waiting_build(build_id=2, num_executors_allocated=10)
+        satisfied_build.needs_more_slaves.return_value = False
+
+        self.assertIs(self._scheduler_pool.next_fair_share_build_scheduler(), unsatisfied_build)
+        self.assertNotIn(satisfied_build, self._scheduler_pool._schedulers_waiting_for_slaves)
+
+    def test_next_fair_share_build_scheduler_prefers_higher_priority_builds(self):
+        self._add_waiting_build(build_id=1, num_executors_allocated=0, priority=0)
+        urgent_build = self._add_waiting_build(build_id=2, num_executors_allocated=20, priority=10)
+
+        self.assertIs(self._scheduler_pool.next_fair_share_build_scheduler(), urgent_build)
+
+    def test_next_fair_share_build_scheduler_only_considers_builds_that_can_share_the_slave(self):
+        self._add_waiting_build(build_id=1, num_executors_allocated=0)
+        compatible_build = self._add_waiting_build(build_id=2, num_executors_allocated=10)
+        mock_slave = Mock(spec=Slave)
+        mock_slave.can_be_shared_with.side_effect = lambda build: build is compatible_build.build
+
+        self.assertIs(self._scheduler_pool.next_fair_share_build_scheduler(mock_slave), compatible_build)
+
+    def test_reclaim_executors_only_reclaims_up_to_the_demand_of_higher_priority_builds(self):
+        urgent_build = self._add_waiting_build(build_id=1, num_executors_allocated=0, priority=10)
+        urgent_build.num_executors_wanted.return_value = 8
+
+        self.assertTrue(self._scheduler_pool.reclaim_executors_for_higher_priority_builds(0, num_executors=5))
+        self.assertTrue(self._scheduler_pool.reclaim_executors_for_higher_priority_builds(0, num_executors=5))
+        self.assertFalse(self._scheduler_pool.reclaim_executors_for_higher_priority_builds(0, num_executors=5),
+                         'Executors already being reclaimed should satisfy the demand of the higher priority build.')
+
+        self._scheduler_pool.release_reclaimed_executors(5)
+        self.assertTrue(self._scheduler_pool.reclaim_executors_for_higher_priority_builds(0, num_executors=5))
+
+    def test_reclaim_executors_does_not_reclaim_for_builds_of_equal_or_lower_priority(self):
+        other_build = self._add_waiting_build(build_id=1, num_executors_allocated=0, priority=5)
+        other_build.num_executors_wanted.return_value = 8
+
+        self.assertFalse(self._scheduler_pool.reclaim_executors_for_higher_priority_builds(5, num_executors=5))
+
+    def test_add_build_waiting_for_slaves_does_not_add_the_same_build_twice(self):
+        self._add_waiting_build(build_id=1, num_executors_allocated=0)
+        self._scheduler_pool.add_build_waiting_for_slaves(Mock(spec=Build, build_id=Mock(return_value=1)))
+
+        self.assertEqual(len(self._scheduler_pool._schedulers_waiting_for_slaves), 1)
+
+    def _add_waiting_build(self, build_id, num_executors_allocated, priority=0):
+        """
+        :type build_id: int
+        :type num_executors_allocated: int
+        :type priority: int
+        :rtype: BuildScheduler | Mock
+        """
+        mock_scheduler = Mock(spec=BuildScheduler, num_executors_allocated=num_executors_allocated, priority=priority,
+                              needs_more_slaves=Mock(return_value=True))
+        self._mock_schedulers_by_build_id[build_id] = mock_scheduler
+        self._scheduler_pool.add_build_waiting_for_slaves(Mock(spec=Build, build_id=Mock(return_value=build_id)))
+        return mock_scheduler
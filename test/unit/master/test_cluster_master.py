@@ -94,7 +94,7 @@ class TestClusterMaster(BaseUnitTestCase):
         build_mock = MagicMock(spec_set=Build)
         master._all_builds_by_id[1] = build_mock
         existing_slave = master.get_slave(slave_id=None, slave_url='running-slave.turtles.gov')
-        existing_slave.current_build_id = 1
+        existing_slave._num_executors_allocated_by_build_id[1] = 1
 
         master.connect_slave('running-slave.turtles.gov', 10)
 
@@ -144,12 +144,38 @@ class TestClusterMaster(BaseUnitTestCase):
         slave_url = 'raphael.turtles.gov'
         master.connect_slave(slave_url, num_executors=10)
         slave = master.get_slave(slave_url=slave_url)
-        slave.current_build_id = 4
+        slave._num_executors_allocated_by_build_id[4] = 1
 
         master.handle_slave_state_update(slave, SlaveState.DISCONNECTED)
 
         self.assertIsNone(slave.current_build_id)
 
+    def test_updating_slave_to_disconnected_state_should_requeue_subjobs_of_its_builds(self):
+        master = ClusterMaster()
+        slave_url = 'raphael.turtles.gov'
+        master.connect_slave(slave_url, 10)
+        slave = master.get_slave(slave_url=slave_url)
+        mock_build = Mock(spec_set=Build, build_id=lambda: 777, is_finished=False)
+        master._all_builds_by_id[mock_build.build_id()] = mock_build
+        slave._num_executors_allocated_by_build_id[mock_build.build_id()] = 10
+        mock_scheduler = self.mock_scheduler_pool.get(mock_build)
+
+        master.handle_slave_state_update(slave, SlaveState.DISCONNECTED)
+
+        mock_scheduler.remove_dead_slave.assert_called_once_with(slave)
+        self.mock_slave_allocator.remove_idle_slave.assert_called_once_with(slave)
+
+    def test_slave_heartbeat_is_recorded(self):
+        master = ClusterMaster()
+        slave_url = 'raphael.turtles.gov'
+        master.connect_slave(slave_url, 10)
+        slave = master.get_slave(slave_url=slave_url)
+
+        master.handle_slave_heartbeat(slave, [{'id': 0}])
+
+        self.assertEqual(slave.api_representation()['executors'], [{'id': 0}])
+        self.assertFalse(slave.has_missed_heartbeats(heartbeat_timeout=30))
+
     def test_updating_slave_to_setup_completed_state_should_tell_build_to_begin_subjob_execution(self):
         master = ClusterMaster()
         fake_build = MagicMock(spec_set=Build)
@@ -163,6 +189,20 @@ class TestClusterMaster(BaseUnitTestCase):
 
         mock_scheduler.begin_subjob_executions_on_slave.assert_called_once_with(slave)
 
+    def test_updating_shared_slave_to_setup_completed_state_should_use_the_build_id_from_the_update(self):
+        master = ClusterMaster()
+        fake_build = MagicMock(spec_set=Build)
+        master.get_build = MagicMock(return_value=fake_build)
+        slave_url = 'raphael.turtles.gov'
+        master.connect_slave(slave_url, 10)
+        slave = master.get_slave(slave_url=slave_url)
+        slave._num_executors_allocated_by_build_id[1] = 5
+        slave._num_executors_allocated_by_build_id[2] = 5
+
+        master.handle_slave_state_update(slave, SlaveState.SETUP_COMPLETED, build_id=1)
+
+        master.get_build.assert_called_once_with(1)
+
     def test_updating_slave_to_shutdown_should_call_slave_set_shutdown_mode(self):
         master = ClusterMaster()
         slave_url = 'raphael.turtles.gov'
@@ -218,6 +258,49 @@ class TestClusterMaster(BaseUnitTestCase):
 
         self.assertEqual(mock_scheduler.execute_next_subjob_or_free_executor.call_count, 1)
 
+    def test_result_reported_from_slave_updates_the_speed_of_the_slave(self):
+        slave_url = 'raphael.turtles.gov'
+        mock_build = Mock(spec_set=Build, build_id=lambda: 777, is_finished=False)
+        mock_build.complete_subjob.return_value = True
+        mock_build.subjob.return_value.atoms = [Mock(expected_time=4.0, actual_time=1.0),
+                                                Mock(expected_time=4.0, actual_time=None)]
+
+        master = ClusterMaster()
+        master._all_builds_by_id[mock_build.build_id()] = mock_build
+        master._all_slaves_by_url[slave_url] = mock_slave = Mock()
+
+        master.handle_result_reported_from_slave(slave_url, mock_build.build_id(), subjob_id=888)
+
+        mock_slave.record_atom_times.assert_called_once_with(expected_time=4.0, actual_time=1.0)
+
+    def test_late_result_for_finished_build_is_ignored_but_frees_the_executor(self):
+        slave_url = 'raphael.turtles.gov'
+        mock_build = Mock(spec_set=Build, build_id=lambda: 777, is_finished=True, has_error=False, is_canceled=False)
+
+        master = ClusterMaster()
+        master._all_builds_by_id[mock_build.build_id()] = mock_build
+        master._all_slaves_by_url[slave_url] = Mock()
+        mock_scheduler = self.mock_scheduler_pool.get(mock_build)
+
+        master.handle_result_reported_from_slave(slave_url, mock_build.build_id(), subjob_id=888)
+
+        self.assertFalse(mock_build.complete_subjob.called)
+        self.assertEqual(mock_scheduler.execute_next_subjob_or_free_executor.call_count, 1)
+
+    @genty_dataset(
+        non_numeric_string=('urgent',),
+        float_value=(1.5,),
+        boolean_value=(True,),
+    )
+    def test_handle_request_for_new_build_rejects_non_integer_priority(self, priority):
+        master = ClusterMaster()
+        build_params = {'type': 'directory', 'project_directory': '/tmp', 'priority': priority}
+
+        success, response = master.handle_request_for_new_build(build_params)
+
+        self.assertFalse(success)
+        self.assertIn('priority', response['error'])
+
     @given(dictionaries(text(), text()))
     def test_handle_request_for_new_build_does_not_raise_exception(self, build_params):
         master = ClusterMaster()
@@ -33,6 +33,7 @@ class TestJobConfig(BaseUnitTestCase):
             'teardown_build': ['teardown command 1;', 'teardown command 2;'],
             'max_executors': 100,
             'max_executors_per_slave': 2,
+            'sparse_checkout': ['src/', 'test/'],
         }
         job_config = JobConfig.construct_from_dict('some_job_name', config_dict)
 
@@ -42,3 +43,4 @@ class TestJobConfig(BaseUnitTestCase):
         self.assertEquals(job_config.teardown_build, 'teardown command 1 && teardown command 2')
         self.assertEquals(job_config.max_executors, 100)
         self.assertEquals(job_config.max_executors_per_slave, 2)
+        self.assertEquals(job_config.sparse_checkout_paths, ['src/', 'test/'])
@@ -0,0 +1,54 @@
+from unittest.mock import Mock
+
+from app.master.project_distribution_tree import ProjectDistributionTree
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestProjectDistributionTree(BaseUnitTestCase):
+
+    def test_each_source_serves_at_most_fan_out_slaves_and_slaves_that_are_set_up_become_sources(self):
+        tree = ProjectDistributionTree(fan_out=2)
+        slaves = [Mock(name='slave{}'.format(i)) for i in range(5)]
+        start_setups = [Mock() for _ in slaves]
+
+        for slave, start_setup in zip(slaves, start_setups):
+            tree.add_slave(slave, start_setup)
+
+        start_setups[0].assert_called_once_with(None)
+        start_setups[1].assert_called_once_with(None)
+        self.assertFalse(start_setups[2].called, 'The master should serve at most fan_out slaves at a time.')
+
+        tree.mark_slave_as_set_up(slaves[0])
+
+        start_setups[2].assert_called_once_with(slaves[0])
+        start_setups[3].assert_called_once_with(slaves[0])
+        start_setups[4].assert_called_once_with(None)
+
+    def test_slaves_that_already_have_the_project_are_set_up_without_using_a_source(self):
+        tree = ProjectDistributionTree(fan_out=1)
+        start_setups = [Mock() for _ in range(3)]
+
+        tree.add_slave(Mock(), start_setups[0], has_project=True)
+        tree.add_slave(Mock(), start_setups[1])
+        tree.add_slave(Mock(), start_setups[2])
+
+        start_setups[0].assert_called_once_with(None)
+        start_setups[1].assert_called_once_with(None)
+        self.assertFalse(start_setups[2].called)
+
+    def test_removing_a_slave_frees_its_source_and_stops_it_from_serving_other_slaves(self):
+        tree = ProjectDistributionTree(fan_out=1)
+        slaves = [Mock(name='slave{}'.format(i)) for i in range(4)]
+        start_setups = [Mock() for _ in slaves]
+        tree.add_slave(slaves[0], start_setups[0])
+        tree.mark_slave_as_set_up(slaves[0])
+        tree.add_slave(slaves[1], start_setups[1])
+        tree.add_slave(slaves[2], start_setups[2])
+        tree.add_slave(slaves[3], start_setups[3])
+        start_setups[1].assert_called_once_with(slaves[0])
+        start_setups[2].assert_called_once_with(None)
+
+        tree.remove_slave(slaves[0])
+        tree.mark_slave_as_set_up(slaves[2])
+
+        start_setups[3].assert_called_once_with(slaves[2])
@@ -1,4 +1,8 @@
-from unittest.mock import Mock, MagicMock
+from unittest.mock import ANY, Mock, MagicMock
+
+from genty import genty, genty_dataset
+import requests
+from tornado.concurrent import Future
 
 from app.master.atom import Atom, AtomState
 from app.master.build import Build
@@ -10,6 +14,7 @@ from app.util.session_id import SessionId
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
+@genty
 class TestSlave(BaseUnitTestCase):
 
     _FAKE_SLAVE_URL = 'splinter.sensei.net:43001'
@@ -21,7 +26,7 @@ class TestSlave(BaseUnitTestCase):
 
     def test_disconnect_command_is_sent_during_teardown_when_slave_is_still_connected(self):
         slave = self._create_slave()
-        slave.current_build_id = 3
+        slave._num_executors_allocated_by_build_id[3] = 1
         slave._is_alive = True
 
         slave.teardown()
@@ -31,7 +36,7 @@ class TestSlave(BaseUnitTestCase):
 
     def test_disconnect_command_is_not_sent_during_teardown_when_slave_has_disconnected(self):
         slave = self._create_slave()
-        slave.current_build_id = 3
+        slave._num_executors_allocated_by_build_id[3] = 1
         slave._is_alive = False
 
         slave.teardown()
@@ -68,6 +73,27 @@ class TestSlave(BaseUnitTestCase):
             Secret.get()
         )
 
+    def test_project_params_are_modified_to_get_the_project_from_the_peer_slave_if_specified(self):
+        slave = self._create_slave()
+        peer_slave = self._create_slave(slave_url='peer-slave.test:43001')
+        slave._network.post_with_digest = Mock()
+        mock_build = self._create_mock_build(build_id=888, project_id='project-a')
+        mock_build.project_type.peer_param_overrides.return_value = {'peer_host': 'overridden-peer-host'}
+
+        slave.allocate_executors(mock_build)
+        slave.start_setup(mock_build, executor_start_index=0, peer_slave=peer_slave)
+
+        mock_build.project_type.peer_param_overrides.assert_called_once_with('peer-slave.test')
+        slave._network.post_with_digest.assert_called_once_with(
+            'http://{}/v1/build/888/setup'.format(self._FAKE_SLAVE_URL),
+            {
+                'build_executor_start_index': 0,
+                'project_type_params': {'type': 'directory', 'peer_host': 'overridden-peer-host'},
+            },
+            Secret.get()
+        )
+        self.assertEqual(slave.num_unallocated_executors(), 0)
+
     def test_build_id_is_set_on_master_before_telling_slave_to_setup(self):
         # This test enforces an ordering that avoids a race where the slave finishes setup and posts back before the
         # master has actually set the slave's current_build_id.
@@ -120,6 +146,78 @@ class TestSlave(BaseUnitTestCase):
 
         self.assertTrue(is_slave_alive)
 
+    @genty_dataset(
+        slave_is_alive=(True, True),
+        slave_is_not_alive=(False, False),
+        slave_is_offline=(None, False),
+        slave_response_is_not_json=(ValueError, False),
+    )
+    def test_probe_liveness_records_whether_the_slave_responded_that_it_is_alive(self, is_alive_response,
+                                                                                   expected_is_alive):
+        slave = self._create_slave()
+        mock_async_network = Mock()
+        response_future = Future()
+        if is_alive_response is None:
+            response_future.set_exception(requests.ConnectionError())
+        elif is_alive_response is ValueError:
+            response_future.set_result(Mock(ok=True, json=Mock(side_effect=ValueError)))
+        else:
+            response_data = {'slave': {'is_alive': is_alive_response}}
+            response_future.set_result(Mock(ok=True, json=Mock(return_value=response_data)))
+        mock_async_network.get.return_value = response_future
+
+        probe_result = slave.probe_liveness(mock_async_network, timeout=15.0)
+
+        self.assertEqual(probe_result.result(), expected_is_alive)
+        self.assertEqual(slave.is_alive(use_cached=True), expected_is_alive)
+        self.assertIsNotNone(slave.last_liveness_check_time)
+        mock_async_network.get.assert_called_once_with('http://{}/v1'.format(self._FAKE_SLAVE_URL), headers=ANY,
+                                                       timeout=15.0)
+
+    def test_slave_that_has_never_sent_a_heartbeat_has_not_missed_heartbeats(self):
+        slave = self._create_slave()
+
+        self.assertFalse(slave.has_missed_heartbeats(heartbeat_timeout=30))
+
+    def test_slave_has_missed_heartbeats_once_heartbeat_timeout_has_passed(self):
+        mock_time = self.patch('app.master.slave.time')
+        mock_time.time.return_value = 1000.0
+        slave = self._create_slave()
+        slave.record_heartbeat([])
+
+        mock_time.time.return_value = 1031.0
+
+        self.assertTrue(slave.has_missed_heartbeats(heartbeat_timeout=30))
+
+    def test_setup_cost_depends_on_how_much_of_the_build_source_the_slave_has_cached(self):
+        slave = self._create_slave()
+        mock_build = self._create_mock_build(build_id=1, project_id='/repos/a')
+        mock_build.project_type.cached_source.return_value = ('http://original-url/a.git', 'abc123')
+        mock_build.project_type.slave_param_overrides.return_value = {'url': 'ssh://master/repos/a'}
+
+        self.assertEqual(slave.setup_cost(mock_build), 2, 'A slave that has not reported the repo should cost most.')
+
+        slave.record_heartbeat([], cached_sources={'ssh://master/repos/a': ['def456']})
+        self.assertEqual(slave.setup_cost(mock_build), 1)
+
+        slave.record_heartbeat([], cached_sources={'ssh://master/repos/a': ['def456', 'abc123']})
+        self.assertEqual(slave.setup_cost(mock_build), 0)
+
+    def test_setup_cost_is_zero_for_project_types_that_do_not_cache_their_source(self):
+        slave = self._create_slave()
+        mock_build = self._create_mock_build(build_id=1, project_id='/projects/a')
+        mock_build.project_type.cached_source.return_value = None
+
+        self.assertEqual(slave.setup_cost(mock_build), 0)
+
+    def test_speed_factor_moves_toward_measured_ratio_of_expected_to_actual_atom_time(self):
+        slave = self._create_slave()
+
+        for _ in range(20):
+            slave.record_atom_times(expected_time=10.0, actual_time=5.0)
+
+        self.assertAlmostEqual(slave.speed_factor, 2.0, places=2)
+
     def test_is_alive_makes_correct_network_call_to_slave(self):
         slave = self._create_slave(
             slave_url='fake.slave.gov:43001',
@@ -129,13 +227,51 @@ class TestSlave(BaseUnitTestCase):
 
         self.mock_network.get.assert_called_once_with(
             'http://fake.slave.gov:43001/v1',
-            headers={SessionId.EXPECTED_SESSION_HEADER_KEY: 'abc-123'})
+            headers={SessionId.EXPECTED_SESSION_HEADER_KEY: 'abc-123'},
+            timeout=None)
 
-    def test_mark_as_idle_raises_when_executors_are_in_use(self):
+    def test_mark_as_idle_raises_but_does_not_kill_slave_in_shutdown_mode_while_builds_are_running(self):
         slave = self._create_slave()
-        slave._num_executors_in_use.increment()
+        slave._num_executors_allocated_by_build_id[1] = 3
+        slave._is_in_shutdown_mode = True
+        slave.kill = Mock()
+
+        self.assertRaises(SlaveMarkedForShutdownError, slave.mark_as_idle)
+        self.assertFalse(slave.kill.called)
+
+    def test_setup_allocates_only_unallocated_executors_to_each_build(self):
+        slave = self._create_slave(num_executors=10)
+
+        slave.setup(self._create_mock_build(build_id=1, project_id='project-a'), executor_start_index=0,
+                    num_executors=6)
+        slave.setup(self._create_mock_build(build_id=2, project_id='project-b'), executor_start_index=0)
+
+        self.assertEqual(slave.num_executors_allocated_to_build(1), 6)
+        self.assertEqual(slave.num_executors_allocated_to_build(2), 4)
+        self.assertEqual(slave.num_unallocated_executors(), 0)
+        self.assertEqual(slave.current_build_ids(), [1, 2])
+
+    def test_release_executor_and_teardown_return_executors_to_the_slave(self):
+        slave = self._create_slave(num_executors=10)
+        slave.setup(self._create_mock_build(build_id=1, project_id='project-a'), executor_start_index=0,
+                    num_executors=6)
+
+        remaining_executors = slave.release_executor(1)
+        self.assertEqual(remaining_executors, 5)
+        self.assertEqual(slave.num_unallocated_executors(), 5)
 
-        self.assertRaises(Exception, slave.mark_as_idle)
+        slave.teardown(1)
+        self.assertEqual(slave.num_unallocated_executors(), 10)
+        self.assertIsNone(slave.current_build_id)
+
+    def test_slave_cannot_be_shared_by_builds_of_the_same_project(self):
+        slave = self._create_slave(num_executors=10)
+        slave.setup(self._create_mock_build(build_id=1, project_id='project-a'), executor_start_index=0,
+                    num_executors=5)
+
+        self.assertFalse(slave.can_be_shared_with(self._create_mock_build(build_id=1, project_id='project-a')))
+        self.assertFalse(slave.can_be_shared_with(self._create_mock_build(build_id=2, project_id='project-a')))
+        self.assertTrue(slave.can_be_shared_with(self._create_mock_build(build_id=3, project_id='project-b')))
 
     def test_mark_as_idle_raises_when_slave_is_in_shutdown_mode(self):
         slave = self._create_slave()
@@ -159,7 +295,7 @@ class TestSlave(BaseUnitTestCase):
 
     def test_set_shutdown_mode_should_set_is_shutdown_and_not_kill_slave_if_slave_has_a_build(self):
         slave = self._create_slave()
-        slave.current_build_id = 1
+        slave._num_executors_allocated_by_build_id[1] = 1
         slave.kill = Mock()
 
         slave.set_shutdown_mode()
@@ -183,6 +319,16 @@ class TestSlave(BaseUnitTestCase):
 
         assert slave._network.post_with_digest.called
 
+    def _create_mock_build(self, build_id, project_id):
+        """
+        :type build_id: int
+        :type project_id: str
+        :rtype: Build | MagicMock
+        """
+        mock_project_type = Mock(slave_param_overrides=Mock(return_value={}), project_id=Mock(return_value=project_id))
+        return MagicMock(spec=Build, build_request=BuildRequest({'type': 'directory'}),
+                         build_id=Mock(return_value=build_id), project_type=mock_project_type)
+
     def _create_slave(self, **kwargs):
         """
         Create a slave for testing.
@@ -29,23 +29,44 @@ class TestSlaveAllocator(BaseUnitTestCase):
                           allocate_slave=Mock(side_effect=AbortLoopForTesting))
         mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False))
         slave_allocator = self._create_slave_allocator()
-        slave_allocator._scheduler_pool.next_prepared_build_scheduler = Mock(return_value=mock_build)
+        slave_allocator._scheduler_pool.next_fair_share_build_scheduler.return_value = mock_build
         slave_allocator._idle_slaves.get = Mock(return_value=mock_slave)
 
         self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
 
     def test_slave_allocation_loop_should_return_idle_slave_to_queue_if_not_needed(self):
-        mock_build = Mock(spec=Build, needs_more_slaves=Mock(side_effect=[True, False]))
-        mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False))
+        mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False),
+                          current_build_id=None)
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.next_fair_share_build_scheduler.return_value = None
+        slave_allocator._idle_slaves.get = Mock(return_value=mock_slave)
+        slave_allocator.add_idle_slave = Mock(side_effect=AbortLoopForTesting)
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+
+    def test_slave_allocation_loop_should_return_slave_to_queue_if_it_has_executors_left_after_allocation(self):
+        mock_build_scheduler = Mock()
+        mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False),
+                          num_unallocated_executors=Mock(return_value=2))
         slave_allocator = self._create_slave_allocator()
-        slave_allocator._scheduler_pool.next_prepared_build_scheduler = Mock(return_value=mock_build)
+        slave_allocator._scheduler_pool.next_fair_share_build_scheduler.return_value = mock_build_scheduler
         slave_allocator._idle_slaves.get = Mock(return_value=mock_slave)
         slave_allocator.add_idle_slave = Mock(side_effect=AbortLoopForTesting)
 
         self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        mock_build_scheduler.allocate_slave.assert_called_once_with(mock_slave)
+        slave_allocator._scheduler_pool.next_fair_share_build_scheduler.assert_called_once_with(mock_slave)
+
+    def test_slave_allocation_loop_should_wait_for_a_waiting_build_before_claiming_a_slave(self):
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.wait_for_build_waiting_for_slaves.side_effect = AbortLoopForTesting
+        slave_allocator._idle_slaves.get = Mock()
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        self.assertFalse(slave_allocator._idle_slaves.get.called)
 
     def test_add_idle_slave_should_mark_slave_idle_and_add_to_queue(self):
-        mock_slave = Mock(spec=Slave, url='', mark_as_idle=Mock())
+        mock_slave = Mock(spec=Slave, url='', mark_as_idle=Mock(), num_unallocated_executors=Mock(return_value=1))
         slave_allocator = self._create_slave_allocator()
         slave_allocator._idle_slaves.put = Mock()
 
@@ -54,6 +75,15 @@ class TestSlaveAllocator(BaseUnitTestCase):
         self.assertTrue(mock_slave.mark_as_idle.called)
         slave_allocator._idle_slaves.put.assert_called_with(mock_slave)
 
+    def test_add_idle_slave_should_not_add_slave_to_queue_if_all_its_executors_are_allocated(self):
+        mock_slave = Mock(spec=Slave, url='', mark_as_idle=Mock(), num_unallocated_executors=Mock(return_value=0))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._idle_slaves.put = Mock()
+
+        slave_allocator.add_idle_slave(mock_slave)
+
+        self.assertFalse(slave_allocator._idle_slaves.put.called)
+
     def test_add_idle_slave_should_not_add_slave_to_queue_if_slave_is_shutdown(self):
         mock_slave = Slave('', 10)
         mock_slave.kill = Mock(return_value=None)
@@ -65,6 +95,63 @@ class TestSlaveAllocator(BaseUnitTestCase):
 
         self.assertFalse(slave_allocator._idle_slaves.put.called)
 
+    def test_slave_allocation_loop_should_use_cached_liveness_of_slave(self):
+        mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=False), is_shutdown=Mock(return_value=False))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._idle_slaves.get = Mock(side_effect=[mock_slave, AbortLoopForTesting])
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        mock_slave.is_alive.assert_called_once_with()
+        self.assertFalse(slave_allocator._scheduler_pool.next_fair_share_build_scheduler.called,
+                         'A dead slave should not be allocated to a build.')
+
+    def test_remove_idle_slave_removes_slave_from_queue(self):
+        mock_slave = Mock(spec=Slave, url='', mark_as_idle=Mock(), num_unallocated_executors=Mock(return_value=1))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator.add_idle_slave(mock_slave)
+
+        slave_allocator.remove_idle_slave(mock_slave)
+
+        self.assertTrue(slave_allocator._idle_slaves.empty())
+
+    def test_slave_allocation_loop_should_prefer_the_idle_slave_that_is_cheapest_to_set_up(self):
+        cold_slave = self._create_mock_slave(setup_cost=2)
+        warm_slave = self._create_mock_slave(setup_cost=0)
+        mock_build_scheduler = Mock(allocate_slave=Mock(side_effect=AbortLoopForTesting))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.next_fair_share_build_scheduler.return_value = mock_build_scheduler
+        slave_allocator.add_idle_slave(warm_slave)
+        slave_allocator.add_idle_slave(cold_slave)
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+
+        mock_build_scheduler.allocate_slave.assert_called_once_with(warm_slave)
+        self.assertEqual(slave_allocator._idle_slaves.snapshot(), [cold_slave],
+                         'The slave that was passed over should be put back on the idle queue.')
+
+    def test_slave_allocation_loop_should_not_prefer_a_cheaper_slave_that_cannot_be_shared_with_the_build(self):
+        cold_slave = self._create_mock_slave(setup_cost=2)
+        warm_slave = self._create_mock_slave(setup_cost=0, can_be_shared_with=False)
+        mock_build_scheduler = Mock(allocate_slave=Mock(side_effect=AbortLoopForTesting))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.next_fair_share_build_scheduler.return_value = mock_build_scheduler
+        slave_allocator.add_idle_slave(warm_slave)
+        slave_allocator.add_idle_slave(cold_slave)
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+
+        mock_build_scheduler.allocate_slave.assert_called_once_with(cold_slave)
+
+    def _create_mock_slave(self, setup_cost, can_be_shared_with=True):
+        """
+        :type setup_cost: int
+        :type can_be_shared_with: bool
+        :rtype: Slave | Mock
+        """
+        return Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False),
+                    num_unallocated_executors=Mock(return_value=1), setup_cost=Mock(return_value=setup_cost),
+                    can_be_shared_with=Mock(return_value=can_be_shared_with))
+
     def _create_slave_allocator(self, **kwargs):
         """
         Create a slave allocator for testing.
@@ -0,0 +1,78 @@
+from unittest.mock import Mock
+
+from tornado.concurrent import Future
+
+from app.master.slave import Slave
+from app.master.slave_liveness_monitor import SlaveLivenessMonitor
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestSlaveLivenessMonitor(BaseUnitTestCase):
+
+    def test_probe_slaves_calls_dead_slave_callback_for_unresponsive_slaves(self):
+        alive_slave = self._create_mock_slave(slave_id=1, is_alive_over_network=True)
+        dead_slave = self._create_mock_slave(slave_id=2, is_alive_over_network=False)
+        dead_slave_callback = Mock()
+        monitor = self._create_monitor([alive_slave, dead_slave], dead_slave_callback)
+
+        monitor.probe_slaves()
+
+        dead_slave.probe_liveness.assert_called_once_with(monitor._network, timeout=15.0)
+        dead_slave_callback.assert_called_once_with(dead_slave)
+
+    def test_probe_slaves_does_not_probe_slaves_already_known_to_be_dead(self):
+        slave = self._create_mock_slave(slave_id=1, is_alive_over_network=False, is_alive_cached=False)
+        dead_slave_callback = Mock()
+        monitor = self._create_monitor([slave], dead_slave_callback)
+
+        monitor.probe_slaves()
+
+        slave.is_alive.assert_called_once_with()
+        self.assertFalse(slave.probe_liveness.called)
+        self.assertFalse(dead_slave_callback.called)
+
+    def test_probe_slaves_skips_slave_whose_previous_probe_has_not_finished(self):
+        slave = self._create_mock_slave(slave_id=1, is_alive_over_network=True)
+        monitor = self._create_monitor([slave], Mock())
+        monitor._slave_ids_being_probed.add(slave.id)
+
+        monitor.probe_slaves()
+
+        self.assertFalse(slave.probe_liveness.called)
+
+    def test_probe_slaves_considers_slave_that_missed_heartbeats_dead_without_probing_it(self):
+        slave = self._create_mock_slave(slave_id=1, is_alive_over_network=True)
+        slave.has_missed_heartbeats.return_value = True
+        dead_slave_callback = Mock()
+        monitor = SlaveLivenessMonitor(lambda: [slave], dead_slave_callback, probe_interval=15.0, heartbeat_timeout=30.0)
+
+        monitor.probe_slaves()
+
+        slave.has_missed_heartbeats.assert_called_once_with(30.0)
+        slave.set_is_alive.assert_called_once_with(False)
+        dead_slave_callback.assert_called_once_with(slave)
+        self.assertFalse(slave.probe_liveness.called)
+
+    def test_start_should_raise_if_monitor_thread_is_already_running(self):
+        monitor = self._create_monitor([], Mock())
+        monitor._monitor_thread.is_alive = Mock(return_value=True)
+
+        self.assertRaises(RuntimeError, monitor.start)
+
+    def _create_monitor(self, slaves, dead_slave_callback):
+        """
+        :type slaves: list[Slave]
+        :type dead_slave_callback: callable
+        :rtype: SlaveLivenessMonitor
+        """
+        return SlaveLivenessMonitor(lambda: slaves, dead_slave_callback, probe_interval=15.0)
+
+    def _create_mock_slave(self, slave_id, is_alive_over_network, is_alive_cached=True):
+        """
+        :rtype: Slave
+        """
+        # The probe's future is already resolved, so probes complete right away without running an IOLoop.
+        probe_result = Future()
+        probe_result.set_result(is_alive_over_network)
+        return Mock(spec=Slave, id=slave_id, is_alive=Mock(return_value=is_alive_cached),
+                    probe_liveness=Mock(return_value=probe_result))
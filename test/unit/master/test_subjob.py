@@ -85,3 +85,40 @@ class TestSubjob(BaseUnitTestCase):
         self._subjob.mark_completed()
         actual_api_repr = self._subjob.api_representation()
         self._assert_atoms_are_in_state(actual_api_repr, 'COMPLETED')
+
+    def test_expected_time_is_the_sum_of_atom_expected_times(self):
+        self.assertAlmostEqual(self._subjob.expected_time(), 23.4 + 89.0)
+
+    def test_expected_time_is_none_if_an_atom_has_no_timing_data(self):
+        self._subjob.atoms[1].expected_time = None
+
+        self.assertIsNone(self._subjob.expected_time())
+
+    def test_only_the_first_result_can_be_claimed(self):
+        self._subjob.mark_in_progress(None)
+
+        self.assertTrue(self._subjob.claim_result())
+        self.assertFalse(self._subjob.claim_result(), 'A duplicate result from a speculative execution should be '
+                                                      'rejected.')
+        self.assertFalse(self._subjob.is_executing())
+
+    def test_split_moves_trailing_atoms_into_new_subjob(self):
+        new_subjob = self._subjob.split(new_subjob_id=35, num_atoms_to_keep=1)
+
+        self.assertEqual([atom.command_string for atom in self._subjob.atoms], ['export BREAKFAST="pancakes";'])
+        self.assertEqual(new_subjob.subjob_id(), 35)
+        self.assertEqual([atom.command_string for atom in new_subjob.atoms], ['export BREAKFAST="cereal";'])
+        self.assertEqual([atom.id for atom in new_subjob.atoms], [0], 'Atom ids should be reindexed in new subjob.')
+
+    def test_split_returns_none_when_no_atoms_would_be_moved(self):
+        self.assertIsNone(self._subjob.split(new_subjob_id=35, num_atoms_to_keep=2))
+        self.assertEqual(len(self._subjob.atoms), 2)
+
+    def test_split_without_atom_count_balances_expected_time(self):
+        atoms = [Atom('command', expected_time=expected_time) for expected_time in (10.0, 1.0, 1.0, 1.0, 1.0)]
+        subjob = Subjob(build_id=1, subjob_id=0, project_type=Mock(), job_config=Mock(), atoms=atoms)
+
+        new_subjob = subjob.split(new_subjob_id=1)
+
+        self.assertEqual(len(subjob.atoms), 1, 'The long atom alone should take about as long as the rest.')
+        self.assertEqual(len(new_subjob.atoms), 4)
@@ -6,7 +6,9 @@ from app.master.atom import Atom
 from app.master.atomizer import Atomizer
 from app.master.job_config import JobConfig
 from app.master.subjob_calculator import SubjobCalculator
+from app.master.timing_store import AtomTimingStatistics, TimingStore
 from app.project_type.project_type import ProjectType
+from app.util.conf.configuration import Configuration
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
@@ -40,3 +42,42 @@ class TestSubjobCalculator(BaseUnitTestCase):
                                                     project_type=mock_project)
 
         self.assertEquals(mock_atomizer.atomize_in_project.called, atomizer_called)
+
+    def test_atoms_are_grouped_by_the_configured_percentile_of_their_recent_times(self):
+        self.patch('os.path.isfile').return_value = False
+        Configuration['atom_time_percentile'] = 90
+        mock_timing_store = Mock(spec_set=TimingStore)
+        mock_timing_store.atom_statistics.return_value = {
+            'atom_1': AtomTimingStatistics(3.0, 2.0, 5.0, 4, [2.0, 5.0, 3.0, 2.0]),
+        }
+        mock_grouper_class = self.patch('app.master.subjob_calculator.TimeBasedAtomGrouper')
+
+        subjob_calculator = SubjobCalculator(timing_store=mock_timing_store)
+        subjob_calculator._grouped_atoms([Atom('atom_1')], 1, '/some/path/doesnt/matter', '/some/project/directory')
+
+        _, _, atom_time_map, _, _, _, _, atom_time_variances, _, _ = mock_grouper_class.call_args[0]
+        self.assertEqual(atom_time_map, {'atom_1': 5.0})
+        self.assertEqual(atom_time_variances, {'atom_1': 2.0})
+
+    def test_group_atoms_incrementally_groups_streamed_atoms_in_batches_of_the_configured_size(self):
+        self.patch('os.path.isfile').return_value = False
+        Configuration['streaming_atomization_batch_size'] = 2
+        mock_project = Mock(spec_set=ProjectType())
+        mock_project.timing_file_path.return_value = '/some/path/doesnt/matter'
+        mock_project.project_directory = '/some/project/directory'
+        mock_atomizer = Mock(spec_set=Atomizer)
+        mock_atomizer.atomize_in_project_incrementally.side_effect = \
+            lambda project_type, atoms_callback, atomization_cache: [atoms_callback([Atom('atom_{}'.format(i))])
+                                                                     for i in range(5)]
+        mock_job_config = Mock(spec=JobConfig)
+        mock_job_config.name = 'some_config'
+        mock_job_config.max_executors = 1
+        mock_job_config.atomizer = mock_atomizer
+        grouped_atom_batches = []
+
+        subjob_calculator = SubjobCalculator()
+        subjob_calculator.group_atoms_incrementally(mock_job_config, mock_project, grouped_atom_batches.append)
+
+        batch_atom_commands = [[atom.command_string for atom_group in atom_groups for atom in atom_group]
+                               for atom_groups in grouped_atom_batches]
+        self.assertEqual(batch_atom_commands, [['atom_0', 'atom_1'], ['atom_2', 'atom_3'], ['atom_4']])
@@ -1,9 +1,13 @@
 from unittest.mock import Mock
+
+from genty import genty, genty_dataset
+
 from app.master.atom import Atom
-from app.master.time_based_atom_grouper import TimeBasedAtomGrouper, _AtomTimingDataError
+from app.master.time_based_atom_grouper import TimeBasedAtomGrouper, _AtomTimingDataError, _SortedAtoms
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
+@genty
 class TestTimeBasedAtomGrouper(BaseUnitTestCase):
     def _mock_atoms(self, command_strings):
         atom_spec = Atom('key', 'val')
@@ -41,6 +45,19 @@ class TestTimeBasedAtomGrouper(BaseUnitTestCase):
         self.assertEquals(total_time, 11.0)
         self._assert_coalesced_contents(new_atoms, expected_contents)
 
+    def test_coalesce_new_atoms_estimates_times_from_atoms_with_the_longest_common_path_prefix(self):
+        new_atoms = self._mock_atoms(['test/unit/a.py', 'test/unit/b.py', 'test/functional/c.py',
+                                      'test/unit/new.py', 'test/other/new.py', 'other/new.py'])
+        old_atoms_with_times = {'test/unit/a.py': 1.0, 'test/unit/b.py': 3.0, 'test/functional/c.py': 8.0}
+        expected_contents = {'test/unit/a.py': 1.0, 'test/unit/b.py': 3.0, 'test/functional/c.py': 8.0,
+                             'test/unit/new.py': 2.0, 'test/other/new.py': 4.0, 'other/new.py': 8.0}
+
+        atom_grouper = TimeBasedAtomGrouper(new_atoms, 3, old_atoms_with_times, 'some_project_directory')
+        total_time = atom_grouper._set_expected_atom_times(new_atoms, old_atoms_with_times, 'some_project_directory')
+
+        self.assertEquals(total_time, 26.0)
+        self._assert_coalesced_contents(new_atoms, expected_contents)
+
     def test_groupings_data_set_1(self):
         new_atoms = self._mock_atoms([
             'atom_1', 'atom_2', 'atom_3', 'atom_4', 'atom_5', 'atom_6', 'atom_7', 'atom_8', 'atom_9', 'atom_10'])
@@ -135,6 +152,77 @@ class TestTimeBasedAtomGrouper(BaseUnitTestCase):
 
         self._assert_subjobs_match_expected_groupings(subjobs, expected_groupings)
 
+    def test_big_chunk_subjobs_are_sized_in_proportion_to_executor_speed(self):
+        new_atoms = self._mock_atoms(['atom_1', 'atom_2', 'atom_3', 'atom_4'])
+        old_atoms_with_times = {'atom_1': 25.0, 'atom_2': 25.0, 'atom_3': 25.0, 'atom_4': 25.0}
+        atom_grouper = TimeBasedAtomGrouper(new_atoms, 10, old_atoms_with_times, 'some_project_directory',
+                                            executor_speed_factors=[3.0, 1.0])
+        group_atoms = self.patch_object(atom_grouper, '_group_atoms_into_sized_buckets')
+        group_atoms.return_value = []
+
+        atom_grouper.groupings()
+
+        (_, big_subjob_times, max_big_subjobs), _ = group_atoms.call_args_list[0]
+        self.assertEqual(big_subjob_times, [60.0, 20.0], 'The big chunk (80% of 100s) should be split 3:1.')
+        self.assertEqual(max_big_subjobs, 2, 'There should be one big subjob per executor that is available.')
+
+    def test_tuned_grouping_parameters_set_the_big_chunk_fraction_and_number_of_small_subjobs(self):
+        new_atoms = self._mock_atoms(['atom_1', 'atom_2', 'atom_3', 'atom_4'])
+        old_atoms_with_times = {'atom_1': 25.0, 'atom_2': 25.0, 'atom_3': 25.0, 'atom_4': 25.0}
+        atom_grouper = TimeBasedAtomGrouper(new_atoms, 2, old_atoms_with_times, 'some_project_directory',
+                                            big_chunk_fraction=0.6, small_subjobs_per_executor=4)
+        group_atoms = self.patch_object(atom_grouper, '_group_atoms_into_sized_buckets')
+        group_atoms.return_value = []
+
+        atom_grouper.groupings()
+
+        (_, big_subjob_times, _), _ = group_atoms.call_args_list[0]
+        (_, small_subjob_times, _), _ = group_atoms.call_args_list[1]
+        self.assertEqual(big_subjob_times, [30.0, 30.0], 'The big chunk should be 60% of the 100s of work.')
+        self.assertEqual(small_subjob_times, [5.0], 'The remaining 40s should be split into 4 subjobs per executor.')
+
+    @genty_dataset(
+        cheap_subjobs_are_split_finely=(0.05, 1.25),
+        expensive_subjobs_are_split_coarsely=(20.0, 20.0),
+    )
+    def test_small_subjobs_are_sized_to_balance_the_overhead_per_subjob(self, subjob_overhead,
+                                                                         expected_small_subjob_time):
+        new_atoms = self._mock_atoms(['atom_1', 'atom_2', 'atom_3', 'atom_4'])
+        old_atoms_with_times = {'atom_1': 25.0, 'atom_2': 25.0, 'atom_3': 25.0, 'atom_4': 25.0}
+        atom_grouper = TimeBasedAtomGrouper(new_atoms, 1, old_atoms_with_times, 'some_project_directory',
+                                            subjob_overhead=subjob_overhead)
+        group_atoms = self.patch_object(atom_grouper, '_group_atoms_into_sized_buckets')
+        group_atoms.return_value = []
+
+        atom_grouper.groupings()
+
+        (_, [small_subjob_time], _), _ = group_atoms.call_args_list[1]
+        self.assertAlmostEqual(small_subjob_time, expected_small_subjob_time)
+
+    def test_high_variance_atoms_are_kept_out_of_big_chunk_subjobs(self):
+        new_atoms = self._mock_atoms(['atom_1', 'atom_2', 'atom_3', 'atom_4', 'flaky_atom'])
+        old_atoms_with_times = {'atom_1': 30.0, 'atom_2': 30.0, 'atom_3': 20.0, 'atom_4': 10.0, 'flaky_atom': 10.0}
+        atom_time_variances = {'atom_1': 1.0, 'atom_2': 1.0, 'atom_3': 1.0, 'atom_4': 1.0, 'flaky_atom': 400.0}
+        # Without the variances, flaky_atom would fill up the second big chunk subjob along with atom_2.
+        expected_groupings = [['atom_1', 'atom_4'], ['atom_2'], ['atom_3'], ['flaky_atom']]
+        atom_grouper = TimeBasedAtomGrouper(new_atoms, 2, old_atoms_with_times, 'some_project_directory',
+                                            atom_time_variances=atom_time_variances)
+
+        subjobs = atom_grouper.groupings()
+
+        self._assert_subjobs_match_expected_groupings(subjobs, expected_groupings)
+
+    def test_sorted_atoms_pops_longest_atom_that_fits_in_original_order_for_ties(self):
+        atoms = [Atom('atom_{}'.format(i), expected_time=atom_time) for i, atom_time in enumerate([3.0, 5.0, 3.0, 1.0])]
+        sorted_atoms = _SortedAtoms(atoms)
+
+        self.assertIs(sorted_atoms.pop_longest(max_time=4.0), atoms[0])
+        self.assertIs(sorted_atoms.pop_longest(max_time=4.0), atoms[2])
+        self.assertIs(sorted_atoms.pop_longest(max_time=2.5), atoms[3])
+        self.assertIsNone(sorted_atoms.pop_longest(max_time=4.0))
+        self.assertEqual(sorted_atoms.pop_all(), [atoms[1]])
+        self.assertEqual(len(sorted_atoms), 0)
+
     def _assert_coalesced_contents(self, coalesced_atoms_with_historic_times, expected_atom_time_values):
         """
         Assert that coalesced_atoms_with_historic_times matches expected_atom_time_values
@@ -0,0 +1,58 @@
+import json
+from unittest.mock import mock_open
+
+from app.master.timing_store import TimingStore
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestTimingStore(BaseUnitTestCase):
+
+    _JOB_KEY = '/var/timings/project/job.timing.json'
+
+    def setUp(self):
+        super().setUp()
+        self.mock_isfile = self.patch('app.master.timing_store.os.path.isfile')
+        self.mock_isfile.return_value = False
+        self._timing_store = TimingStore(':memory:')
+        self.addCleanup(self._timing_store.close)
+
+    def test_statistics_of_atoms_are_updated_with_every_recorded_time(self):
+        for atom_time in [10.0, 20.0, 10.0]:
+            self._timing_store.record_atom_times(self._JOB_KEY, {'atom_1': atom_time})
+
+        statistics = self._timing_store.atom_statistics(self._JOB_KEY, ['atom_1'])['atom_1']
+
+        self.assertAlmostEqual(statistics.mean, 12.1, msg='The mean should move 30% of the way to each new time.')
+        self.assertGreater(statistics.variance, 0)
+        self.assertEqual(statistics.p90, 20.0)
+        self.assertEqual(statistics.percentile(0.5), 10.0)
+        self.assertEqual(statistics.num_samples, 3)
+
+    def test_expected_times_are_only_returned_for_the_requested_atoms_of_the_job(self):
+        self._timing_store.record_atom_times(self._JOB_KEY, {'atom_1': 1.0, 'atom_2': 2.0})
+        self._timing_store.record_atom_times('/var/timings/project/other_job.timing.json', {'atom_3': 3.0})
+
+        expected_times = self._timing_store.expected_times(self._JOB_KEY, ['atom_2', 'atom_3', 'new_atom'])
+
+        self.assertEqual(expected_times, {'atom_2': 2.0})
+
+    def test_lookups_of_more_atoms_than_fit_in_one_query_return_all_atoms(self):
+        atom_times = {'atom_{}'.format(i): float(i) for i in range(1200)}
+        self._timing_store.record_atom_times(self._JOB_KEY, atom_times)
+
+        self.assertEqual(self._timing_store.expected_times(self._JOB_KEY, list(atom_times)), atom_times)
+
+    def test_existing_timing_file_is_imported_the_first_time_the_job_is_looked_up(self):
+        self.mock_isfile.side_effect = lambda path: path == self._JOB_KEY
+        self.patch('app.master.timing_store.open', new=mock_open(read_data=json.dumps({'atom_1': 5.0, 'atom_2': 7.0})),
+                   create=True)
+
+        self.assertEqual(self._timing_store.expected_times(self._JOB_KEY, ['atom_1', 'atom_2']),
+                         {'atom_1': 5.0, 'atom_2': 7.0})
+
+        self._timing_store.record_atom_times(self._JOB_KEY, {'atom_1': 15.0})
+        self.assertAlmostEqual(self._timing_store.expected_times(self._JOB_KEY, ['atom_1'])['atom_1'], 8.0,
+                               msg='The timing file should not be imported again over the newly recorded time.')
+
+    def test_lookup_before_anything_is_recorded_returns_no_times(self):
+        self.assertEqual(self._timing_store.expected_times(self._JOB_KEY, ['atom_1']), {})
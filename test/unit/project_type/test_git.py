@@ -21,6 +21,7 @@ class TestGit(BaseUnitTestCase):
         self.patch('app.project_type.git.fs.create_dir')
         self.patch('os.unlink')
         self.patch('os.symlink')
+        self.patch('os.remove')
 
         self.os_path_exists_mock = self.patch('app.project_type.git.os.path.exists')
         self.os_path_exists_mock.return_value = False
@@ -261,6 +262,112 @@ class TestGit(BaseUnitTestCase):
             '"branch" should not be in the params to override when "get_project_from_master" is False',
         )
 
+    def test_fetch_project_checks_out_commit_in_build_specific_worktree_when_git_worktrees_is_enabled(self):
+        Configuration['git_worktrees'] = True
+        Configuration['repo_directory'] = '/repo-directory'
+        mock_popen = self._patch_popen({
+            'git rev-parse FETCH_HEAD': _FakePopenResult(stdout='deadbee123\n')
+        })
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name',
+                  build_project_directory='/tmp/build_symlinks/build-uuid')
+        git.fetch_project()
+
+        repo_directory = '/repodirectory/originaluserspecifiedurl.test/repopath/reponame'
+        worktree_directory = join(repo_directory, Git.WORKTREES_DIRECTORY, 'build-uuid')
+        self.assertTrue(git.has_build_specific_copy())
+        self.assertIn(call(AnyStringMatching('git worktree add --detach --no-checkout {} deadbee123'.format(
+            worktree_directory)), start_new_session=ANY, stdout=ANY, stderr=ANY, cwd=repo_directory, shell=ANY),
+            mock_popen.call_args_list)
+        self.assertIn(call(AnyStringMatching('git reset --hard deadbee123 --'), start_new_session=ANY, stdout=ANY,
+                           stderr=ANY, cwd=worktree_directory, shell=ANY), mock_popen.call_args_list,
+                      'The commit should be checked out in the worktree rather than in the shared repo.')
+        self.assertNotIn(call(AnyStringMatching('git reset'), start_new_session=ANY, stdout=ANY, stderr=ANY,
+                              cwd=repo_directory, shell=ANY), mock_popen.call_args_list)
+
+    def test_fetch_project_removes_worktree_that_was_left_on_disk_before_adding_it_again(self):
+        Configuration['git_worktrees'] = True
+        Configuration['repo_directory'] = '/repo-directory'
+        repo_directory = '/repodirectory/originaluserspecifiedurl.test/repopath/reponame'
+        worktree_directory = join(repo_directory, Git.WORKTREES_DIRECTORY, 'build-uuid')
+        self.os_path_exists_mock.side_effect = lambda path: path == worktree_directory
+        mock_popen = self._patch_popen()
+        git_commands_before_rmtree = []
+        mock_rmtree = self.patch('app.project_type.git.shutil.rmtree')
+        mock_rmtree.side_effect = lambda path: git_commands_before_rmtree.extend(
+            args[0] for args, _ in mock_popen.call_args_list)
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name',
+                  build_project_directory='/tmp/build_symlinks/build-uuid')
+        git.fetch_project()
+
+        mock_rmtree.assert_called_once_with(worktree_directory)
+        self.assertFalse(any('git worktree' in command for command in git_commands_before_rmtree),
+                         'The leftover worktree should be removed before worktrees are pruned and added.')
+        self.assertIn(call(AnyStringMatching('git worktree add --detach --no-checkout {} '.format(worktree_directory)),
+                           start_new_session=ANY, stdout=ANY, stderr=ANY, cwd=repo_directory, shell=ANY),
+                      mock_popen.call_args_list)
+
+    def test_fetch_project_checks_out_only_sparse_checkout_paths_and_clusterrunner_yaml_if_specified(self):
+        mock_write_file = self.patch('app.project_type.git.fs.write_file')
+        mock_popen = self._patch_popen({'git rev-parse --git-dir': _FakePopenResult(stdout='.git\n')})
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name', project_directory='project',
+                  sparse_checkout_paths=['src/', 'test'])
+        git.fetch_project()
+
+        mock_write_file.assert_called_once_with('/src\n/test\n/project/clusterrunner.yaml\n',
+                                                AnyStringMatching('/.git/info/sparse-checkout$'))
+        git_commands = [popen_call[0][0].rsplit('; ', 1)[-1] for popen_call in mock_popen.call_args_list]
+        self.assertIn('git config core.sparseCheckout true', git_commands)
+        self.assertIn('git read-tree -mu HEAD', git_commands)
+
+    @skipIf(is_windows(), 'Skipping test for cloning repo from master on Windows')
+    def test_clone_uses_mirror_as_reference_when_git_mirror_cache_is_enabled(self):
+        Configuration['git_mirror_cache_size_gb'] = 1.0
+        Configuration['git_mirror_directory'] = '/mirror-directory'
+        Configuration['repo_directory'] = '/repo-directory'
+        mock_update_mirror = self.patch('app.project_type.git.GitMirrorCache.update_mirror')
+        mock_register_clone = self.patch('app.project_type.git.GitMirrorCache.register_clone')
+        mock_popen = self._patch_popen({'git rev-parse$': _FakePopenResult(return_code=1)})
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name')
+        git.fetch_project()
+
+        mirror_directory = '/mirrordirectory/originaluserspecifiedurl.test/repopath/reponame'
+        repo_directory = '/repodirectory/originaluserspecifiedurl.test/repopath/reponame'
+        mock_update_mirror.assert_called_once_with(ANY, mirror_directory, git._url, 'master', '', ANY)
+        git_clone_call = call(AnyStringMatching('git clone +--reference {} '.format(mirror_directory)),
+                              start_new_session=ANY, stdout=ANY, stderr=ANY, cwd=ANY, shell=ANY)
+        self.assertIn(git_clone_call, mock_popen.call_args_list)
+        mock_register_clone.assert_called_once_with(ANY, mirror_directory, repo_directory)
+
+    @genty_dataset(
+        peer_has_commit=(0, False),
+        peer_fails=(1, True),
+    )
+    def test_fetch_project_fetches_from_peer_slave_and_falls_back_to_remote_if_that_fails(
+            self, peer_fetch_return_code, expect_remote_fetch):
+        Configuration['repo_directory'] = '/repo-directory'
+        mock_popen = self._patch_popen({'git fetch .*ssh://peer-slave.test/': _FakePopenResult(peer_fetch_return_code)})
+
+        git = Git(url='ssh://master.test/repo-path/repo-name', branch='refs/clusterrunner/abc123',
+                  peer_host='peer-slave.test')
+        git.fetch_project()
+
+        peer_fetch_call = call(
+            AnyStringMatching('git fetch +--update-head-ok ssh://peer-slave.test/repodirectory/master.test/repopath/'
+                              'reponame refs/clusterrunner/abc123'),
+            start_new_session=ANY, stdout=ANY, stderr=ANY, cwd=ANY, shell=ANY)
+        remote_fetch_call = call(AnyStringMatching('git fetch +--update-head-ok origin refs/clusterrunner/abc123'),
+                                 start_new_session=ANY, stdout=ANY, stderr=ANY, cwd=ANY, shell=ANY)
+        self.assertIn(peer_fetch_call, mock_popen.call_args_list)
+        if expect_remote_fetch:
+            self.assertIn(remote_fetch_call, mock_popen.call_args_list, 'If fetching from the peer slave fails, the '
+                                                                        'commit should be fetched from the remote.')
+        else:
+            self.assertNotIn(remote_fetch_call, mock_popen.call_args_list)
+
     def _patch_popen(self, command_to_result_map=None):
         """
         Mock out calls to Popen to inject fake results for specific command strings.
@@ -0,0 +1,61 @@
+from unittest.mock import ANY, Mock, call, mock_open
+
+from app.project_type.git_mirror_cache import GitMirrorCache
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestGitMirrorCache(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mock_isfile = self.patch('app.project_type.git_mirror_cache.os.path.isfile')
+        self.mock_isfile.return_value = True
+        self.mock_walk = self.patch('app.project_type.git_mirror_cache.os.walk')
+        self.mock_walk.return_value = []
+        self.patch('app.project_type.git_mirror_cache.fs.create_dir')
+        self.patch('app.project_type.git_mirror_cache.os.utime')
+        self.mock_rmtree = self.patch('app.project_type.git_mirror_cache.shutil.rmtree')
+        self.mock_execute_git_command = Mock(return_value='deadbee123\n')
+
+    def test_update_mirror_clones_mirror_only_if_it_does_not_exist_and_fetches_branch_into_it(self):
+        self.mock_isfile.return_value = False
+        cache = GitMirrorCache('/var/mirrors', max_size_gb=1.0)
+
+        cache.update_mirror('/var/mirrors/example.com/repo', 'ssh://example.com/repo.git', 'master',
+                            '--filter=blob:none', self.mock_execute_git_command)
+
+        git_commands = [git_call[1]['git_command'] for git_call in self.mock_execute_git_command.call_args_list]
+        self.assertEqual(git_commands, [
+            'clone --bare --filter=blob:none ssh://example.com/repo.git /var/mirrors/example.com/repo',
+            'fetch --filter=blob:none ssh://example.com/repo.git master',
+            'rev-parse FETCH_HEAD',
+            'update-ref refs/clusterrunner/deadbee123 deadbee123',
+        ])
+
+    def test_least_recently_used_mirrors_are_removed_when_mirrors_exceed_the_quota(self):
+        mirror_sizes = {'/var/mirrors/new': 600, '/var/mirrors/old': 600, '/var/mirrors/recent': 600}
+        last_used_times = {'/var/mirrors/new': 30.0, '/var/mirrors/old': 10.0, '/var/mirrors/recent': 20.0}
+        self.patch('app.project_type.git_mirror_cache.GitMirrorCache._mirror_paths').return_value = list(mirror_sizes)
+        self.patch('app.project_type.git_mirror_cache.GitMirrorCache._directory_size').side_effect = mirror_sizes.get
+        self.patch('app.project_type.git_mirror_cache.os.path.getmtime').side_effect = last_used_times.get
+        self.patch('app.project_type.git_mirror_cache.open', new=mock_open(read_data='/var/repos/old_clone\n'),
+                   create=True)
+        mock_remove = self.patch('app.project_type.git_mirror_cache.os.remove')
+        cache = GitMirrorCache('/var/mirrors', max_size_gb=1500 / 1024 ** 3)
+
+        cache.update_mirror('/var/mirrors/new', 'ssh://example.com/new.git', 'master', '',
+                            self.mock_execute_git_command)
+
+        self.mock_rmtree.assert_called_once_with('/var/mirrors/old')
+        self.assertIn(call(git_command='repack -a -d', error_msg=ANY, cwd='/var/repos/old_clone'),
+                      self.mock_execute_git_command.call_args_list)
+        mock_remove.assert_called_once_with('/var/repos/old_clone/.git/objects/info/alternates')
+
+    def test_mirrors_are_not_removed_while_they_are_within_the_quota(self):
+        self.patch('app.project_type.git_mirror_cache.GitMirrorCache._mirror_paths').return_value = ['/var/mirrors/a']
+        self.patch('app.project_type.git_mirror_cache.GitMirrorCache._directory_size').return_value = 600
+        cache = GitMirrorCache('/var/mirrors', max_size_gb=1.0)
+
+        cache.update_mirror('/var/mirrors/b', 'ssh://example.com/b.git', 'master', '', self.mock_execute_git_command)
+
+        self.assertFalse(self.mock_rmtree.called)
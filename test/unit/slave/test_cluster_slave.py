@@ -9,10 +9,9 @@ import requests
 import requests.models
 
 from app.project_type.project_type import SetupFailureError
-from app.slave.cluster_slave import ClusterSlave, SlaveState
-from app.util.exceptions import BadRequestError
+from app.slave.cluster_slave import ClusterSlave, SlaveState, _SlaveBuild
+from app.util.exceptions import BadRequestError, ItemNotFoundError
 from app.util.safe_thread import SafeThread
-from app.util.single_use_coin import SingleUseCoin
 from app.util.unhandled_exception_handler import UnhandledExceptionHandler
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
@@ -35,7 +34,8 @@ class TestClusterSlave(BaseUnitTestCase):
     )
     def test_start_working_on_subjob_called_with_incorrect_build_id_will_raise(self, slave_current_build_id):
         slave = self._create_cluster_slave()
-        slave._current_build_id = slave_current_build_id
+        if slave_current_build_id is not None:
+            slave._builds_by_id[slave_current_build_id] = _SlaveBuild(slave_current_build_id, MagicMock(), 0)
         incorrect_build_id = 300
 
         with self.assertRaises(BadRequestError, msg='Start subjob should raise error if incorrect build_id specified.'):
@@ -47,7 +47,8 @@ class TestClusterSlave(BaseUnitTestCase):
     )
     def test_teardown_called_with_incorrect_build_id_will_raise(self, slave_current_build_id):
         slave = self._create_cluster_slave()
-        slave._current_build_id = slave_current_build_id
+        if slave_current_build_id is not None:
+            slave._builds_by_id[slave_current_build_id] = _SlaveBuild(slave_current_build_id, MagicMock(), 0)
         incorrect_build_id = 300
 
         with self.assertRaises(BadRequestError, msg='Teardown should raise error if incorrect build_id specified.'):
@@ -91,12 +92,12 @@ class TestClusterSlave(BaseUnitTestCase):
 
         slave = self._create_cluster_slave(num_executors=3)
         slave.connect_to_master(self._FAKE_MASTER_URL)
-        slave._build_teardown_coin = SingleUseCoin()
+        slave._builds_by_id[123] = _SlaveBuild(123, MagicMock(), 0)
         self.trigger_graceful_app_shutdown()
 
         expected_disconnect_call = call.mock_network.put_with_digest(disconnect_api_url, request_params=ANY,
                                                                      secret=ANY, error_on_failure=ANY)
-        expected_kill_executor_call = call.mock_executor.kill()
+        expected_kill_executor_call = call.mock_executor.kill(123)
         self.assertEqual(1, parent_mock.method_calls.count(expected_disconnect_call),
                          'Graceful shutdown should cause the slave to make a disconnect call to the master.')
         self.assertEqual(3, parent_mock.method_calls.count(expected_kill_executor_call),
@@ -111,7 +112,8 @@ class TestClusterSlave(BaseUnitTestCase):
         # This test is successful if app shutdown does not raise a SystemExit exception.
 
     def test_shutting_down_after_running_a_build_does_not_raise_exception(self):
-        self.patch('app.slave.cluster_slave.util.create_project_type')
+        project_type_mock = self.patch('app.slave.cluster_slave.util.create_project_type').return_value
+        project_type_mock.cached_source.return_value = None
         self.patch('app.slave.cluster_slave.open', new=mock_open(read_data=''), create=True)
         slave = self._create_cluster_slave()
         expected_results_api_url = 'http://{}/v1/build/123/subjob/321/result'.format(self._FAKE_MASTER_URL)
@@ -171,6 +173,7 @@ class TestClusterSlave(BaseUnitTestCase):
         # This test uses setup_complete_event to detect when the async fetch_project() has executed.
         setup_complete_event = Event()
         project_type_mock.fetch_project.side_effect = self.no_args_side_effect(setup_complete_event.set)
+        project_type_mock.cached_source.return_value = None
         # This test uses teardown_event to cause a thread to block on the teardown_build() call.
         teardown_event = Event()
         project_type_mock.teardown_build = Mock()
@@ -200,22 +203,23 @@ class TestClusterSlave(BaseUnitTestCase):
         expected_slave_data_url = 'http://{}/v1/slave/1'.format(self._FAKE_MASTER_URL)
         slave = self._create_cluster_slave()
         slave.connect_to_master(self._FAKE_MASTER_URL)
-        slave._project_type = MagicMock()
+        build = _SlaveBuild(123, MagicMock(), 0)
+        build.project_type.cached_source.return_value = None
         if not is_setup_successful:
-            slave._project_type.fetch_project.side_effect = SetupFailureError
+            build.project_type.fetch_project.side_effect = SetupFailureError
 
-        slave._async_setup_build(executors=[], project_type_params={}, build_executor_start_index=0)
+        slave._async_setup_build(build=build, executors=[], project_type_params={})
 
         self.mock_network.put_with_digest.assert_called_once_with(
-            expected_slave_data_url, request_params={'slave': {'state': expected_slave_state}},
+            expected_slave_data_url, request_params={'slave': {'state': expected_slave_state, 'build_id': 123}},
             secret=ANY, error_on_failure=True)
 
     def test_async_setup_happy_path_invokes_correct_methods(self):
         slave = self._create_cluster_slave()
         slave.connect_to_master(self._FAKE_MASTER_URL)
         project_type_mock = self.patch('app.slave.cluster_slave.util.create_project_type').return_value
-        slave._project_type = project_type_mock
-        slave._async_setup_build([], {}, 0)
+        project_type_mock.cached_source.return_value = None
+        slave._async_setup_build(_SlaveBuild(123, project_type_mock, 0), [], {})
 
         project_type_mock.fetch_project.assert_called_once_with()
         self.assertTrue(project_type_mock.run_job_config_setup.called)
@@ -223,20 +227,82 @@ class TestClusterSlave(BaseUnitTestCase):
     def test_setup_build_sets_base_executor_index(self):
         slave = self._create_cluster_slave()
         slave.setup_build(build_id=123, project_type_params={'type': 'Fake'}, build_executor_start_index=8)
-        self.assertEqual(8, slave._base_executor_index, 'Build setup should set _base_executor_index')
+        self.assertEqual(8, slave._builds_by_id[123].base_executor_index,
+                         'Build setup should set the base executor index of the build')
+
+    def test_setup_build_does_not_require_executors_used_by_other_builds_to_be_idle(self):
+        self.patch('app.slave.cluster_slave.util.create_project_type')
+        self.patch('app.slave.cluster_slave.DispatchPool')
+        slave = self._create_cluster_slave(num_executors=2)
+        slave.setup_build(build_id=123, project_type_params={'type': 'Fake'}, build_executor_start_index=0)
+        slave._idle_executors.get()  # one executor is busy with a subjob for build 123
+
+        slave.setup_build(build_id=124, project_type_params={'type': 'Fake'}, build_executor_start_index=0)
+
+        self.assertEqual(slave.api_representation()['current_build_ids'], [123, 124])
+
+    def test_setup_build_raises_if_build_is_already_running_on_slave(self):
+        self.patch('app.slave.cluster_slave.util.create_project_type')
+        self.patch('app.slave.cluster_slave.DispatchPool')
+        slave = self._create_cluster_slave()
+        slave.setup_build(build_id=123, project_type_params={'type': 'Fake'}, build_executor_start_index=0)
+
+        with self.assertRaises(BadRequestError):
+            slave.setup_build(build_id=123, project_type_params={'type': 'Fake'}, build_executor_start_index=0)
 
     def test_execute_subjob_passes_base_executor_index_to_executor(self):
         slave = self._create_cluster_slave()
-        slave._base_executor_index = 12
         slave._master_api = Mock()
         executor = Mock()
         slave._idle_executors = Mock()
 
         with patch.object(builtins, 'open', mock_open(read_data='asdf')):
-            slave._execute_subjob(build_id=1, subjob_id=2, executor=executor, atomic_commands=[])
+            slave._execute_subjob(build=_SlaveBuild(1, Mock(), 12), subjob_id=2, executor=executor, atomic_commands=[])
 
         executor.execute_subjob.assert_called_with(1, 2, [], 12)
 
+    def test_start_working_on_subjob_does_not_wait_for_an_idle_executor(self):
+        self.patch('app.slave.cluster_slave.util.create_project_type')
+        self.patch('app.slave.cluster_slave.DispatchPool')
+        slave = self._create_cluster_slave(num_executors=1)
+        slave.setup_build(build_id=123, project_type_params={'type': 'Fake'}, build_executor_start_index=0)
+        slave.start_working_on_subjob(build_id=123, subjob_id=0, atomic_commands=[])
+
+        response = slave.start_working_on_subjob(build_id=123, subjob_id=1, atomic_commands=[])
+
+        self.assertIsNone(response['executor_id'], 'The subjob should be queued until an executor becomes idle.')
+        _, _, executor, _ = slave._subjob_pool.submit.call_args[0][1:]
+        self.assertIsNone(executor)
+
+    def test_heartbeat_sends_executor_state_to_master(self):
+        slave = self._create_cluster_slave(num_executors=2)
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+        mock_network = self.patch_object(slave, '_network')
+
+        slave._send_heartbeat()
+
+        heartbeat_url, heartbeat_params, _ = mock_network.post_with_digest.call_args[0]
+        self.assertTrue(heartbeat_url.endswith('/slave/{}/heartbeat'.format(slave._slave_id)))
+        self.assertEqual(len(heartbeat_params['executors']), 2)
+
+    def test_heartbeat_reports_the_sources_fetched_by_builds(self):
+        slave = self._create_cluster_slave()
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+        mock_network = self.patch_object(slave, '_network')
+        for commit_hash in ('abc123', 'def456', 'abc123'):
+            slave._record_cached_source(Mock(cached_source=Mock(return_value=('ssh://master/repo', commit_hash))))
+
+        slave._send_heartbeat()
+
+        _, heartbeat_params, _ = mock_network.post_with_digest.call_args[0]
+        self.assertEqual(heartbeat_params['cached_sources'], {'ssh://master/repo': ['def456', 'abc123']})
+
+    def test_release_unstarted_atoms_raises_if_subjob_is_not_executing_on_slave(self):
+        slave = self._create_cluster_slave()
+
+        with self.assertRaises(ItemNotFoundError):
+            slave.release_unstarted_atoms(build_id=1, subjob_id=2)
+
     def _create_cluster_slave(self, **kwargs):
         """
         Create a ClusterSlave for testing.
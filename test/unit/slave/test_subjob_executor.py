@@ -14,33 +14,55 @@ class TestSubjobExecutor(BaseUnitTestCase):
         util.create_project_type = Mock(return_value=Mock())
         executor = SubjobExecutor(1)
 
-        executor.configure_project_type(project_type_params)
+        executor.configure_project_type(project_type_params, build_id=1)
 
         util.create_project_type.assert_called_with(project_type_params)
-        executor._project_type.setup_executor.assert_called_with()
+        executor._project_types_by_build_id[1].setup_executor.assert_called_with()
 
     def test_configure_project_type_with_existing_project_type_calls_teardown(self):
         executor = SubjobExecutor(1)
-        executor._project_type = Mock()
+        existing_project_type = Mock()
+        executor._project_types_by_build_id[1] = existing_project_type
         self.patch('app.slave.subjob_executor.util')
 
-        executor.configure_project_type({})
+        executor.configure_project_type({}, build_id=1)
 
-        executor._project_type.teardown_executor.assert_called_once()
+        self.assertEqual(existing_project_type.teardown_executor.call_count, 1)
+
+    def test_configure_project_type_for_another_build_keeps_existing_project_type(self):
+        executor = SubjobExecutor(1)
+        existing_project_type = Mock()
+        executor._project_types_by_build_id[1] = existing_project_type
+        self.patch('app.slave.subjob_executor.util')
+
+        executor.configure_project_type({}, build_id=2)
+
+        self.assertFalse(existing_project_type.teardown_executor.called)
+        self.assertIs(executor._project_types_by_build_id[1], existing_project_type)
+
+    def test_kill_only_kills_subprocesses_of_the_specified_build(self):
+        executor = SubjobExecutor(1)
+        executor._project_types_by_build_id = {1: Mock(), 2: Mock()}
+
+        executor.kill(build_id=1)
+
+        self.assertTrue(executor._project_types_by_build_id[1].kill_subprocesses.called)
+        self.assertFalse(executor._project_types_by_build_id[2].kill_subprocesses.called)
 
     def test_run_job_config_setup_calls_project_types_run_job_config_setup(self):
         executor = SubjobExecutor(1)
-        executor._project_type = Mock()
+        executor._project_types_by_build_id[1] = Mock()
 
-        executor.run_job_config_setup()
+        executor.run_job_config_setup(build_id=1)
 
-        executor._project_type.run_job_config_setup.assert_called_with()
+        executor._project_types_by_build_id[1].run_job_config_setup.assert_called_with()
 
     def test_execute_subjob_passes_correct_build_executor_index_to_execute_command_in_project(self):
         Configuration['artifact_directory'] = expanduser('~')
         executor = SubjobExecutor(1)
-        executor._project_type = Mock()
-        executor._project_type.execute_command_in_project = Mock(return_value=(1, 2))
+        project_type = Mock()
+        project_type.execute_command_in_project = Mock(return_value=(1, 2))
+        executor._project_types_by_build_id[1] = project_type
         self.patch('app.slave.subjob_executor.fs_util')
         self.patch('app.slave.subjob_executor.shutil')
         output_file_mock = self.patch('app.slave.subjob_executor.open', new=mock_open(read_data=''), create=True).return_value
@@ -60,5 +82,34 @@ class TestSubjobExecutor(BaseUnitTestCase):
         executor.execute_subjob(build_id=1, subjob_id=2, atomic_commands=atomic_commands,
                                 base_executor_index=6)
 
-        executor._project_type.execute_command_in_project.assert_called_with('command', expected_env_vars,
-                                                                             output_file=output_file_mock)
+        project_type.execute_command_in_project.assert_called_with('command', expected_env_vars,
+                                                                   output_file=output_file_mock)
+
+    def test_execute_subjob_stops_after_the_current_atom_when_unstarted_atoms_are_released(self):
+        Configuration['artifact_directory'] = expanduser('~')
+        executor = SubjobExecutor(1)
+        project_type = Mock()
+        executor._project_types_by_build_id[1] = project_type
+        self.patch('app.slave.subjob_executor.fs_util')
+        self.patch('app.slave.subjob_executor.shutil')
+        self.patch('app.slave.subjob_executor.open', new=mock_open(read_data=''), create=True)
+        self.patch('app.slave.subjob_executor.os')
+        num_atoms_kept = []
+
+        def execute_command_in_project(*args, **kwargs):
+            if not num_atoms_kept:
+                num_atoms_kept.append(executor.release_unstarted_atoms(build_id=1, subjob_id=2))
+            return 0, 1
+        project_type.execute_command_in_project = Mock(side_effect=execute_command_in_project)
+
+        executor.execute_subjob(build_id=1, subjob_id=2, atomic_commands=['command 0', 'command 1', 'command 2'],
+                                base_executor_index=0)
+
+        self.assertEqual(num_atoms_kept, [1])
+        self.assertEqual(project_type.execute_command_in_project.call_count, 1,
+                         'Atoms that were released should not be executed.')
+
+    def test_release_unstarted_atoms_returns_none_when_not_executing_the_subjob(self):
+        executor = SubjobExecutor(1)
+
+        self.assertIsNone(executor.release_unstarted_atoms(build_id=1, subjob_id=2))
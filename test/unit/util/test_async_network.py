@@ -0,0 +1,100 @@
+from unittest.mock import Mock
+
+import requests
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPResponse
+from tornado.ioloop import IOLoop
+
+from app.util.async_network import AsyncNetwork
+from app.util.network import RequestFailedError
+from app.util.secret import Secret
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestAsyncNetwork(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._io_loop = IOLoop()
+        self.addCleanup(self._io_loop.close)
+        self._network = AsyncNetwork()
+        self._mock_http_client = Mock()
+        self.patch_object(self._network, '_get_http_client').return_value = self._mock_http_client
+
+    def test_post_with_digest_sends_encoded_body_with_digest_header(self):
+        self._mock_http_client.fetch.side_effect = lambda request: self._resolved_future(self._response(200))
+
+        response = self._run(lambda: self._network.post_with_digest('http://slave:43001/v1/build/1', {'a': 1}, 'sec'))
+
+        request = self._mock_http_client.fetch.call_args[0][0]
+        self.assertEqual(request.method, 'POST')
+        self.assertEqual(request.body, b'{"a": 1}')
+        self.assertEqual(request.headers[Secret.DIGEST_HEADER_KEY], Secret.header('{"a": 1}', 'sec')[
+            Secret.DIGEST_HEADER_KEY])
+        self.assertTrue(response.ok)
+
+    def test_response_that_is_not_in_the_200s_is_returned_unless_error_on_failure_is_set(self):
+        self._mock_http_client.fetch.side_effect = lambda request: self._failed_future(
+            HTTPError(404, response=self._response(404)))
+
+        response = self._run(lambda: self._network.get('http://slave:43001/v1'))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.ok)
+
+        with self.assertRaises(RequestFailedError):
+            self._run(lambda: self._network.put('http://slave:43001/v1', {}, error_on_failure=True))
+
+    def test_request_that_times_out_raises_connection_error(self):
+        self._mock_http_client.fetch.side_effect = lambda request: self._failed_future(HTTPError(599, 'Timeout'))
+
+        with self.assertRaises(requests.ConnectionError):
+            self._run(lambda: self._network.get('http://slave:43001/v1', timeout=2.5))
+
+        request = self._mock_http_client.fetch.call_args[0][0]
+        self.assertEqual(request.connect_timeout, 2.5)
+        self.assertEqual(request.request_timeout, 2.5)
+
+    def test_post_retries_on_connection_errors_and_then_raises_connection_error(self):
+        self.patch('app.util.async_network._sleep').side_effect = lambda seconds: self._resolved_future(None)
+        self._mock_http_client.fetch.side_effect = lambda request: self._failed_future(ConnectionRefusedError())
+
+        with self.assertRaises(requests.ConnectionError):
+            self._run(lambda: self._network.post('http://slave:43001/v1', {}))
+
+        self.assertGreater(self._mock_http_client.fetch.call_count, 1, 'The request should have been retried.')
+
+    def test_requests_to_a_host_beyond_the_per_host_limit_wait_for_a_slot(self):
+        network = AsyncNetwork(max_concurrent_requests_per_host=1)
+        self.patch_object(network, '_get_http_client').return_value = self._mock_http_client
+        pending_fetches = []
+
+        def fetch(request):
+            pending_fetches.append(Future())
+            return pending_fetches[-1]
+        self._mock_http_client.fetch.side_effect = fetch
+
+        def send_two_requests_to_the_same_host():
+            first_response = network.get('http://slave:43001/v1/a')
+            second_response = network.get('http://slave:43001/v1/b')
+            self.assertEqual(len(pending_fetches), 1, 'The second request should wait for the first to finish.')
+            pending_fetches[0].set_result(self._response(200))
+            return first_response
+
+        self._run(send_two_requests_to_the_same_host)
+        self.assertEqual(len(pending_fetches), 2)
+
+    def _run(self, coroutine_function):
+        return self._io_loop.run_sync(coroutine_function)
+
+    def _response(self, code):
+        return HTTPResponse(Mock(), code, buffer=None)
+
+    def _resolved_future(self, result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _failed_future(self, exception):
+        future = Future()
+        future.set_exception(exception)
+        return future
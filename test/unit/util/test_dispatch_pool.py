@@ -0,0 +1,57 @@
+from threading import Event, Semaphore
+
+from app.util.dispatch_pool import DispatchPool
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestDispatchPool(BaseUnitTestCase):
+
+    def test_tasks_with_the_same_key_run_one_at_a_time_in_submission_order(self):
+        pool = DispatchPool(max_workers=4)
+        first_task_may_finish = Event()
+        all_tasks_done = Event()
+        task_order = []
+
+        def task(task_id):
+            if task_id == 0:
+                first_task_may_finish.wait(timeout=5)
+            task_order.append(task_id)
+            if len(task_order) == 3:
+                all_tasks_done.set()
+
+        for task_id in range(3):
+            pool.submit(task, task_id, key='slave-1')
+        self.assertEqual(task_order, [], 'Later tasks with the same key should wait for the first one to finish.')
+        first_task_may_finish.set()
+
+        self.assertTrue(all_tasks_done.wait(timeout=5))
+        self.assertEqual(task_order, [0, 1, 2])
+
+    def test_tasks_with_different_keys_run_concurrently(self):
+        pool = DispatchPool(max_workers=2)
+        first_task_may_finish = Event()
+        second_task_done = Event()
+
+        pool.submit(first_task_may_finish.wait, 5, key='slave-1')
+        pool.submit(second_task_done.set, key='slave-2')
+
+        self.assertTrue(second_task_done.wait(timeout=5), 'A task for another key should not wait on the first task.')
+        first_task_may_finish.set()
+
+    def test_pool_does_not_start_more_than_max_workers(self):
+        pool = DispatchPool(max_workers=2)
+        tasks_started = Semaphore(0)
+        tasks_may_finish = Event()
+
+        def task():
+            tasks_started.release()
+            tasks_may_finish.wait(timeout=5)
+
+        for _ in range(5):
+            pool.submit(task)
+        for _ in range(2):
+            self.assertTrue(tasks_started.acquire(timeout=5))
+
+        self.assertEqual(pool.api_representation()['num_workers'], 2)
+        self.assertEqual(pool.queue_depth(), 3, 'Tasks beyond the number of workers should wait in the queue.')
+        tasks_may_finish.set()